@@ -0,0 +1,139 @@
+import argparse
+import glob
+import json
+import multiprocessing as mp
+import platform
+import re
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# Weird Python hackery to get the last import to work
+import sys
+import os
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPT_DIR))
+from src.utils import load_experiment
+from src.vec_env import make_env
+
+# Key identifying a benchmark case, used to match results against a baseline
+def case_key(result):
+    return (result['set'], result['backend'], result['num_envs'], result['actions'])
+
+# Benchmarks one experiment set with one backend and number of environments. Runs in a fresh process,
+# so that the peak RSS belongs to this case only
+def run_case(set_path, backend, num_envs, action_streams, steps, resets, seed):
+    config = load_experiment(set_path)
+
+    start = time.perf_counter()
+    vec_env = make_env(config, num_envs, seed, backend)
+    construction_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(resets):
+        vec_env.reset()
+    reset_latency = (time.perf_counter() - start) / resets
+
+    results = []
+    rng = np.random.default_rng(seed)
+    for stream in action_streams:
+        # Random actions, or every agent standing still, which keeps episodes running until truncation
+        if stream == 'random':
+            actions = rng.integers(0, vec_env.action_space.n, size=(steps, num_envs))
+        else:
+            actions = np.full((steps, num_envs), vec_env.action_space.n - 1)
+        vec_env.reset()
+        start = time.perf_counter()
+        for action in actions:
+            vec_env.step(action)
+        elapsed = time.perf_counter() - start
+        results.append({
+            'set': int(re.search(r'set(\d+)', set_path).group(1)),
+            'backend': backend,
+            'num_envs': num_envs,
+            'actions': stream,
+            'steps_per_sec': steps * num_envs / elapsed,
+            'reset_latency_ms': reset_latency * 1e3,
+            'construction_time_ms': construction_time * 1e3,
+        })
+    vec_env.close()
+
+    # ru_maxrss is in kilobytes on Linux, worker processes are counted as children once they have exited
+    peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    for result in results:
+        result['peak_rss_mb'] = peak_rss / 1024
+    return results
+
+# Compares results with a baseline, returning the cases where steps/sec dropped by more than the tolerance
+def compare(results, baseline, tolerance):
+    baseline_results = {case_key(result): result for result in baseline['results']}
+    regressions = []
+    print(f"\n{'set':>4} {'backend':>8} {'envs':>5} {'actions':>8} {'steps/s':>12} {'baseline':>12} {'change':>8}")
+    for result in results:
+        base = baseline_results.get(case_key(result))
+        if base is None:
+            continue
+        change = result['steps_per_sec'] / base['steps_per_sec'] - 1
+        print(f"{result['set']:>4} {result['backend']:>8} {result['num_envs']:>5} {result['actions']:>8} {result['steps_per_sec']:>12.0f} {base['steps_per_sec']:>12.0f} {change:>+8.1%}")
+        if change < -tolerance:
+            regressions.append(result)
+    return regressions
+
+if __name__ == '__main__':
+
+    # Parse arguments
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--sets', type=int, nargs='+', default=None, help='The experiment sets to benchmark, defaults to every set in the experiments directory')
+    parser.add_argument('--num_envs', type=int, nargs='+', default=[1, 4, 64], help='The numbers of parallel environments to benchmark')
+    parser.add_argument('--backends', type=str, nargs='+', choices=['dummy', 'subproc', 'shm', 'batched'], default=['dummy', 'shm', 'batched'], help='The vectorized environments to benchmark')
+    parser.add_argument('--actions', type=str, nargs='+', choices=['random', 'fixed'], default=['random', 'fixed'], help='The action streams to benchmark')
+    parser.add_argument('--steps', type=int, default=2000, help='The number of vectorized steps per case')
+    parser.add_argument('--resets', type=int, default=20, help='The number of resets used to measure reset latency')
+    parser.add_argument('--seed', type=int, default=0, help='The random seed to use')
+    parser.add_argument('--output', type=str, default='benchmarks/results.json', help='The JSON file to write the results to')
+    parser.add_argument('--baseline', type=str, default=None, help='A previous results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='The allowed relative drop in steps/sec before a case counts as a regression')
+
+    args = parser.parse_args()
+    print(args)
+
+    if args.sets is None:
+        set_paths = sorted(glob.glob('experiments/set*.yaml'), key=lambda path: int(re.search(r'set(\d+)', path).group(1)))
+    else:
+        set_paths = [f'experiments/set{s}.yaml' for s in args.sets]
+
+    # Run every case in its own process
+    results = []
+    context = mp.get_context('spawn')
+    for set_path in set_paths:
+        for backend in args.backends:
+            for num_envs in args.num_envs:
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    case_results = executor.submit(run_case, set_path, backend, num_envs, args.actions, args.steps, args.resets, args.seed).result()
+                for result in case_results:
+                    print(f"{set_path} {backend:>8} envs={num_envs:<4} {result['actions']:>7}: {result['steps_per_sec']:>10.0f} steps/s, "
+                          f"reset {result['reset_latency_ms']:.3f} ms, construction {result['construction_time_ms']:.1f} ms, peak RSS {result['peak_rss_mb']:.0f} MB")
+                results.extend(case_results)
+
+    # Save results
+    output = {
+        'machine': {'platform': platform.platform(), 'python': platform.python_version(), 'numpy': np.__version__, 'cpus': os.cpu_count()},
+        'args': vars(args),
+        'results': results,
+    }
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as output_file:
+        json.dump(output, output_file, indent=2)
+    print(f'Results saved to {args.output}')
+
+    # Compare with the baseline
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f'{len(regressions)} cases are more than {args.tolerance:.0%} slower than the baseline')
+            raise SystemExit(1)
+        print('No regressions found')
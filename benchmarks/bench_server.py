@@ -0,0 +1,67 @@
+import argparse
+import multiprocessing as mp
+import time
+import numpy as np
+
+# Weird Python hackery to get the last import to work
+import sys
+import os
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPT_DIR))
+from src.inference_server import InferenceClient, read_authkey
+
+# Sends requests of random observations to the server from one client, like a controller stepping num_envs
+# environments. Runs in its own process and returns the round trip times of its requests
+def run_client(address, authkey, model, num_envs, requests, seed, start_event):
+    client = InferenceClient(address, model, authkey)
+    nvec = np.array(client.models()[model])
+    rng = np.random.default_rng(seed)
+    observations = rng.integers(0, nvec, size=(requests, num_envs, len(nvec)))
+    episode_start = np.ones(num_envs, dtype=bool)
+    latencies = np.empty(requests)
+    start_event.wait()
+    for i in range(requests):
+        start = time.perf_counter()
+        client.predict(observations[i], episode_start=episode_start, deterministic=True)
+        latencies[i] = time.perf_counter() - start
+        episode_start[:] = False
+    client.close()
+    return latencies
+
+if __name__ == '__main__':
+
+    # Parse arguments
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--address', type=str, default='inference.sock', help='The address of the running inference server')
+    parser.add_argument('--authkey', type=str, default=None, help='The key of the inference server, if it has one')
+    parser.add_argument('--authkey_file', type=str, default=None, help='A file holding the key of the inference server, e.g. the one serve.py generates')
+    parser.add_argument('--model', type=str, required=True, help='The name of the served model to request actions from')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 4, 16], help='The numbers of concurrent clients to benchmark')
+    parser.add_argument('--num_envs', type=int, default=1, help='The number of observations per request')
+    parser.add_argument('--requests', type=int, default=500, help='The number of requests per client')
+    parser.add_argument('--seed', type=int, default=0, help='The random seed to use')
+
+    args = parser.parse_args()
+    print(args)
+    authkey = read_authkey(args.authkey, args.authkey_file)
+
+    # Every client is a process, so that they send requests concurrently
+    context = mp.get_context('spawn')
+    manager = context.Manager()
+    for num_clients in args.clients:
+        start_event = manager.Event()
+        with context.Pool(num_clients) as pool:
+            results = [pool.apply_async(run_client, (args.address, authkey, args.model, args.num_envs, args.requests, args.seed + i, start_event)) for i in range(num_clients)]
+            time.sleep(1) # Clients connect and draw their observations
+            start = time.perf_counter()
+            start_event.set()
+            latencies = np.concatenate([result.get() for result in results])
+            elapsed = time.perf_counter() - start
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) * 1e3
+        print(f'{num_clients:>3} clients: {len(latencies) * args.num_envs / elapsed:.0f} observations/s, round trip p50 {p50:.2f} ms, p90 {p90:.2f} ms, p99 {p99:.2f} ms')
+
+    client = InferenceClient(args.address, args.model, authkey)
+    summary = client.metrics()[args.model]
+    print(f"Server: {summary['requests']} requests in {summary['batches']} batches of {summary['mean_batch']:.1f} observations on average")
+    client.close()
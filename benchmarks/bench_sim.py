@@ -0,0 +1,34 @@
+import argparse
+
+# Weird Python hackery to get the last import to work
+import sys
+import os
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPT_DIR))
+from src.utils import load_experiment
+from tests.fake_sim import run
+
+if __name__ == '__main__':
+
+    # Parse arguments
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--set', type=int, default=1, help='The experiment set to simulate')
+    parser.add_argument('--steps', type=int, default=500, help='The maximum number of steps to simulate')
+    parser.add_argument('--seed', type=int, default=0, help='The random seed to use')
+
+    args = parser.parse_args()
+    print(args)
+
+    env_config = load_experiment(f'experiments/set{args.set}.yaml')
+    runs = {
+        'batched': run(env_config, args.steps, args.seed, scripts=True, stepping=False),
+        'single calls': run(env_config, args.steps, args.seed, scripts=False, stepping=False),
+        'batched, stepping': run(env_config, args.steps, args.seed, scripts=True, stepping=True),
+    }
+    for name, sim in runs.items():
+        total = sum(sim.calls.values())
+        per_step = (total - sim.setup_calls) / sim.steps
+        print(f'{name:>18}: {sim.steps} steps, {sim.setup_calls} setup round trips, {per_step:.2f} round trips per step, {total} in total')
+        print(f"{'':>18}  {dict(sim.calls)}")
+
@@ -0,0 +1,32 @@
+import argparse
+import glob
+import os
+import re
+import time
+from src.field_pool import build_field_pool, FieldPool
+
+if __name__ == '__main__':
+
+    # Parse arguments
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('experiments', type=str, nargs='+', help='The experiment files or directories of experiment files to compile into the pool')
+    parser.add_argument('--output', type=str, required=True, help='The directory to save the field pool in')
+
+    args = parser.parse_args()
+    print(args)
+
+    # Collect the experiment files, directories are sorted by set number
+    set_number = lambda path: int(re.search(r'set(\d+)', os.path.basename(path)).group(1)) if re.search(r'set(\d+)', os.path.basename(path)) else 0
+    paths = []
+    for experiment in args.experiments:
+        if os.path.isdir(experiment):
+            paths += sorted(glob.glob(os.path.join(experiment, '*.yaml')), key=lambda path: (set_number(path), path))
+        else:
+            paths.append(experiment)
+
+    start = time.perf_counter()
+    build_field_pool(paths, args.output)
+    pool = FieldPool(args.output)
+    size = sum(os.path.getsize(os.path.join(args.output, name)) for name in os.listdir(args.output))
+    print(f'Compiled {len(pool)} fields with {pool.num_agents} agents and at most {pool.max_weeds} weeds into {args.output} ({size / 2**20:.1f} MB) in {time.perf_counter() - start:.1f}s')
@@ -0,0 +1,143 @@
+import argparse
+import glob
+import hashlib
+import multiprocessing as mp
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from src.utils import load_experiment, model_modes
+
+# Columns identifying an evaluation in the results table
+KEY_COLUMNS = ['model_hash', 'set', 'seed', 'mode']
+
+# Hash of a model file, so that retrained models are evaluated again
+def file_hash(path):
+    with open(path, 'rb') as model_file:
+        return hashlib.sha256(model_file.read()).hexdigest()
+
+# Whether two spaces are equal. MultiDiscrete spaces of different lengths cannot be compared with ==
+def spaces_match(space, other):
+    return space.shape == other.shape and space == other
+
+# Evaluates one model on a list of (set, seed, mode) tasks. Runs in a worker process, which loads the model once
+# and steps all episodes of a task in a vectorized environment. Tasks on sets whose spaces do not fit the model get a
+# skipped row, so that they are not checked again
+def evaluate_model(model_path, model_hash, algorithm, tasks, episodes, num_envs, vec_env, device):
+    import torch
+    from stable_baselines3.common.evaluation import evaluate_policy
+    from src.utils import get_algorithm
+    from src.vec_env import make_env
+    torch.set_num_threads(1) # One core per worker
+
+    model = get_algorithm(algorithm).load(model_path, device=device)
+    obs_mode, action_mode = model_modes(model)
+    rows, skipped = [], set()
+    for experiment_set, seed, mode in tasks:
+        row = {'model_hash': model_hash, 'model': model_path, 'algorithm': algorithm, 'set': experiment_set, 'seed': seed, 'mode': mode}
+        if experiment_set not in skipped:
+            env_config = load_experiment(f'experiments/set{experiment_set}.yaml')
+            env = make_env(env_config, min(num_envs, episodes), seed, vec_env, obs_mode, action_mode)
+            if not (spaces_match(env.observation_space, model.observation_space) and spaces_match(env.action_space, model.action_space)):
+                skipped.add(experiment_set) # Fields with another number of agents or weeds
+                env.close()
+        if experiment_set in skipped:
+            rows.append({**row, 'skipped': True, 'evaluated_on': datetime.now().isoformat(timespec='seconds')})
+            continue
+
+        model.set_random_seed(seed)
+        start = time.perf_counter()
+        rewards, lengths = evaluate_policy(model, env, n_eval_episodes=episodes, deterministic=mode == 'deterministic', return_episode_rewards=True)
+        env.close()
+        rows.append({
+            **row,
+            'skipped': False,
+            'episodes': len(rewards),
+            'mean_reward': np.mean(rewards),
+            'std_reward': np.std(rewards),
+            'min_reward': np.min(rewards),
+            'max_reward': np.max(rewards),
+            'mean_length': np.mean(lengths),
+            'eval_time': time.perf_counter() - start,
+            'evaluated_on': datetime.now().isoformat(timespec='seconds'),
+        })
+    return model_path, rows, sorted(skipped)
+
+# Writes the results table through a temporary file, so that an interrupted run never leaves a broken table
+def save_results(results, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    results.to_csv(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+
+if __name__ == '__main__':
+
+    # Parse arguments
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--models_dir', type=str, nargs='+', default=['trained_models'], help='The directories to look for models in, e.g. trained_models, tuned_models or transfer_models')
+    parser.add_argument('--algorithms', type=str, nargs='+', choices=['A2C', 'PPO', 'TRPO', 'DQN', 'ARS', 'RecurrentPPO'], default=None, help='The DRL algorithms to evaluate, defaults to every model found')
+    parser.add_argument('--sets', type=int, nargs='+', default=None, help='The experiment sets to evaluate on, defaults to every set in the experiments directory')
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0], help='The random seeds to evaluate with')
+    parser.add_argument('--modes', type=str, nargs='+', choices=['deterministic', 'stochastic'], default=['deterministic', 'stochastic'], help='Whether actions are picked deterministically or sampled from the policy')
+    parser.add_argument('--episodes', type=int, default=10, help='The number of episodes for each model, set, seed and mode')
+    parser.add_argument('--num_envs', type=int, default=10, help='The number of parallel environments the episodes are run in')
+    parser.add_argument('--vec_env', type=str, choices=['dummy', 'subproc', 'shm', 'batched'], default='batched', help='The vectorized environment to use')
+    parser.add_argument('--workers', type=int, default=None, help='The number of worker processes, defaults to the number of cores')
+    parser.add_argument('--output', type=str, default='evaluations/results.csv', help='The results table, evaluations already in it are skipped')
+    parser.add_argument('--device', type=str, choices=['cpu', 'cuda'], default='cpu', help='The device to run the models on')
+
+    args = parser.parse_args()
+    print(args)
+
+    if args.sets is None:
+        args.sets = sorted(int(re.search(r'set(\d+)', path).group(1)) for path in glob.glob('experiments/set*.yaml'))
+
+    # Load the results of previous runs
+    if os.path.exists(args.output):
+        results = pd.read_csv(args.output)
+    else:
+        results = pd.DataFrame(columns=KEY_COLUMNS)
+    if 'skipped' not in results:
+        results['skipped'] = False # Tables written before skipped sets were recorded
+    done = set(zip(results['model_hash'], results['set'], results['seed'], results['mode']))
+
+    # Find the models and the evaluations they are missing. Models are named by their path, as directories can hold
+    # models with the same file name
+    jobs = []
+    current_models = {}
+    for models_dir in args.models_dir:
+        for model_path in sorted(glob.glob(os.path.join(os.path.normpath(models_dir), '*.zip'))):
+            algorithm = os.path.basename(model_path).split('_')[0]
+            if args.algorithms is not None and algorithm not in args.algorithms:
+                continue
+            model_hash = file_hash(model_path)
+            if model_hash in current_models:
+                continue # A copy of a model that is already evaluated
+            current_models[model_hash] = model_path
+            tasks = [(s, seed, mode) for s in args.sets for seed in args.seeds for mode in args.modes if (model_hash, s, seed, mode) not in done]
+            if tasks:
+                jobs.append((model_path, model_hash, algorithm, tasks))
+    print(f'{len(jobs)} models to evaluate, {len(current_models) - len(jobs)} already evaluated')
+
+    # Evaluate the models in parallel, saving the table as each model finishes
+    context = mp.get_context('spawn') # Forking a process that has loaded torch is not safe
+    with ProcessPoolExecutor(max_workers=args.workers or os.cpu_count(), mp_context=context) as executor:
+        futures = [executor.submit(evaluate_model, *job, args.episodes, args.num_envs, args.vec_env, args.device) for job in jobs]
+        for future in as_completed(futures):
+            model_path, rows, skipped = future.result()
+            print(f"Evaluated {model_path} on {sum(not row['skipped'] for row in rows)} tasks" + (f', skipped sets {skipped} with other spaces' if skipped else ''))
+            if rows:
+                results = pd.concat([results, pd.DataFrame(rows)], ignore_index=True) if len(results) else pd.DataFrame(rows)
+                results = results.drop_duplicates(subset=KEY_COLUMNS, keep='last')
+                save_results(results, args.output)
+
+    # Summary of the current models, under their current paths
+    current = results[results['model_hash'].isin(current_models) & results['set'].isin(args.sets) & (results['skipped'] != True)]
+    current = current.assign(model=current['model_hash'].map(current_models))
+    if len(current):
+        summary = current.pivot_table(index=['model', 'mode'], columns='set', values='mean_reward', aggfunc='mean')
+        pd.set_option('display.width', 200)
+        print(summary.round(0))
@@ -0,0 +1,57 @@
+import argparse
+import os
+import time
+import numpy as np
+from src.numpy_policy import NumpyPolicy, export_policy
+from src.utils import load_model, parse_bool
+
+# Compares the deterministic actions of the exported policy with those of the model on random observations. Recurrent
+# policies are run on sequences, with episodes starting at random steps, and their LSTM states are compared too.
+# Returns the number of mismatched actions
+def verify(model, policy, num_envs, steps, seed):
+    rng = np.random.default_rng(seed)
+    nvec = model.observation_space.nvec
+    recurrent = policy.lstm_layers > 0
+    model_state, policy_state = None, None
+    mismatches, max_state_error = 0, 0.0
+    for step in range(steps):
+        obs = rng.integers(0, nvec, size=(num_envs, len(nvec)))
+        episode_start = rng.random(num_envs) < 0.05 if step else np.ones(num_envs, dtype=bool)
+        model_actions, model_state = model.predict(obs, state=model_state, episode_start=episode_start, deterministic=True)
+        policy_actions, policy_state = policy.predict(obs, state=policy_state, episode_start=episode_start, deterministic=True)
+        mismatches += int(np.any(model_actions.reshape(num_envs, -1) != policy_actions.reshape(num_envs, -1), axis=1).sum())
+        if recurrent:
+            max_state_error = max(max_state_error, *(float(np.abs(a - b).max()) for a, b in zip(model_state, policy_state)))
+    total = num_envs * steps
+    print(f'Verified {total} observations: {mismatches} mismatched actions' + (f', max LSTM state error {max_state_error:.2e}' if recurrent else ''))
+    return mismatches
+
+if __name__ == '__main__':
+
+    # Parse arguments
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--path', type=str, default='trained_models', help='The directory to look for trained models in')
+    parser.add_argument('--algorithm', type=str, required=True, choices=['A2C', 'PPO', 'TRPO', 'DQN', 'ARS', 'RecurrentPPO'], help='The DRL algorithm of the model')
+    parser.add_argument('--set', type=int, required=True, help='The experiment set the model was trained on')
+    parser.add_argument('--output', type=str, default=None, help='The file to export the policy to, defaults to [path]/[algorithm]_set[set].npz')
+    parser.add_argument('--verify', type=parse_bool, default=True, help='If true, checks that the exported policy picks the same deterministic actions as the model')
+    parser.add_argument('--verify_envs', type=int, default=64, help='The number of observations per verification step')
+    parser.add_argument('--verify_steps', type=int, default=100, help='The number of verification steps, recurrent policies are run on sequences this long')
+    parser.add_argument('--seed', type=int, default=0, help='The random seed of the verification observations')
+
+    args = parser.parse_args()
+    print(args)
+    output = args.output if args.output is not None else os.path.join(args.path, f'{args.algorithm}_set{args.set}.npz')
+
+    model = load_model(args.algorithm, args.set, None, 'cpu', args.path, 0, None)
+    export_policy(model, args.algorithm, output)
+    model_size = os.path.getsize(os.path.join(args.path, f'{args.algorithm}_set{args.set}.zip'))
+    print(f'Exported the policy to {output} ({os.path.getsize(output) / 2**10:.0f} KB, the model is {model_size / 2**10:.0f} KB)')
+
+    if args.verify:
+        start = time.perf_counter()
+        policy = NumpyPolicy(output)
+        print(f'Loaded the exported policy in {(time.perf_counter() - start) * 1e3:.1f} ms')
+        if verify(model, policy, args.verify_envs, args.verify_steps, args.seed):
+            raise SystemExit('The exported policy does not match the model')
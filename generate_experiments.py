@@ -1,25 +1,120 @@
 from shapely import Polygon
 from shapely.geometry import Point
-from scipy.spatial import ConvexHull, distance
-import matplotlib.pyplot as plt
+from scipy.spatial import ConvexHull, QhullError, distance
+from concurrent.futures import ProcessPoolExecutor
+from src.field import rasterize_polygon
 import numpy as np
 import os
 import yaml
 import argparse
 
+# Samples a random convex field from 5-9 random points, returning its vertices and a mask of the grid points strictly
+# inside it, which are the points shapely's Polygon.contains accepts
+def sample_field(rng, max_size, attempts=1000):
+    for _ in range(attempts):
+        points = np.unique(rng.integers(0, max_size, size=(rng.integers(5, 10), 2)), axis=0)
+        try:
+            hull = ConvexHull(points)
+        except QhullError: # Fewer than 3 distinct or only collinear points
+            continue
+        vertices = points[hull.vertices]
+        return vertices, rasterize_polygon(vertices, max_size, pad=0)
+    raise ValueError(f'No field with 3 points that are not on a line was sampled in {attempts} attempts, the grid of size {max_size} is too small')
+
+# Picks count cells that are all at least min_spacing apart. Whole sets of candidates are drawn and checked in batches,
+# returning the first valid set, or None if no batch had one
+def sample_spaced_cells(rng, cells, count, min_spacing, batch_size=256, attempts=20):
+    for _ in range(attempts):
+        candidates = cells[rng.integers(0, len(cells), size=(batch_size, count))]
+        distances = np.linalg.norm(candidates[:, :, None, :] - candidates[:, None, :, :], axis=-1)
+        distances[:, np.arange(count), np.arange(count)] = np.inf
+        valid = (distances >= min_spacing).all(axis=(1, 2))
+        if valid.any():
+            return candidates[np.argmax(valid)]
+    return None
+
+# Generates one experiment with its own random generator and saves it. Fields that are too small or cannot fit the
+# spaced start positions are sampled again, up to max_attempts times
+def generate_experiment(path, seed, args):
+    rng = np.random.default_rng(seed)
+    too_small, too_crowded = 0, 0
+    for _ in range(args.max_attempts):
+        vertices, mask = sample_field(rng, args.max_size)
+        cells = np.argwhere(mask)
+        num_weeds = rng.integers(args.min_weeds, args.max_weeds + 1)
+        if len(cells) < max(args.min_area * args.max_size ** 2, num_weeds):
+            too_small += 1
+            continue
+        init_positions = sample_spaced_cells(rng, cells, args.num_agents, args.min_spacing)
+        if init_positions is None:
+            too_crowded += 1
+            continue
+        infected_locations = cells[rng.choice(len(cells), size=num_weeds, replace=False)]
+        break
+    else:
+        raise ValueError(f'No field out of {args.max_attempts} met the constraints: {too_small} had fewer grid points inside than --min_area '
+                         f'{args.min_area} or the number of weeds, {too_crowded} could not fit --num_agents {args.num_agents} start positions '
+                         f'--min_spacing {args.min_spacing} apart')
+
+    experiment = {
+        'grid_size': args.max_size,
+        'field': vertices.tolist(),
+        'init_positions': init_positions.tolist(),
+        'infected_locations': infected_locations.tolist(),
+    }
+    with open(path + '.tmp', 'w') as save_file:
+        yaml.dump(experiment, save_file, sort_keys=False, default_flow_style=None)
+    os.replace(path + '.tmp', path)
+    return path
+
 if __name__ == '__main__':
 
     # Parse args
     parser = argparse.ArgumentParser()
     parser.add_argument('number', type=int, nargs='?', default=1, help='The number of experiments to generate')
     parser.add_argument('--max_size', type=int, default=50, help='The maximum allowed size of the field')
+    parser.add_argument('--batch', action='store_true', help='Generates the experiments without showing the fields for confirmation')
+    parser.add_argument('--seed', type=int, default=None, help='The random seed to use, the same seed and arguments give the same experiments')
+    parser.add_argument('--output_dir', type=str, default='experiments', help='The directory to save the experiments in')
+    parser.add_argument('--num_agents', type=int, default=3, help='The number of agents of each experiment, only in batch mode')
+    parser.add_argument('--min_weeds', type=int, default=5, help='The minimum number of weeds of each experiment, only in batch mode')
+    parser.add_argument('--max_weeds', type=int, default=9, help='The maximum number of weeds of each experiment, only in batch mode')
+    parser.add_argument('--min_spacing', type=float, default=5, help='The minimum distance between the start positions of the agents, only in batch mode')
+    parser.add_argument('--min_area', type=float, default=0.2, help='The minimum share of the grid points that must be inside the field, only in batch mode')
+    parser.add_argument('--max_attempts', type=int, default=1000, help='The number of fields sampled for each experiment before giving up on the constraints, only in batch mode')
+    parser.add_argument('--workers', type=int, default=None, help='The number of worker processes generating experiments in batch mode, defaults to the number of cores')
     args = parser.parse_args()
 
     if args.max_size > 100:
         raise ValueError('Max size cannot be greater than 100')
+    if args.min_weeds > args.max_weeds:
+        raise ValueError('Min weeds cannot be greater than max weeds')
+
+    # Experiments are saved as set[number].yaml, using the lowest free numbers
+    os.makedirs(args.output_dir, exist_ok=True)
+    file = lambda x: os.path.join(args.output_dir, f'set{x}.yaml')
+    paths, counter = [], 1
+    while len(paths) < args.number:
+        if not os.path.exists(file(counter)):
+            paths.append(file(counter))
+        counter += 1
+
+    # Generate the experiments in parallel, each from its own seed so that the result does not depend on the workers
+    if args.batch:
+        seeds = np.random.SeedSequence(args.seed).spawn(args.number)
+        workers = min(args.workers or os.cpu_count(), args.number)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunksize = max(args.number // (workers * 4), 1)
+            for i, path in enumerate(executor.map(generate_experiment, paths, seeds, [args] * args.number, chunksize=chunksize)):
+                if (i + 1) % 100 == 0 or i + 1 == args.number:
+                    print(f'Generated {i + 1}/{args.number} experiments, last saved to {path}')
+        raise SystemExit
+
+    import matplotlib.pyplot as plt
+    np.random.seed(args.seed)
 
     # Generate the specified number of experiments
-    for _ in range(args.number):
+    for path in paths:
         experiment = {'grid_size': args.max_size}
 
         response = 'n'
@@ -56,9 +151,5 @@ if __name__ == '__main__':
                 experiment['infected_locations'].append(new_point)
 
         # Save as yaml file
-        file = lambda x: f'experiments/set{x}.yaml'
-        counter = 1
-        while os.path.exists(file(counter)):
-            counter += 1
-        with open(file(counter), 'w') as save_file:
+        with open(path, 'w') as save_file:
             yaml.dump(experiment, save_file)
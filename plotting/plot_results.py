@@ -1,35 +1,20 @@
-import glob
-import logging
-import os
-os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
-logging.getLogger('tensorflow').disabled = True
-import tensorflow as tf
 import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn
 import argparse
 
+# Weird Python hackery to get the last import to work
+import sys
+import os
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPT_DIR))
+from src.scalars import load_scalars
+
 def plot_setting_a():
     print('Plotting Setting A figure...')
     
     # Gather training data
-    training_data = []
-    training_logs = glob.glob("./training_logs/*/*")
-    for log in training_logs:
-        experiment_info = log.split('/')[2].split('_')
-        algorithm = experiment_info[0]
-        st = int(experiment_info[1][3:])
-
-        for e in tf.compat.v1.train.summary_iterator(log):
-            for v in e.summary.value:
-                if v.tag == 'rollout/ep_rew_mean':
-                    training_data.append({
-                        'algorithm': algorithm,
-                        'set': st,
-                        'step': e.step,
-                        'reward': v.simple_value
-                    })
-    train_df = pd.DataFrame(training_data)
+    train_df = load_scalars('training').rename(columns={'value': 'reward'})
 
     # Plot Setting A figure
     plt.rcParams.update({'font.size': 22})
@@ -45,27 +30,10 @@ def plot_setting_b():
     print('Plotting Setting B figures...')
     
     # Gather training data
-    training_data = []
-    training_logs = glob.glob("./training_logs/*/*")
-    for log in training_logs:
-        experiment_info = log.split('/')[2].split('_')
-        algorithm = experiment_info[0]
-        st = int(experiment_info[1][3:])
-        
-        # TODO: Run tuning experiments for all 10 environment variations
-        if st != 1:
-            continue
-
-        for e in tf.compat.v1.train.summary_iterator(log):
-            for v in e.summary.value:
-                if v.tag == 'rollout/ep_rew_mean':
-                    training_data.append({
-                        'algorithm': algorithm,
-                        'set': st,
-                        'step': e.step,
-                        'reward': v.simple_value
-                    })
-    train_df = pd.DataFrame(training_data)
+    train_df = load_scalars('training').rename(columns={'value': 'reward'})
+    
+    # TODO: Run tuning experiments for all 10 environment variations
+    train_df = train_df[train_df['set'] == 1]
         
     # Best trial info from slurm logs
     best_trials = {
@@ -78,27 +46,8 @@ def plot_setting_b():
     }
     
     # Gather tuning data
-    tuning_data = []
-    tuning_logs = glob.glob("./tuning_logs/*/*")
-    for log in tuning_logs:
-        experiment_info = log.split('/')[2].split('_')
-        algorithm = experiment_info[0]
-        st = int(experiment_info[1][3:])
-        trial = int(experiment_info[2])
-        
-        if trial != best_trials[algorithm]:
-            continue
-
-        for e in tf.compat.v1.train.summary_iterator(log):
-            for v in e.summary.value:
-                if v.tag == 'rollout/ep_rew_mean':
-                    tuning_data.append({
-                        'algorithm': algorithm,
-                        'set': st,
-                        'step': e.step,
-                        'reward': v.simple_value
-                    })
-    tune_df = pd.DataFrame(tuning_data)
+    tune_df = load_scalars('tuning').rename(columns={'value': 'reward'})
+    tune_df = tune_df[tune_df['trial'] == tune_df['algorithm'].map(best_trials)]
     
     # Plot Setting B figures
     plt.rcParams.update({'font.size': 22})
@@ -118,44 +67,12 @@ def plot_setting_c():
     print('Plotting Setting C figures...')
     
     # Gather training data
-    training_data = []
-    training_logs = glob.glob("./training_logs/*/*")
-    for log in training_logs:
-        experiment_info = log.split('/')[2].split('_')
-        algorithm = experiment_info[0]
-        st = int(experiment_info[1][3:])
-
-        for e in tf.compat.v1.train.summary_iterator(log):
-            for v in e.summary.value:
-                if v.tag == 'rollout/ep_rew_mean':
-                    training_data.append({
-                        'type': 'non-transfer',
-                        'algorithm': algorithm,
-                        'set': st,
-                        'step': e.step,
-                        'reward': v.simple_value
-                    })
-    train_df = pd.DataFrame(training_data)
+    train_df = load_scalars('training').rename(columns={'value': 'reward'})
+    train_df['type'] = 'non-transfer'
     
     # Gather transfer data
-    transfer_data = []
-    transfer_logs = glob.glob("./transfer_logs/*/*")
-    for log in transfer_logs:
-        experiment_info = log.split('/')[2].split('_')
-        algorithm = experiment_info[0]
-        st = int(experiment_info[2][2:])
-
-        for e in tf.compat.v1.train.summary_iterator(log):
-            for v in e.summary.value:
-                if v.tag == 'rollout/ep_rew_mean':
-                    transfer_data.append({
-                        'type': 'transfer',
-                        'algorithm': algorithm,
-                        'set': st,
-                        'step': e.step,
-                        'reward': v.simple_value
-                    })
-    transfer_df = pd.DataFrame(transfer_data)
+    transfer_df = load_scalars('transfer').rename(columns={'value': 'reward'})
+    transfer_df['type'] = 'transfer'
     
     all_df = pd.concat([train_df, transfer_df])
     
@@ -172,8 +89,6 @@ def plot_setting_c():
     
 if __name__ == '__main__':
     
-    tf.get_logger().setLevel('INFO')
-    
     # Parse arguments
     parser = argparse.ArgumentParser()
     
@@ -1,62 +1,298 @@
 import argparse
-import pygame
+import queue
+import threading
+import time
+import numpy as np
 import gymnasium as gym
-from coppeliasim_zmqremoteapi_client import RemoteAPIClient
-from src.sim import DroneSimulator
+from src.inference_server import InferenceClient, read_authkey
+from src.numpy_policy import NumpyPolicy
+from src.recorder import FrameRecorder
+from src.trajectory import Trajectory, TrajectoryWriter
 from src.utils import load_experiment, load_model, parse_bool
 
+# Connects to CoppeliaSim and places the field, the agents and the weeds of the environment
+def make_simulator(env, info, args):
+    from coppeliasim_zmqremoteapi_client import RemoteAPIClient
+    from src.sim import DroneSimulator
+    client = RemoteAPIClient()
+    sim = client.getObject('sim')
+    defaultIdleFps = sim.getInt32Param(sim.intparam_idle_fps)
+    sim.setInt32Param(sim.intparam_idle_fps, 0)
+
+    drone_simulator = DroneSimulator(sim, polygon=env.unwrapped.poly_vertices, scaling_factor=5, height=0.35, client=client, stepping=args.sim_stepping, sim_steps=args.sim_steps)
+    drone_simulator.draw_field()
+    drone_simulator.set_agent_positions(k=env.unwrapped.num_agents, info=info)
+    drone_simulator.set_weed_locations(weed_locations=env.unwrapped.infected_locations)
+    drone_simulator.start_simulation()
+    return drone_simulator
+
+# Runs the model on several environments in lockstep and records their tiled frames without a display. Environments
+# that finish early keep showing their last frame until every episode is over
+def record(model, env_config, args, trajectory_writer=None):
+    envs = [gym.make('MultiAgentGridworld-v1', render_mode='rgb_array', env_config=env_config, obs_mode=args.obs_mode, action_mode=args.action_mode)
+            for _ in range(args.num_envs)]
+    seeds = [None if args.seed is None else args.seed + i for i in range(args.num_envs)]
+    obs = np.stack([env.reset(seed=seed)[0] for env, seed in zip(envs, seeds)])
+    frames = [env.render() for env in envs]
+    done = np.zeros(args.num_envs, dtype=bool)
+    total_rewards = np.zeros(args.num_envs)
+    steps = np.zeros(args.num_envs, dtype=int)
+    state, episode_starts = None, np.ones(args.num_envs, dtype=bool)
+    if trajectory_writer is not None:
+        for i, (env, seed) in enumerate(zip(envs, seeds)):
+            trajectory_writer.begin(env, slot=i, seed=seed)
+
+    start_time = time.perf_counter()
+    with FrameRecorder(args.record, fps=args.fps) as recorder:
+        recorder.record(frames)
+        while not done.all():
+            actions, state = model.predict(obs, state=state, episode_start=episode_starts)
+            episode_starts[:] = False
+            for i, env in enumerate(envs):
+                if done[i]:
+                    continue
+                obs[i], reward, terminated, truncated, info = env.step(actions[i])
+                total_rewards[i] += reward
+                steps[i] += 1
+                done[i] = terminated or truncated
+                frames[i] = env.render()
+                if trajectory_writer is not None:
+                    trajectory_writer.step(env, actions[i], reward, slot=i)
+                    if done[i]:
+                        trajectory_writer.end(terminated, truncated, slot=i)
+            recorder.record(frames)
+    elapsed = time.perf_counter() - start_time
+
+    for i, env in enumerate(envs):
+        print(f'Env {i}: steps: {steps[i]}, total_rewards: {total_rewards[i]}')
+        env.close()
+    print(f'Recorded {recorder.num_frames} frames to {args.record} in {elapsed:.1f}s ({recorder.num_frames / elapsed:.0f} frames/s)')
+
+# Replays logged episodes in PyGame, CoppeliaSim or into a recording, without loading the model. Every frame
+# restores the logged state, so replays can start at any step, where the visited cells are rebuilt once. Episodes
+# logged on a field pool are replayed on their own field
+def replay(args):
+    trajectory = Trajectory(args.replay)
+    render_mode = 'rgb_array' if args.record is not None else 'human'
+    recorder = FrameRecorder(args.record, fps=args.fps * args.speed) if args.record is not None else None
+    env, field, drone_simulator = None, None, None
+
+    episodes = range(len(trajectory.episodes)) if args.episode is None else [args.episode]
+    for index in episodes:
+        episode = trajectory.episodes[index]
+        if env is None or episode.get('field') != field:
+            if env is not None:
+                env.close()
+            if drone_simulator is not None: # The simulator shows the previous field
+                drone_simulator.stop_simulation()
+                drone_simulator = None
+            env = gym.make('MultiAgentGridworld-v1', render_mode=render_mode, env_config=trajectory.episode_config(index), obs_mode=trajectory.obs_mode, action_mode=trajectory.action_mode)
+            env.metadata['render_fps'] = args.fps * args.speed
+            env.reset()
+            field = episode.get('field')
+        columns = trajectory.episode(index)
+        targets = Trajectory.targets(columns)
+        print(f"Episode {index}: steps: {episode['length'] - 1}, total_rewards: {episode['total_reward']}, terminated: {episode['terminated']}, truncated: {episode['truncated']}")
+        visited = None
+        for t in range(min(args.start, episode['length'] - 1), episode['length']):
+            if visited is None:
+                obs, info = env.unwrapped.set_state(columns['positions'][t], columns['weeds'][t], targets[:t], t)
+                visited = env.unwrapped.visited.copy()
+            else:
+                # Only the cells of the last step are new, so the visited cells are kept from frame to frame
+                visited[targets[t - 1, :, 0] + 1, targets[t - 1, :, 1] + 1] = 1
+                obs, info = env.unwrapped.set_state(columns['positions'][t], columns['weeds'][t], step_count=t, visited=visited)
+            if args.simulate:
+                if drone_simulator is None:
+                    drone_simulator = make_simulator(env, info, args)
+                else:
+                    drone_simulator.move_agents(k=env.unwrapped.num_agents, info=info)
+            elif recorder is not None:
+                recorder.record(env.render())
+            else:
+                env.render()
+
+    if drone_simulator is not None:
+        drone_simulator.stop_simulation()
+    if recorder is not None:
+        recorder.close()
+        print(f'Recorded {recorder.num_frames} frames to {args.record}')
+    if env is not None:
+        env.close()
+
+# Prints status lines at most once every interval seconds. Messages are given as functions, so that they are only
+# formatted when printed
+class StatusPrinter:
+    def __init__(self, enabled=True, interval=0.0):
+        self.enabled = enabled
+        self.interval = interval
+        self.last_print = -np.inf
+
+    def __call__(self, message):
+        now = time.perf_counter()
+        if self.enabled and now - self.last_print >= self.interval:
+            print(message())
+            self.last_print = now
+
+# Prints the 50th, 90th and 99th percentile and the maximum latency of each stage
+def print_latencies(latencies):
+    for stage, values in latencies.items():
+        if values:
+            p50, p90, p99 = np.percentile(values, [50, 90, 99]) * 1e3
+            print(f'{stage:>8}: p50 {p50:.2f} ms, p90 {p90:.2f} ms, p99 {p99:.2f} ms, max {max(values) * 1e3:.2f} ms ({len(values)} steps)')
+
+# Runs one episode of the model live. A step goes through two stages: the model picks an action and the environment
+# steps, then the new state is sent to CoppeliaSim or rendered in PyGame. With pipelining, the first stage runs in a
+# thread and computes step t+1 while step t is still being sent, with a bounded queue between the stages for
+# backpressure. The renderer then draws a copy of each state in a display environment, as the stepping environment
+# has already moved on. Returns the latencies of the stages
+def run_live(model, env, args, display_env=None, trajectory_writer=None):
+    printer = StatusPrinter(args.print, args.print_interval)
+    latencies = {'predict': [], 'step': [], 'queue': [], 'output': [], 'loop': []}
+    obs, info = env.reset(seed=args.seed)
+    if display_env is not None:
+        display_env.reset()
+    if trajectory_writer is not None:
+        trajectory_writer.begin(env, seed=args.seed)
+    drone_simulator = make_simulator(env, info, args) if args.simulate else None
+
+    # First stage: inference and environment step
+    def compute_steps(obs):
+        terminated, truncated = False, False
+        state, episode_start = None, True
+        while not (terminated or truncated):
+            start = time.perf_counter()
+            action, state = model.predict(obs, state=state, episode_start=np.array([episode_start]))
+            episode_start = False
+            predicted = time.perf_counter()
+            obs, reward, terminated, truncated, info = env.step(action)
+            stepped = time.perf_counter()
+            latencies['predict'].append(predicted - start)
+            latencies['step'].append(stepped - predicted)
+            if trajectory_writer is not None:
+                trajectory_writer.step(env, action, reward)
+            snapshot = env.unwrapped.get_state() if display_env is not None else None
+            yield time.perf_counter(), obs, reward, terminated, truncated, info, action, snapshot
+
+    if args.pipeline:
+        steps = queue.Queue(maxsize=args.queue_size)
+        def produce():
+            try:
+                for item in compute_steps(obs):
+                    steps.put(item)
+                steps.put(None)
+            except BaseException as error:
+                steps.put(error)
+        threading.Thread(target=produce, daemon=True).start()
+        items = iter(steps.get, None)
+    else:
+        items = compute_steps(obs)
+
+    # Second stage: simulator or renderer
+    total_rewards = 0
+    last_output = time.perf_counter()
+    for item in items:
+        if isinstance(item, BaseException):
+            raise RuntimeError('Computing the steps failed') from item
+        queued, obs, reward, terminated, truncated, info, action, snapshot = item
+        start = time.perf_counter()
+        if drone_simulator is not None:
+            drone_simulator.move_agents(k=env.unwrapped.num_agents, info=info)
+        elif display_env is not None:
+            display_env.unwrapped.set_state(**snapshot)
+            display_env.render()
+        else:
+            env.render()
+        end = time.perf_counter()
+        latencies['queue'].append(start - queued)
+        latencies['output'].append(end - start)
+        latencies['loop'].append(end - last_output)
+        last_output = end
+        total_rewards += reward
+        printer(lambda: f"Obs: {obs}, Reward: {reward}, terminated: {terminated}, total_rewards: {total_rewards}, action: {action}")
+    print('terminated:', terminated, 'truncated:', truncated, 'total_rewards:', total_rewards)
+    if trajectory_writer is not None:
+        trajectory_writer.end(terminated, truncated)
+
+    if drone_simulator is not None:
+        drone_simulator.stop_simulation()
+    return latencies
+
 if __name__ == '__main__':
 
     # Parse arguments
     parser = argparse.ArgumentParser()
 
-    parser.add_argument('--path', type='str', required=True, help='The directory to look for trained models in')
-    parser.add_argument('--algorithm', type=str, required=True, choices=['A2C', 'PPO', 'TRPO', 'RecurrentPPO'], help='The DRL algorithm to use')
-    parser.add_argument('--set', type=int, required=True, help='The experiment set to use, from the sets defined in the experiments directory')
+    parser.add_argument('--path', type=str, default=None, help='The directory to look for trained models in')
+    parser.add_argument('--policy', type=str, default=None, help='A policy exported with export.py to run instead of a trained model, which does not need torch')
+    parser.add_argument('--server', type=str, default=None, help='The address of an inference server (serve.py) to get actions from instead of loading the model, a Unix socket path or host:port')
+    parser.add_argument('--authkey', type=str, default=None, help='The key of the inference server, if it has one')
+    parser.add_argument('--authkey_file', type=str, default=None, help='A file holding the key of the inference server, e.g. the one serve.py generates')
+    parser.add_argument('--algorithm', type=str, default=None, choices=['A2C', 'PPO', 'TRPO', 'DQN', 'ARS', 'RecurrentPPO'], help='The DRL algorithm to use')
+    parser.add_argument('--set', type=int, default=None, help='The experiment set to use, from the sets defined in the experiments directory')
     parser.add_argument('--simulate', type=parse_bool, default=False, help='If true, uses the Coppelia Simulator to show the environment. If false, renders the environment using PyGame')
+    parser.add_argument('--sim_stepping', type=parse_bool, default=False, help='If true, runs CoppeliaSim in stepping mode, advancing the simulation in lockstep with the environment')
+    parser.add_argument('--sim_steps', type=int, default=1, help='The number of simulation steps per environment step in stepping mode')
+    parser.add_argument('--record', type=str, default=None, help='Records the rollouts headless to this path instead of showing them: an .mp4 file (requires imageio), a .gif file or a directory of chunked .npy frames')
+    parser.add_argument('--num_envs', type=int, default=1, help='The number of environments to record, their frames are tiled into one video')
+    parser.add_argument('--fps', type=int, default=30, help='The frame rate of the recorded video and of replays')
+    parser.add_argument('--save_trajectory', type=str, default=None, help='Logs the episodes to this trajectory directory, for replaying them later')
+    parser.add_argument('--replay', type=str, default=None, help='Replays the episodes of a trajectory directory instead of running a model')
+    parser.add_argument('--episode', type=int, default=None, help='The episode to replay, defaults to every logged episode')
+    parser.add_argument('--start', type=int, default=0, help='The step to start replaying from')
+    parser.add_argument('--speed', type=float, default=1.0, help='The speed of the replay, relative to --fps')
+    parser.add_argument('--pipeline', type=parse_bool, default=False, help='If true, computes the next step in a background thread while the current one is sent to CoppeliaSim or rendered')
+    parser.add_argument('--queue_size', type=int, default=2, help='The maximum number of computed steps waiting to be sent when pipelining, larger queues absorb stalls but show older steps')
+    parser.add_argument('--print', type=parse_bool, default=True, help='If true, prints the observation, reward and action while running')
+    parser.add_argument('--print_interval', type=float, default=0.0, help='The minimum number of seconds between printed steps, 0 prints every step')
+    parser.add_argument('--obs_mode', type=str, choices=['decimal', 'bits'], default='decimal', help='The observation mode the model was trained with')
+    parser.add_argument('--action_mode', type=str, choices=['discrete', 'multidiscrete'], default='discrete', help='The action mode the model was trained with')
     parser.add_argument('--seed', type=int, default=None, help='The random seed to use')
     parser.add_argument('--device', type=str, choices=['cpu', 'cuda'], default='cpu', help='The device to run the model on')
 
     args = parser.parse_args()
 
-    # Load the model
-    model = load_model(args.algorithm, args.set, args.seed, args.device, args.path)
+    # Replays only need the trajectory
+    if args.replay is not None:
+        replay(args)
+        raise SystemExit
+    if args.set is None or (args.policy is None and (args.algorithm is None or (args.path is None and args.server is None))):
+        parser.error('--set, and --path and --algorithm, --server and --algorithm or --policy, are required unless replaying a trajectory')
 
-    # Make the environment
-    env_config = load_experiment(f'experiments/set{args.set}.yaml')
-    env = gym.make('ThreeAgentGridworld-v0', seed=args.seed, render_mode='human', env_config=env_config)
-    env.metadata['render_fps'] = 5 if args.simulate else 30
-    obs, info = env.reset(seed=args.seed)
+    # Load the exported policy or the model, or connect to the server serving the model. They all have the same predict
+    if args.policy is not None:
+        model = NumpyPolicy(args.policy, seed=args.seed)
+        args.algorithm = model.algorithm
+    elif args.server is not None:
+        model = InferenceClient(args.server, f'{args.algorithm}_set{args.set}', read_authkey(args.authkey, args.authkey_file))
+    else:
+        model = load_model(args.algorithm, args.set, args.seed, args.device, args.path, 0, None)
 
-    # Set up CoppeliaSim
-    if args.simulate:
-        client = RemoteAPIClient()
-        sim = client.getObject('sim')
-        defaultIdleFps = sim.getInt32Param(sim.intparam_idle_fps)
-        sim.setInt32Param(sim.intparam_idle_fps, 0)
+    env_config = load_experiment(f'experiments/set{args.set}.yaml')
+    trajectory_writer = None
+    if args.save_trajectory is not None:
+        trajectory_writer = TrajectoryWriter(args.save_trajectory, env_config, args.obs_mode, args.action_mode, metadata={'algorithm': args.algorithm, 'set': args.set})
+    if args.record is not None:
+        record(model, env_config, args, trajectory_writer)
+        if trajectory_writer is not None:
+            trajectory_writer.close()
+        raise SystemExit
 
-        drone_simulator = DroneSimulator(sim, polygon=env.poly_vertices, scaling_factor=5, height=0.35)
-        drone_simulator.draw_field()
-        drone_simulator.set_agent_positions(k=3, info=info)
-        drone_simulator.set_weed_locations(weed_locations=env.infected_locations)
-        drone_simulator.start_simulation()
+    # Make the environment. When pipelining, a second environment shows the states computed by the first
+    render_mode = None if args.simulate or args.pipeline else 'human'
+    env = gym.make('MultiAgentGridworld-v1', render_mode=render_mode, env_config=env_config, obs_mode=args.obs_mode, action_mode=args.action_mode)
+    display_env = None
+    if args.pipeline and not args.simulate:
+        display_env = gym.make('MultiAgentGridworld-v1', render_mode='human', env_config=env_config, obs_mode=args.obs_mode, action_mode=args.action_mode)
+    env.metadata['render_fps'] = 30
 
     # Run trained model
-    terminated, truncated = False, False
-    total_rewards = 0
-    while not (terminated or truncated):
-        action, _ = model.predict(obs)
-        obs, reward, terminated, truncated, info = env.step(list(action))
-        if args.simulate:
-            drone_simulator.move_agents(k=3, info=info)
-        else:
-            env.render()
-            pygame.event.get()
-        total_rewards += reward
-        print(f"Obs: {obs}, Reward: {reward}, terminated: {terminated}, total_rewards: {total_rewards}, action: {action}")
-    print('terminated:', terminated, 'truncated:', truncated)
-    
-    # Close simulator and environment
-    if args.simulate:
-        drone_simulator.stop_simulation()
+    latencies = run_live(model, env, args, display_env=display_env, trajectory_writer=trajectory_writer)
+    if trajectory_writer is not None:
+        trajectory_writer.close()
+    print_latencies(latencies)
+
+    # Close environments
     env.close()
+    if display_env is not None:
+        display_env.close()
@@ -0,0 +1,134 @@
+import argparse
+import itertools
+import json
+import os
+import shlex
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+# Builds the command of one job of the grid. With several seeds, the seed is added to the names of the model,
+# checkpoints and TensorBoard runs, or of the study for tuning, so that the jobs of different seeds do not overwrite
+# each other's outputs
+def job_command(task, algorithm, experiment_set, seed, args, extra_args):
+    command = [sys.executable, f'{task}.py', '--algorithm', algorithm, '--seed', str(seed)]
+    if task == 'transfer':
+        command += ['--load_set', str(args.load_set), '--train_set', str(experiment_set)]
+        name = f'{algorithm}_from{args.load_set}_to{experiment_set}'
+    else:
+        command += ['--set', str(experiment_set)]
+        name = f'{algorithm}_set{experiment_set}'
+    if len(args.seeds) > 1:
+        command += ['--study_name' if task == 'tune' else '--run_name', f'{name}_seed{seed}']
+    return command + extra_args
+
+# Reads the keys of the jobs that finished successfully in earlier runs
+def load_manifest(path):
+    completed = set()
+    if os.path.exists(path):
+        with open(path, 'r') as manifest_file:
+            for line in manifest_file:
+                entry = json.loads(line)
+                if entry['returncode'] == 0:
+                    completed.add(entry['key'])
+    return completed
+
+# Appends a finished job to the manifest, one JSON object per line
+def record_job(path, entry):
+    with open(path, 'a') as manifest_file:
+        manifest_file.write(json.dumps(entry) + '\n')
+        manifest_file.flush()
+        os.fsync(manifest_file.fileno())
+
+# Formats a number of seconds as hours, minutes and seconds
+def format_duration(seconds):
+    return str(timedelta(seconds=int(seconds)))
+
+if __name__ == '__main__':
+
+    # Parse arguments, any unknown arguments are passed on to every job
+    parser = argparse.ArgumentParser(description='Runs a grid of train, tune or transfer jobs on the local cores. Arguments not listed here are passed on to every job, e.g. --steps 2000000 --vec_env shm')
+
+    parser.add_argument('task', type=str, choices=['train', 'tune', 'transfer'], help='The script to run for every job')
+    parser.add_argument('--algorithms', type=str, nargs='+', choices=['A2C', 'PPO', 'TRPO', 'DQN', 'ARS', 'RecurrentPPO'], default=['A2C', 'PPO', 'TRPO', 'ARS', 'DQN'], help='The DRL algorithms of the grid')
+    parser.add_argument('--sets', type=int, nargs='+', default=list(range(1, 11)), help='The experiment sets of the grid, the sets trained on for transfer')
+    parser.add_argument('--seeds', type=int, nargs='+', default=[33], help='The random seeds of the grid. With several seeds, the outputs of each job are named with its seed')
+    parser.add_argument('--load_set', type=int, default=1, help='The experiment set the transferred models were trained on')
+    parser.add_argument('--cores_per_job', type=int, default=4, help='The number of cores given to each job')
+    parser.add_argument('--max_cores', type=int, default=None, help='The number of cores to use, defaults to every core available to this process')
+    parser.add_argument('--manifest', type=str, default=None, help='The file recording finished jobs, defaults to schedule_logs/[task]_manifest.jsonl')
+    parser.add_argument('--log_dir', type=str, default='schedule_logs', help='The directory for the output of each job')
+    parser.add_argument('--dry_run', action='store_true', help='Prints the jobs that would run without running them')
+
+    args, extra_args = parser.parse_known_args()
+    manifest = args.manifest or os.path.join(args.log_dir, f'{args.task}_manifest.jsonl')
+    os.makedirs(args.log_dir, exist_ok=True)
+
+    # Cores available for jobs, split into slots of cores_per_job cores
+    pinning = hasattr(os, 'sched_setaffinity') # Only available on Linux
+    cores = sorted(os.sched_getaffinity(0)) if pinning else list(range(os.cpu_count()))
+    cores = cores[:args.max_cores]
+    cores_per_job = min(args.cores_per_job, len(cores))
+    free_slots = [cores[i:i + cores_per_job] for i in range(0, len(cores) - cores_per_job + 1, cores_per_job)]
+
+    # Expand the grid, skipping the jobs that already finished
+    completed = load_manifest(manifest)
+    jobs = []
+    for algorithm, experiment_set, seed in itertools.product(args.algorithms, args.sets, args.seeds):
+        command = job_command(args.task, algorithm, experiment_set, seed, args, extra_args)
+        key = shlex.join(command[1:]) # The Python interpreter does not matter
+        name = f'{args.task}_{algorithm}_set{experiment_set}_seed{seed}'
+        if key not in completed:
+            jobs.append({'key': key, 'name': name, 'command': command})
+    total = len(jobs)
+    print(f'{total} jobs to run, {len(completed)} finished in earlier runs, {len(free_slots)} slots of {cores_per_job} cores')
+    if args.dry_run:
+        for job in jobs:
+            print(job['name'] + ': ' + shlex.join(job['command']))
+        raise SystemExit
+
+    # Run the jobs, starting a new one whenever a slot of cores is free
+    running = [] # (job, process, slot, start time, log file)
+    finished, failed = 0, 0
+    start_time = time.time()
+    try:
+        while jobs or running:
+            while jobs and free_slots:
+                job, slot = jobs.pop(0), free_slots.pop(0)
+                log_file = open(os.path.join(args.log_dir, job['name'] + '.log'), 'w')
+                process = subprocess.Popen(job['command'], stdout=log_file, stderr=subprocess.STDOUT,
+                                           preexec_fn=(lambda slot=slot: os.sched_setaffinity(0, slot)) if pinning else None)
+                running.append((job, process, slot, time.time(), log_file))
+                print(f"Started {job['name']} on cores {slot[0]}-{slot[-1]}")
+
+            time.sleep(1)
+            for entry in [entry for entry in running if entry[1].poll() is not None]:
+                job, process, slot, job_start, log_file = entry
+                running.remove(entry)
+                free_slots.append(slot)
+                log_file.close()
+                end = time.time()
+                record_job(manifest, {
+                    'key': job['key'],
+                    'name': job['name'],
+                    'returncode': process.returncode,
+                    'start': datetime.fromtimestamp(job_start).isoformat(timespec='seconds'),
+                    'duration': end - job_start,
+                })
+                finished += 1
+                failed += process.returncode != 0
+
+                # Throughput and ETA, from the jobs finished in this run
+                elapsed = end - start_time
+                throughput = finished / elapsed * 3600
+                eta = elapsed / finished * (total - finished)
+                status = 'finished' if process.returncode == 0 else f'failed with code {process.returncode}'
+                print(f"{job['name']} {status} in {format_duration(end - job_start)}. {finished}/{total} jobs done ({failed} failed), "
+                      f"{throughput:.2f} jobs/hour, ETA {format_duration(eta)}")
+    finally:
+        for job, process, slot, job_start, log_file in running:
+            process.terminate()
+            log_file.close()
+
+    print(f'All jobs done in {format_duration(time.time() - start_time)}, {failed} failed. Failed jobs run again next time')
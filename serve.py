@@ -0,0 +1,60 @@
+import argparse
+import signal
+import threading
+import time
+from src.inference_server import InferenceServer, generate_authkey, load_served_model
+
+# Prints the metrics of every model, see ModelMetrics.summary
+def print_metrics(metrics):
+    for name, summary in metrics.items():
+        latencies = ', '.join(f"{stage} p50 {summary[stage]['p50']:.2f} ms p99 {summary[stage]['p99']:.2f} ms" for stage in ('wait', 'predict', 'total') if stage in summary)
+        print(f"{name}: {summary['requests']} requests, {summary['observations']} observations, {summary['batches']} batches of {summary['mean_batch']:.1f} on average" + (f', {latencies}' if latencies else ''))
+
+if __name__ == '__main__':
+
+    # Parse arguments
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('models', type=str, nargs='+', help='The model files to serve: trained models named [algorithm]_*.zip, or policies exported with export.py. Clients request them by file name without the extension')
+    parser.add_argument('--address', type=str, default='inference.sock', help='The path of the Unix socket to listen on, or host:port to listen on TCP')
+    parser.add_argument('--authkey', type=str, default=None, help='The key clients must connect with. If it is not given, a key is generated and written to --authkey_file')
+    parser.add_argument('--authkey_file', type=str, default='inference.key', help='The file the generated key is written to, readable by the current user only')
+    parser.add_argument('--max_batch', type=int, default=64, help='The number of observations at which a batch is run without waiting for more requests')
+    parser.add_argument('--max_wait', type=float, default=2.0, help='The maximum number of milliseconds a request waits for other requests to batch with')
+    parser.add_argument('--metrics_interval', type=float, default=60.0, help='The number of seconds between printed metrics, 0 for none')
+    parser.add_argument('--device', type=str, choices=['cpu', 'cuda'], default='cpu', help='The device to run the trained models on')
+
+    args = parser.parse_args()
+    print(args)
+
+    # Load the models once for every client
+    models = {}
+    for path in args.models:
+        start = time.perf_counter()
+        name, model = load_served_model(path, args.device)
+        models[name] = model
+        print(f'Loaded {name} from {path} in {time.perf_counter() - start:.1f}s')
+
+    # Unix sockets are only writable by their owner, but a key also keeps out anyone who gets around that, e.g. by
+    # the socket directory being shared
+    authkey = args.authkey.encode() if args.authkey is not None else None
+    if authkey is None:
+        authkey = generate_authkey(args.authkey_file)
+        print(f'Generated a key for clients in {args.authkey_file}')
+    server = InferenceServer(models, args.address, args.max_batch, args.max_wait / 1e3, authkey)
+    print(f'Serving {", ".join(models)} on {args.address}')
+
+    if args.metrics_interval > 0:
+        def report():
+            while True:
+                time.sleep(args.metrics_interval)
+                print_metrics(server.metrics())
+        threading.Thread(target=report, daemon=True).start()
+
+    # Stop accepting clients on Ctrl+C or SIGTERM, and remove the socket file
+    def stop(signum, frame):
+        server.close()
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    server.serve_forever()
+    print_metrics(server.metrics())
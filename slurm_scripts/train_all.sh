@@ -9,6 +9,7 @@
 #SBATCH --mem=4G
 #SBATCH --time=4:00:00
 #SBATCH --export=NONE
+#SBATCH --signal=B:USR1@300
 
 # Modify these for other experiments
 algorithms=("A2C" "PPO" "TRPO" "ARS" "DQN")
@@ -24,6 +25,12 @@ algorithm=${algorithms[$algorithm_index]}
 set_index=$((index % num_sets))
 set=${sets[$set_index]}
 
-conda run --no-capture-output -n rl4pag python3 train.py --algorithm $algorithm --set $set --verbose 1 --steps 2000000 --log_steps 5000 --seed 33
+# Slurm sends USR1 to this script 5 minutes before the time limit, it is forwarded to python which then writes a
+# final checkpoint and exits. Resubmitting the job resumes training from that checkpoint, finished runs are skipped
+trap 'pkill -USR1 -s 0 -f "^[^ ]*python[0-9.]* train\.py"' USR1
 
+conda run --no-capture-output -n rl4pag python3 train.py --algorithm $algorithm --vec_env shm --set $set --verbose 1 --steps 2000000 --log_steps 5000 --seed 33 --resume True --skip_completed True &
+
+# wait returns when a trapped signal arrives, so wait again for python to finish its checkpoint
+wait
 wait
\ No newline at end of file
@@ -12,6 +12,7 @@
 #SBATCH --partition=ksu-gen-gpu.q
 #SBATCH --gres=gpu:1
 #SBATCH --export=NONE
+#SBATCH --signal=B:USR1@300
 
 # Modify these for other experiments
 algorithms=("RecurrentPPO")
@@ -27,6 +28,12 @@ algorithm=${algorithms[$algorithm_index]}
 set_index=$((index % num_sets))
 set=${sets[$set_index]}
 
-conda run --no-capture-output -n rl4pag python3 train.py --algorithm $algorithm --set $set --steps 2000000 --verbose 1 --seed 33 --log_steps 5000 --device "cuda"
+# Slurm sends USR1 to this script 5 minutes before the time limit, it is forwarded to python which then writes a
+# final checkpoint and exits. Resubmitting the job resumes training from that checkpoint, finished runs are skipped
+trap 'pkill -USR1 -s 0 -f "^[^ ]*python[0-9.]* train\.py"' USR1
 
+conda run --no-capture-output -n rl4pag python3 train.py --algorithm $algorithm --vec_env shm --set $set --steps 2000000 --verbose 1 --seed 33 --log_steps 5000 --device "cuda" --resume True --skip_completed True &
+
+# wait returns when a trapped signal arrives, so wait again for python to finish its checkpoint
+wait
 wait
\ No newline at end of file
@@ -8,12 +8,19 @@
 #SBATCH --mem=4G
 #SBATCH --time=24:00:00
 #SBATCH --export=NONE
+#SBATCH --signal=B:USR1@300
 
 algorithm="A2C"
 load_set=1
 train_set=2
 steps=2000000
 
-conda run --no-capture-output -n rl4pag python3 transfer.py --algorithm $algorithm --load_set $load_set --train_set $train_set --verbose 1 --log_steps 5000 --steps $steps
+# Slurm sends USR1 to this script 5 minutes before the time limit, it is forwarded to python which then writes a
+# final checkpoint and exits. Resubmitting the job resumes training from that checkpoint, finished runs are skipped
+trap 'pkill -USR1 -s 0 -f "^[^ ]*python[0-9.]* transfer\.py"' USR1
 
+conda run --no-capture-output -n rl4pag python3 transfer.py --algorithm $algorithm --vec_env shm --load_set $load_set --train_set $train_set --verbose 1 --log_steps 5000 --steps $steps --resume True --skip_completed True &
+
+# wait returns when a trapped signal arrives, so wait again for python to finish its checkpoint
+wait
 wait
\ No newline at end of file
@@ -24,6 +24,6 @@ algorithm=${algorithms[$algorithm_index]}
 set_index=$((index % num_sets))
 set=${sets[$set_index]}
 
-conda run --no-capture-output -n rl4pag python3 tune.py --algorithm $algorithm --set $set --steps 1000000 --seed 33 --log_steps 5000
+conda run --no-capture-output -n rl4pag python3 tune.py --algorithm $algorithm --vec_env shm --set $set --steps 1000000 --seed 33 --log_steps 5000
 
 wait
\ No newline at end of file
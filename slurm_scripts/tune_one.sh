@@ -13,6 +13,6 @@ algorithm="A2C"
 set=1
 steps=1000000
 
-conda run --no-capture-output -n rl4pag python3 tune.py --algorithm $algorithm --set $set --steps $steps --seed 33 --log_steps 5000
+conda run --no-capture-output -n rl4pag python3 tune.py --algorithm $algorithm --vec_env shm --set $set --steps $steps --seed 33 --log_steps 5000
 
 wait
\ No newline at end of file
@@ -1,5 +1,5 @@
 import gymnasium as gym
-from src.env import ThreeAgentGridworldEnv
+from src.env import MultiAgentGridworldEnv, ThreeAgentGridworldEnv
 
 # Register the environment
 gym.envs.registration.register(
@@ -7,3 +7,10 @@ gym.envs.registration.register(
     entry_point=ThreeAgentGridworldEnv,
     max_episode_steps=2000,
 )
+
+# Register the environment for any number of agents
+gym.envs.registration.register(
+    id='MultiAgentGridworld-v1',
+    entry_point=MultiAgentGridworldEnv,
+    max_episode_steps=2000,
+)
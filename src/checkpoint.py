@@ -0,0 +1,194 @@
+import glob
+import io
+import json
+import os
+import pickle
+import re
+import signal
+import threading
+import time
+from stable_baselines3.common.callbacks import BaseCallback
+
+# Writes bytes to a file atomically: to a temporary file in the same directory, synced to disk and renamed over the
+# target, so that a crash or kill at any point leaves either the old or the new file
+def atomic_write(path, data):
+    tmp_path = os.path.join(os.path.dirname(path), f'.{os.path.basename(path)}.tmp')
+    with open(tmp_path, 'wb') as tmp_file:
+        tmp_file.write(data)
+        tmp_file.flush()
+        os.fsync(tmp_file.fileno())
+    os.replace(tmp_path, path)
+
+# Reads the latest checkpoint of a directory, or None if it has none
+def latest_checkpoint(directory):
+    path = os.path.join(directory, 'latest.json')
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as latest_file:
+        checkpoint = json.load(latest_file)
+    # Paths are stored relative to the directory, so that checkpoints can be moved
+    for key in ('model', 'replay_buffer', 'vec_normalize'):
+        if checkpoint.get(key):
+            checkpoint[key] = os.path.join(directory, checkpoint[key])
+    return checkpoint
+
+# Marks the run of a checkpoint directory as finished, with the steps it trained and the path of its saved model, so
+# that its checkpoints are not resumed and resubmitted jobs can leave its model alone
+def mark_completed(directory, steps, model_path):
+    os.makedirs(directory, exist_ok=True)
+    completed = {'steps': steps, 'model': model_path, 'finished_on': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    atomic_write(os.path.join(directory, 'completed.json'), json.dumps(completed).encode())
+
+# Reads the completion marker of a checkpoint directory, or None if its run has not finished
+def completed_run(directory):
+    path = os.path.join(directory, 'completed.json')
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as completed_file:
+        return json.load(completed_file)
+
+# Removes the completion marker of a checkpoint directory when a new run starts in it
+def clear_completed(directory):
+    path = os.path.join(directory, 'completed.json')
+    if os.path.exists(path):
+        os.remove(path)
+
+# Prepares a checkpoint directory for a run that does not resume its latest checkpoint: the completion marker and the
+# pointer to the latest checkpoint are removed, so that the run is never resumed from the checkpoints of an older one.
+# Those are deleted as the new run writes its own
+def clear_run(directory):
+    clear_completed(directory)
+    path = os.path.join(directory, 'latest.json')
+    if os.path.exists(path):
+        os.remove(path)
+
+# Loads a model from a checkpoint written by BackgroundCheckpointCallback, with its replay buffer and VecNormalize
+# statistics if the checkpoint has them
+def load_checkpoint(checkpoint, model_type, env, device, verbose, log_dir):
+    if checkpoint.get('vec_normalize'):
+        with open(checkpoint['vec_normalize'], 'rb') as vec_normalize_file:
+            vec_normalize = pickle.load(vec_normalize_file)
+        vec_normalize.set_venv(env)
+        env = vec_normalize
+    model = model_type.load(checkpoint['model'], env=env, device=device, verbose=verbose, tensorboard_log=log_dir)
+    if checkpoint.get('replay_buffer') and hasattr(model, 'replay_buffer'):
+        model.load_replay_buffer(checkpoint['replay_buffer'])
+    return model
+
+# Saves checkpoints every save_steps steps and/or every save_minutes minutes. The model, and optionally the replay
+# buffer, are serialized to memory in the training loop, which keeps the checkpoint consistent, and written to disk by
+# a background thread while training goes on. latest.json points to the newest complete checkpoint, and only the keep
+# newest checkpoints are kept (all of them with keep=0). The step count the run trains to, target_steps, is kept in
+# latest.json, so that a resumed run stops where the interrupted one would have.
+#
+# After install_signal_handlers, SIGTERM and SIGUSR1 (sent by Slurm before the time limit, see --signal) make the
+# callback write a final checkpoint, wait for it and stop training. `interrupted` is then True
+class BackgroundCheckpointCallback(BaseCallback):
+    def __init__(self, directory, name_prefix, save_steps=None, save_minutes=None, keep=2, save_replay_buffer=False, verbose=0, target_steps=None):
+        super().__init__(verbose)
+        self.directory = directory
+        self.name_prefix = name_prefix
+        self.target_steps = target_steps
+        self.save_steps = save_steps
+        self.save_minutes = save_minutes
+        self.keep = keep
+        self.save_replay_buffer = save_replay_buffer
+        self.last_save_steps = 0
+        self.last_save_time = time.monotonic()
+        self.writer = None
+        self.writer_error = None
+        self.stop_signal = None
+        self.interrupted = False
+        os.makedirs(directory, exist_ok=True)
+
+    # Makes SIGTERM and SIGUSR1 trigger a final checkpoint. Must be called from the main thread
+    def install_signal_handlers(self, signals=(signal.SIGTERM, signal.SIGUSR1)):
+        for signum in signals:
+            signal.signal(signum, self._on_signal)
+
+    # Only sets a flag, the checkpoint is written by the training loop at its next step
+    def _on_signal(self, signum, frame):
+        self.stop_signal = signum
+
+    def _on_training_start(self):
+        self.last_save_steps = self.num_timesteps
+        self.last_save_time = time.monotonic()
+
+    def _on_step(self):
+        if self.writer_error is not None:
+            raise self.writer_error
+        if self.stop_signal is not None:
+            print(f'Received {signal.Signals(self.stop_signal).name} at step {self.num_timesteps}, saving a final checkpoint')
+            self.save()
+            self.wait()
+            self.interrupted = True
+            return False
+        due_steps = self.save_steps and self.num_timesteps - self.last_save_steps >= self.save_steps
+        due_time = self.save_minutes and time.monotonic() - self.last_save_time >= self.save_minutes * 60
+        if due_steps or due_time:
+            self.save()
+        return True
+
+    def _on_training_end(self):
+        self.wait()
+
+    # Snapshots the model in memory and hands it to the writer thread. A previous write still in progress is waited
+    # for first, so at most one snapshot is held in memory besides the one being written
+    def save(self):
+        steps = self.num_timesteps
+        files = {}
+        model_buffer = io.BytesIO()
+        self.model.save(model_buffer)
+        files['model'] = (f'{self.name_prefix}_{steps}_steps.zip', model_buffer.getvalue())
+        if self.save_replay_buffer and getattr(self.model, 'replay_buffer', None) is not None:
+            # Pickled like save_replay_buffer does, which closes the file it is given
+            replay_buffer = pickle.dumps(self.model.replay_buffer, protocol=pickle.HIGHEST_PROTOCOL)
+            files['replay_buffer'] = (f'{self.name_prefix}_replay_buffer_{steps}_steps.pkl', replay_buffer)
+        vec_normalize = self.model.get_vec_normalize_env()
+        if vec_normalize is not None:
+            files['vec_normalize'] = (f'{self.name_prefix}_vecnormalize_{steps}_steps.pkl', pickle.dumps(vec_normalize))
+
+        self.wait()
+        self.writer = threading.Thread(target=self._write, args=(steps, files), daemon=True)
+        self.writer.start()
+        self.last_save_steps = steps
+        self.last_save_time = time.monotonic()
+
+    # Waits for the checkpoint being written, if any
+    def wait(self):
+        if self.writer is not None:
+            self.writer.join()
+            self.writer = None
+        if self.writer_error is not None:
+            raise self.writer_error
+
+    def _write(self, steps, files):
+        try:
+            start = time.perf_counter()
+            for name, data in files.values():
+                atomic_write(os.path.join(self.directory, name), data)
+            latest = {'steps': steps, 'target_steps': self.target_steps, 'saved_on': time.strftime('%Y-%m-%dT%H:%M:%S')}
+            latest.update({key: name for key, (name, _) in files.items()})
+            atomic_write(os.path.join(self.directory, 'latest.json'), json.dumps(latest).encode())
+            self._remove_old_checkpoints()
+            if self.verbose >= 1:
+                size = sum(len(data) for _, data in files.values())
+                print(f'Saved checkpoint at step {steps} ({size / 2**20:.1f} MB) in {time.perf_counter() - start:.2f}s')
+        except Exception as error:
+            self.writer_error = error
+
+    # Deletes all but the keep newest checkpoints, with their replay buffers and VecNormalize statistics. Checkpoints
+    # are ordered by when they were written, so that a new run replaces the checkpoints left by an older one
+    def _remove_old_checkpoints(self):
+        if not self.keep:
+            return
+        pattern = re.compile(re.escape(self.name_prefix) + r'_(?:replay_buffer_|vecnormalize_)?(\d+)_steps\.(?:zip|pkl)$')
+        files = {}
+        for path in glob.glob(os.path.join(self.directory, f'{glob.escape(self.name_prefix)}_*_steps.*')):
+            match = pattern.match(os.path.basename(path))
+            if match:
+                files.setdefault(int(match.group(1)), []).append(path)
+        newest_first = sorted(files.values(), key=lambda paths: max(os.path.getmtime(path) for path in paths), reverse=True)
+        for paths in newest_first[self.keep:]:
+            for path in paths:
+                os.remove(path)
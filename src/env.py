@@ -1,209 +1,340 @@
-import copy
-import pygame
+import os
+import time
 import gymnasium as gym
 from gymnasium import spaces
-from shapely import Polygon
-from shapely.geometry import Point
 import numpy as np
-from src.utils import binary_list_to_decimal, decode_action
-from itertools import product
+from src.field import FieldSpec
+from src.render import FieldRenderer
+from src.utils import decode_table
 
-# The agricultural field environment
-class ThreeAgentGridworldEnv(gym.Env):
+# Movements corresponding to each action: up, down, left, right, none
+MOVEMENTS = ((-1, 0), (1, 0), (0, -1), (0, 1), (0, 0))
+
+# Phases of a step timed when profiling is enabled
+STEP_PHASES = ('decode', 'bounds', 'visited', 'weeds', 'collisions', 'obs')
+
+# The agricultural field environment, with one agent for each initial position in the config
+class MultiAgentGridworldEnv(gym.Env):
     metadata = {'render_modes': ['human', 'print', 'rgb_array'], "render_fps": 4}    
-    def __init__(self, seed=None, render_mode=None, env_config=None):
-        super(ThreeAgentGridworldEnv, self).__init__()
-        self.config = copy.deepcopy(env_config)
-        self.poly_vertices = self.config['field']
-        self.Poly = Polygon(self.poly_vertices) # Get the points of the polygon
+    def __init__(self, seed=None, render_mode=None, env_config=None, obs_mode='decimal', action_mode='discrete', profile=None, profile_interval=1000):
+        super(MultiAgentGridworldEnv, self).__init__()
+        self.config = env_config
+        # Compiled field shared by all environments of the experiment, built here if the config has none. With a
+        # field pool (see load_field_pool), a field of the pool is sampled on each reset instead
+        self.field_pool = self.config.get('field_pool')
+        self.field_index = None
+        self._set_field(self.config.get('field_spec') or FieldSpec.from_config(self.config))
         self.window_size = 800  # The size of the PyGame window        
-        self.grid_size = self.config['grid_size'] # Size of the grid
-        self.outer_boundary = self.Poly.buffer(distance=2) # outer boundary with buffer of distance 2
-
-        # Observation points
-        self.observation_points = self.obs_points()
-        self.observation_length = len(self.observation_points)
-        self.observation_map = {tuple(v):i for i,v in enumerate(self.observation_points)}
+        self.observation_length = self.field_spec.observation_length
 
-        # Keep track of visited states and count steps
+        # Keep track of visited states and count steps. Grids are indexed by cell + 1, so that moves one step
+        # outside of the field can be stored without bounds checks
         self.step_count = 0
-        self.visited = set()
-        self.infected_locations = self.config['infected_locations']
-        
-        self.infected_length = len(self.infected_locations)
+        self.visited = np.zeros((self.field_spec.padded_size, self.field_spec.padded_size), dtype=np.uint8)
+        self.num_agents = len(self.init_positions)
+        self.agent_positions = self.init_positions.copy()
+        self.targets = [None] * self.num_agents # Cells the agents tried to move to in the last step
+        self.agent_keys = [f'agent{i + 1}' for i in range(self.num_agents)]
+
+        # Weeds are stored in the shared grid of weed indices and a bitmask of collected weeds, where the first
+        # weed in the config is the most significant bit. Fields of a pool may have fewer weeds than the one with the
+        # most, whose number sets the size of the observation
         self.infected_state_length = 2**10 # 10 weeds max, binary to decimal
-        self.infected_dict = {v:0 for v in self.infected_locations} # dictionary of locations
+        self.observed_weeds = self.field_pool.max_weeds if self.field_pool is not None else self.infected_length
+        self.collected = 0
+        self.weed_state = np.zeros(self.observed_weeds, dtype=np.int64) # The same bits, one entry per weed
         
         # Action and observation space
-        self.action_space = spaces.Discrete(5 ** 3)  # 5 possible actions for 3 agents
-        self.observation_space = spaces.MultiDiscrete([self.observation_length, self.observation_length, self.observation_length, self.infected_state_length])
+        # The 'discrete' action mode encodes the movements of all agents as one number decoded through a lookup table,
+        # the 'multidiscrete' mode takes one movement per agent and avoids a 5 ** num_agents wide action space
+        assert action_mode in ['discrete', 'multidiscrete'] # Check if the action mode is correct
+        self.action_mode = action_mode
+        if self.action_mode == 'multidiscrete':
+            self.action_space = spaces.MultiDiscrete([5] * self.num_agents)
+        else:
+            self.action_space = spaces.Discrete(5 ** self.num_agents)  # 5 possible actions for each agent
+            self.decode_table = decode_table(self.num_agents)
+        # The 'decimal' observation mode encodes the collected weeds as one number, the 'bits' mode as one 0/1 entry per weed
+        assert obs_mode in ['decimal', 'bits'] # Check if the observation mode is correct
+        self.obs_mode = obs_mode
+        if self.obs_mode == 'bits':
+            self.observation_space = spaces.MultiDiscrete([self.observation_length] * self.num_agents + [2] * self.observed_weeds)
+        else:
+            if self.observed_weeds > 10:
+                raise ValueError(f"The 'decimal' observation mode supports at most 10 weeds, the field has {self.observed_weeds}. Use obs_mode='bits' instead")
+            self.observation_space = spaces.MultiDiscrete([self.observation_length] * self.num_agents + [self.infected_state_length])
         
         assert render_mode is None or render_mode in self.metadata["render_modes"] # Check if the render mode is correct
         self.render_mode = render_mode
-        # If human-rendering is used, `self.window` will be a reference
-        # to the window that we draw to. `self.clock` will be a clock that is used
-        # to ensure that the environment is rendered at the correct framerate in
-        # human-mode. They will remain `None` until human-mode is used for the
-        # first time.
+        # Frames are drawn with NumPy by `self.renderer`, built on the first render call. If human-rendering is used,
+        # `self.window` will be a reference to the pygame window that the frames are blitted to. `self.clock` will be a
+        # clock that is used to ensure that the environment is rendered at the correct framerate in human-mode. They
+        # will remain `None` until human-mode is used for the first time, so rgb_array rendering never needs pygame
+        self.renderer = None
         self.window = None
         self.clock = None
 
+        # Profiling of the step phases, enabled with the profile argument or the GRIDWORLD_PROFILE environment variable.
+        # The profiled versions of step and reset replace the regular ones, so that disabled profiling costs nothing
+        self.profile = bool(int(os.environ.get('GRIDWORLD_PROFILE', '0'))) if profile is None else profile
+        self.profile_interval = profile_interval # Number of steps between profile entries in info
+        self.profile_totals = {phase: 0 for phase in STEP_PHASES + ('reset',)}
+        self.profile_calls = {phase: 0 for phase in STEP_PHASES + ('reset',)}
+        if self.profile:
+            self.step = self._profiled_step
+            self.reset = self._profiled_reset
+
         # Reset the environment and start
         self.reset(seed=seed)
 
-    def obs_points(self):
-        xs = np.arange(0, 100, 1)
-        ys = np.arange(0, 100, 1)
-        obs_points = list(product(xs, ys))
-        return obs_points
-    
+    # Uses a compiled field: its grids, start positions and weeds
+    def _set_field(self, field_spec):
+        self.field_spec = field_spec
+        self.poly_vertices = field_spec.vertices
+        self.grid_size = field_spec.grid_size # Size of the grid
+        self.field_mask = field_spec.field_mask # Rasterized field for bounds checks
+        self.init_positions = field_spec.init_positions
+        self.weed_locations = field_spec.weed_locations
+        self.infected_length = field_spec.infected_length
+        self.weed_index = field_spec.weed_index
+        self.weed_index_flat = self.weed_index.reshape(-1)
+        self.cell_strides = np.array([self.weed_index.shape[1], 1], dtype=np.int64) # Flat indices of padded cells
+        self.cell_offset = self.weed_index.shape[1] + 1
+        self.weed_bits = field_spec.weed_bits
+        self.all_collected = field_spec.all_collected
+        self.renderer = None # Drawn for the previous field
+
+    # Weed locations that have not been collected yet
+    @property
+    def infected_locations(self):
+        return [loc for loc, bit in zip(self.weed_locations, self.weed_bits) if not self.collected & bit]
+
+    # Cells visited in the current episode
+    @property
+    def visited_cells(self):
+        return [tuple(cell) for cell in np.argwhere(self.visited) - 1]
+
     def _get_obs(self):
-        a1, a2, a3 = self.agent_positions[0], self.agent_positions[1], self.agent_positions[2]
-        info = {'agent1': a1, 'agent2': a2, 'agent3': a3, 'step_count': self.step_count}
-        p1,p2,p3 = self.observation_map[tuple(a1)], self.observation_map[tuple(a2)], self.observation_map[tuple(a3)]
-        infected = binary_list_to_decimal(list(self.infected_dict.values()))
-        state = np.array([p1,p2,p3,infected]) # convert the infected binary list to decimal
+        positions = self.agent_positions
+        info = {key: position for key, position in zip(self.agent_keys, positions.copy())}
+        info['step_count'] = self.step_count
+        if self.field_pool is not None:
+            info['field'] = self.field_index
+        state = np.empty(self.observation_space.shape, dtype=np.int64)
+        state[:self.num_agents] = positions[:, 0] * 100 + positions[:, 1]
+        if self.obs_mode == 'bits':
+            state[self.num_agents:] = self.weed_state
+        else:
+            state[self.num_agents] = self.collected
         return state, info
 
+    # With a field pool, a random field is used for each episode, or the one given as options={'field': index}
     def reset(self, seed=None, options={}):
         super().reset(seed=seed)
-        self.visited = set()
+        if self.field_pool is not None:
+            self._sample_field(options)
+        self.visited.fill(0)
         self.step_count = 0
-        self.infected_locations = copy.deepcopy(self.config['infected_locations'])
-        self.infected_dict = {v:0 for v in self.infected_locations} # 0 for unvisited infected locations, 1 for visited
-        self.agent_positions = copy.deepcopy(self.config['init_positions'])
+        self.collected = 0 # bit set for visited infected locations
+        self.weed_state.fill(0)
+        self.agent_positions[:] = self.init_positions
         return self._get_obs()
 
-    def step(self, action):
-        # Placeholder for terminal state and rewards
-        terminated, truncated = False, False
-        rewards = 0
-        self.step_count += 1
+    # Switches to a field of the pool. Only the views of the field's rows in the pool are taken, nothing is parsed or
+    # rasterized
+    def _sample_field(self, options=None):
+        if options and options.get('field') is not None:
+            self.field_index = int(options['field'])
+        else:
+            self.field_index = int(self.np_random.integers(len(self.field_pool)))
+        self._set_field(self.field_pool.field_spec(self.field_index))
 
-        # Define the movements corresponding to each action
-        movements = [(-1, 0), (1, 0), (0, -1), (0, 1), (0, 0)]  # up, down, left, right, none
-        
-        # Update the positions of both agents
-        decoded_action = decode_action(action)
-        for i, act in enumerate(decoded_action):
+    # Copies of the state of the episode, which can be restored with set_state(**state)
+    def get_state(self):
+        return {
+            'agent_positions': self.agent_positions.copy(),
+            'weed_state': self.weed_state.copy(),
+            'visited': self.visited.copy(),
+            'step_count': self.step_count,
+            'field': self.field_index,
+        }
+
+    # Restores a state, e.g. from a trajectory log: the agent positions, the 0/1 state of each weed and optionally the
+    # cells visited so far or the padded visited grid of get_state, which replace the visited grid. With a field
+    # pool, the field of the state can be given too
+    def set_state(self, agent_positions, weed_state, visited_cells=None, step_count=None, visited=None, field=None):
+        if field is not None and self.field_pool is not None and field != self.field_index:
+            self._sample_field({'field': field})
+        self.agent_positions[:] = agent_positions
+        self.weed_state[:] = weed_state
+        self.collected = 0
+        for weed in np.flatnonzero(self.weed_state[:self.infected_length]):
+            self.collected |= self.weed_bits[weed]
+        if visited is not None:
+            self.visited[:] = visited
+        elif visited_cells is not None:
+            cells = np.asarray(visited_cells, dtype=np.int64).reshape(-1, 2)
+            self.visited.fill(0)
+            self.visited[cells[:, 0] + 1, cells[:, 1] + 1] = 1
+        if step_count is not None:
+            self.step_count = step_count
+        return self._get_obs()
+
+    # Moves the agents that stay inside the field, storing the cells each agent tried to move to.
+    # With a handful of agents, plain Python loops are faster than NumPy calls on tiny arrays. The grids and the weed
+    # state are preallocated, but a step still makes small lists and tuples: a version doing the moves, visits and
+    # collision check with take/ufunc calls into preallocated arrays ran at about 12-15k steps/s on set 1 against
+    # 21-22k for the loops (bench_env.py, dummy, 1 env), as every NumPy call on three agents costs about a microsecond
+    def _move_agents(self, decoded_action):
+        rewards = 0
+        positions, targets = self.agent_positions, self.targets
+        for i, (act, (x, y)) in enumerate(zip(decoded_action, positions.tolist())):
 
-            movement = movements[act] # What movement to take
-            new_position = self.agent_positions[i] + movement # New position after movement
+            dx, dy = MOVEMENTS[act] # What movement to take
+            x, y = x + dx, y + dy # New position after movement
+            targets[i] = (x, y)
             
             # Ensure the new position is within bounds
-            new_p = Point(new_position[0], new_position[1])
-            if self.Poly.contains(new_p):
-                self.agent_positions[i] = new_position
+            if self.field_mask.contains(x, y):
+                positions[i] = x, y
             else:
                 rewards -= 10
-            if tuple(new_position) in self.visited:
+        return rewards
+
+    # Marks the cells the agents tried to move to as visited, in agent order
+    def _visit_targets(self):
+        rewards = 0
+        for x, y in self.targets:
+            if self.visited[x + 1, y + 1]:
                 rewards -= 10
             else:
                 rewards -= 1
-            self.visited.add(tuple(new_position))
-        
-        # Check if an infected location is visited
+            self.visited[x + 1, y + 1] = 1
+        return rewards
+
+    # Returns the number of agents on infected cells that were not visited before this step. The weeds under the agents
+    # are detected with array lookups in the weed index grid and the 0/1 weed state, and only collected weeds update
+    # the bitmask
+    def _collect_weeds(self):
         # TODO: Should we make a dedicated action for removing the weed instead of doing it automatically?
         # TODO: Perhaps adding a cost of removing the weed since real drones will have limited herbicide and should be discouraged from wasting it
-        infected_visited = [x for x in self.agent_positions if tuple(x) in self.infected_locations] # If infected cells are visited
-        for v in infected_visited:
-            if tuple(v) in self.infected_locations:
-                self.infected_locations.remove(tuple(v))
-                self.infected_dict[tuple(v)] = 1
-        
-        if infected_visited:
-            rewards += 100 * len(infected_visited) 
+        weeds = self.weed_index_flat.take(np.dot(self.agent_positions, self.cell_strides) + self.cell_offset)
+        detected = weeds >= 0
+        if not np.count_nonzero(detected): # Most steps find no weed
+            return 0
+        detected[detected] = self.weed_state[weeds[detected]] == 0
+        collected = np.unique(weeds[detected])
+        self.weed_state[collected] = 1
+        for weed in collected:
+            self.collected |= self.weed_bits[weed]
+        return int(np.count_nonzero(detected))
 
-        if sum(list(self.infected_dict.values()))==self.infected_length:
-            rewards += 100000
-            terminated = True
+    # Checks if any two agents are at the same position: the occupied cells are fewer than the agents
+    def _agents_collide(self):
+        return len(set(map(tuple, self.agent_positions.tolist()))) < self.num_agents
+
+    # Decodes a discrete action into the movement of each agent
+    def _decode_action(self, action):
+        return self.decode_table[action].tolist() if self.action_mode == 'discrete' else np.asarray(action).tolist()
+
+    # Rewards of the weeds collected this step, ending the episode once every weed is collected
+    def _weed_rewards(self):
+        rewards = 100 * self._collect_weeds()
+        if self.collected == self.all_collected:
+            return rewards + 100000, True
+        return rewards, False
+
+    # If the agents meet at the same position, we can assign a reward or consider it a terminal state
+    def _collision_rewards(self):
+        if self._agents_collide():
+            return -100000, True # Infinity reward for meeting at the same position
+        return 0, False
+
+    def step(self, action):
+        self.step_count += 1
+
+        # Update the positions of the agents and the visited cells
+        rewards = self._move_agents(self._decode_action(action))
+        rewards += self._visit_targets()
+
+        # Check if an infected location is visited and if the agents collide
+        weed_rewards, collected_all = self._weed_rewards()
+        collision_rewards, collided = self._collision_rewards()
 
-        
-        # If the agents meet at the same position, we can assign a reward or consider it a terminal state
-        if np.array_equal(self.agent_positions[0], self.agent_positions[1]) or np.array_equal(self.agent_positions[0], self.agent_positions[2]) or np.array_equal(self.agent_positions[1], self.agent_positions[2]):
-            rewards -= 100000  # Infinity reward for meeting at the same position
-            terminated = True
-        
         obs, info = self._get_obs()
-        return obs, rewards, terminated, truncated, info
+        return obs, rewards + weed_rewards + collision_rewards, collected_all or collided, False, info
+
+    # Same phases as step, timing each of them
+    def _profiled_step(self, action):
+        timer, totals, calls = time.perf_counter_ns, self.profile_totals, self.profile_calls
+        self.step_count += 1
+
+        t0 = timer()
+        decoded_action = self._decode_action(action)
+        t1 = timer()
+        rewards = self._move_agents(decoded_action)
+        t2 = timer()
+        rewards += self._visit_targets()
+        t3 = timer()
+        weed_rewards, collected_all = self._weed_rewards()
+        t4 = timer()
+        collision_rewards, collided = self._collision_rewards()
+        t5 = timer()
+        obs, info = self._get_obs()
+        t6 = timer()
+
+        for phase, elapsed in zip(STEP_PHASES, (t1 - t0, t2 - t1, t3 - t2, t4 - t3, t5 - t4, t6 - t5)):
+            totals[phase] += elapsed
+            calls[phase] += 1
+        if calls['obs'] % self.profile_interval == 0:
+            info['profile'] = self.get_profile()
+        return obs, rewards + weed_rewards + collision_rewards, collected_all or collided, False, info
+
+    # Same as reset, timing it
+    def _profiled_reset(self, seed=None, options={}):
+        start = time.perf_counter_ns()
+        result = MultiAgentGridworldEnv.reset(self, seed=seed, options=options)
+        self.profile_totals['reset'] += time.perf_counter_ns() - start
+        self.profile_calls['reset'] += 1
+        return result
+
+    # Cumulative time and number of calls of each phase, only collected when profiling is enabled
+    def get_profile(self):
+        if not self.profile:
+            return {}
+        return {
+            phase: {
+                'calls': self.profile_calls[phase],
+                'total_ms': self.profile_totals[phase] / 1e6,
+                'mean_us': self.profile_totals[phase] / 1e3 / max(self.profile_calls[phase], 1),
+            }
+            for phase in STEP_PHASES + ('reset',)
+        }
 
     def render(self):
         if self.render_mode == 'print':
             grid = np.zeros((self.grid_size, self.grid_size))
-            grid[tuple(self.agent_positions[0])] = 1  # Mark the position of the first agent
-            grid[tuple(self.agent_positions[1])] = 2  # Mark the position of the second agent
+            for i, position in enumerate(self.agent_positions):
+                grid[tuple(position)] = i + 1  # Mark the position of each agent
             print(grid)
         else:
-            if self.window is None and self.render_mode == "human": # Initialize pygame if it is not initialized
-                pygame.init()
-                pygame.display.init()
-                self.window = pygame.display.set_mode(
-                    (self.window_size, self.window_size)
-                )
-            if self.clock is None and self.render_mode == "human":
-                self.clock = pygame.time.Clock()
-            
-            # Fill the canvas
-            canvas = pygame.Surface((self.window_size, self.window_size))
-            canvas.fill((255, 255, 255))
-            pix_square_size = (
-                self.window_size / self.grid_size
-            )  # The size of a single grid square in pixels
-
-            # Draw the polygon
-            pixel_poly_vertices = [(point[0] * pix_square_size, point[1] * pix_square_size) for point in self.poly_vertices]
-            pygame.draw.polygon(surface=canvas, 
-                                color=(255, 255, 0), 
-                                points=pixel_poly_vertices)
-            
-            # Draw the visited regions
-            for p in self.visited:
-                pygame.draw.rect(
-                canvas,
-                pygame.Color(100, 100, 100, a=0.5),
-                pygame.Rect(
-                    pix_square_size * np.array(p),
-                    (pix_square_size, pix_square_size),
-                ),
-                )
-            # Draw agent1 (square)
-            pygame.draw.rect(
-                canvas,
-                (255, 0, 0),
-                pygame.Rect(
-                    pix_square_size * self.agent_positions[0],
-                    (pix_square_size, pix_square_size),
-                ),
-            )
-            # Draw agent2 (circle)
-            pygame.draw.circle(
-                canvas,
-                (0, 0, 255),
-                (self.agent_positions[1] + 0.5) * pix_square_size,
-                pix_square_size / 3,
-            )
-            # Draw agent3 (circle)
-            pygame.draw.circle(
-                canvas,
-                (0, 255, 0),
-                (self.agent_positions[2] + 0.5) * pix_square_size,
-                pix_square_size / 3,
-            )
-            # Draw infected locations
-            for l in self.infected_locations:
-                pygame.draw.rect(
-                    canvas,
-                    (0, 255, 255),
-                    pygame.Rect(
-                        pix_square_size * np.array(l),
-                        (pix_square_size, pix_square_size),
-                    ),
-                )
-
+            if self.renderer is None:
+                self.renderer = FieldRenderer(self.field_spec, self.window_size)
+            frame = self.renderer.render(self.visited, self.agent_positions.tolist(), self.weed_state.tolist())
 
             if self.render_mode == "human":
-                # The following line copies our drawings from `canvas` to the visible window
-                self.window.blit(canvas, canvas.get_rect())
+                import pygame
+                if self.window is None: # Initialize pygame if it is not initialized
+                    pygame.init()
+                    pygame.display.init()
+                    self.window = pygame.display.set_mode(
+                        (self.window_size, self.window_size)
+                    )
+                if self.clock is None:
+                    self.clock = pygame.time.Clock()
+
+                # The following line copies the frame to the visible window, pygame surfaces are indexed by (x, y)
+                pygame.surfarray.blit_array(self.window, frame.transpose(1, 0, 2))
                 pygame.event.pump()
                 pygame.display.update()
 
@@ -214,11 +345,13 @@ class ThreeAgentGridworldEnv(gym.Env):
                 pygame.event.get()
 
             elif self.render_mode == 'rgb_array':  # rgb_array
-                return np.transpose(
-                    np.array(pygame.surfarray.pixels3d(canvas)), axes=(1, 0, 2)
-                )
+                return frame
             
     def close(self):
         if self.window is not None:
+            import pygame
             pygame.display.quit()
             pygame.quit()
+
+# The environment of the paper, with the 3 agents of the provided experiments
+ThreeAgentGridworldEnv = MultiAgentGridworldEnv
@@ -0,0 +1,100 @@
+import numpy as np
+
+# Rasterizes a field polygon into a boolean grid, where mask[x + pad, y + pad] tells whether the grid point (x, y)
+# lies inside the polygon. The grid covers -pad..size+pad-1 on both axes, with size at least grid_size and large
+# enough to hold every vertex.
+#
+# Boundary rule: a point is inside only if it lies strictly in the interior of the polygon, which is what
+# shapely's Polygon.contains returns. Points exactly on an edge or a vertex are outside. Edges are tested with
+# exact integer cross products and interior points with the even-odd rule, so integer vertices give exact results.
+def rasterize_polygon(vertices, grid_size, pad=1):
+    vertices = np.asarray(vertices)
+    size = max(grid_size, int(np.ceil(vertices.max())) + 1)
+    coords = np.arange(-pad, size + pad)
+    px, py = np.meshgrid(coords, coords, indexing='ij')
+
+    inside = np.zeros(px.shape, dtype=bool)
+    boundary = np.zeros(px.shape, dtype=bool)
+    for (x1, y1), (x2, y2) in zip(vertices, np.roll(vertices, -1, axis=0)):
+        dx, dy = x2 - x1, y2 - y1
+        cross = dx * (py - y1) - dy * (px - x1)
+
+        # Points on the edge segment
+        boundary |= (cross == 0) & (px >= min(x1, x2)) & (px <= max(x1, x2)) & (py >= min(y1, y2)) & (py <= max(y1, y2))
+
+        # Even-odd rule: count the edges crossed by a ray going from the point towards +x
+        if dy != 0:
+            spans = (y1 > py) != (y2 > py)
+            inside ^= spans & ((cross > 0) if dy > 0 else (cross < 0))
+    return inside & ~boundary
+
+# Occupancy grid of a field with constant time lookups, built once per field. An already rasterized padded grid,
+# e.g. one stored in a field pool, can be given instead of rasterizing the polygon
+class FieldMask:
+    def __init__(self, vertices, grid_size, padded=None):
+        self.padded = rasterize_polygon(vertices, grid_size, pad=1) if padded is None else padded
+        self.padded.setflags(write=False)
+        self.mask = self.padded[1:-1, 1:-1]
+        self.size = self.mask.shape[0]
+
+    # Checks if a single cell is inside the field, cells outside the grid are never inside
+    def contains(self, x, y):
+        return -1 <= x <= self.size and -1 <= y <= self.size and bool(self.padded[x + 1, y + 1])
+
+    # Checks an array of cells with shape (..., 2). Cells must be at most one step outside the grid
+    def contains_many(self, positions):
+        return self.padded[positions[..., 0] + 1, positions[..., 1] + 1]
+
+# Width of the grid used to number cells in observations, fields can be at most 100x100
+OBSERVATION_WIDTH = 100
+
+# Compiled, read-only parts of an experiment. Building one is costly, so a single FieldSpec is shared by all
+# environments of a process (see load_experiment). The field mask and weed index grid can be given precompiled, as
+# field pools do, which makes building one cheap
+class FieldSpec:
+    def __init__(self, vertices, grid_size, init_positions, infected_locations, field_mask=None, weed_index=None):
+        self.vertices = [tuple(v) for v in vertices]
+        self.grid_size = grid_size
+        self.field_mask = field_mask or FieldMask(self.vertices, grid_size)
+        self.padded_size = self.field_mask.size + 2
+        self.observation_length = OBSERVATION_WIDTH * OBSERVATION_WIDTH
+
+        self.init_positions = np.array(init_positions, dtype=np.int64)
+        self.init_positions.setflags(write=False)
+
+        # Weeds are numbered by their order in the config, the first weed being the most significant bit
+        self.weed_locations = [tuple(loc) for loc in infected_locations]
+        self.infected_length = len(self.weed_locations)
+        self.weed_bits = tuple(1 << (self.infected_length - 1 - i) for i in range(self.infected_length))
+        self.all_collected = (1 << self.infected_length) - 1
+
+        # Grid of weed indices, -1 for healthy cells. Indexed by cell + 1 like the padded field mask
+        if weed_index is None:
+            weed_index = np.full((self.padded_size, self.padded_size), -1, dtype=np.int64)
+            for i, (x, y) in enumerate(self.weed_locations):
+                weed_index[x + 1, y + 1] = i
+        self.weed_index = weed_index
+        self.weed_index.setflags(write=False)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['field'], config['grid_size'], config['init_positions'], config['infected_locations'])
+
+    # Observation index of a cell and the cell of an observation index
+    @staticmethod
+    def cell_index(x, y):
+        return x * OBSERVATION_WIDTH + y
+
+    @staticmethod
+    def index_cell(index):
+        return divmod(index, OBSERVATION_WIDTH)
+
+# Compares the field mask with shapely's Polygon.contains, returning the cells where they disagree
+def verify_field_mask(vertices, grid_size):
+    from shapely import Polygon, contains_xy
+    field_mask = FieldMask(vertices, grid_size)
+    coords = np.arange(-1, field_mask.size + 1)
+    xs, ys = np.meshgrid(coords, coords, indexing='ij')
+    expected = contains_xy(Polygon(vertices), xs, ys)
+    mismatches = np.argwhere(expected != field_mask.padded) - 1
+    return [tuple(cell) for cell in mismatches]
@@ -0,0 +1,118 @@
+import json
+import os
+import numpy as np
+import yaml
+from src.field import FieldMask, FieldSpec
+
+# A field pool is a directory of .npy arrays holding many compiled experiments, read through memory maps. Fields are
+# padded to the largest grid of the pool, so that every array has one row per field:
+#   masks           (fields, size + 2, size + 2) bool, the padded field masks
+#   weed_index      (fields, size + 2, size + 2) int8, or int16/int32 for more weeds, the padded weed index grids
+#   vertices        (fields, max vertices, 2), with num_vertices per field
+#   init_positions  (fields, agents, 2)
+#   weeds           (fields, max weeds, 2), with num_weeds per field
+#   grid_sizes      (fields,)
+# The processes using a pool share the pages of these files instead of each keeping a copy of every field
+POOL_ARRAYS = ('masks', 'weed_index', 'vertices', 'num_vertices', 'init_positions', 'weeds', 'num_weeds', 'grid_sizes')
+
+# Compiles experiment files into a field pool. The arrays are written through memory maps, so pools of any size can be
+# built without holding them in memory. Every experiment must have the same number of agents
+def build_field_pool(experiment_paths, path):
+    configs = []
+    for experiment_path in experiment_paths:
+        with open(experiment_path, 'r') as experiment_file:
+            configs.append(yaml.load(experiment_file, Loader=yaml.FullLoader))
+    num_agents = {len(config['init_positions']) for config in configs}
+    if len(num_agents) != 1:
+        raise ValueError(f'Every experiment of a field pool must have the same number of agents, found {sorted(num_agents)}')
+    size = max(max(config['grid_size'], int(np.max(config['field'])) + 1) for config in configs)
+    max_vertices = max(len(config['field']) for config in configs)
+    max_weeds = max(len(config['infected_locations']) for config in configs)
+
+    os.makedirs(path, exist_ok=True)
+    open_array = lambda name, shape, dtype, fill: open_pool_array(path, name, shape, dtype, fill)
+    masks = open_array('masks', (len(configs), size + 2, size + 2), bool, False)
+    weed_index = open_array('weed_index', (len(configs), size + 2, size + 2), weed_index_dtype(max_weeds), -1)
+    vertices = open_array('vertices', (len(configs), max_vertices, 2), np.int64, 0)
+    num_vertices = open_array('num_vertices', (len(configs),), np.int64, 0)
+    init_positions = open_array('init_positions', (len(configs), num_agents.pop(), 2), np.int64, 0)
+    weeds = open_array('weeds', (len(configs), max_weeds, 2), np.int64, 0)
+    num_weeds = open_array('num_weeds', (len(configs),), np.int64, 0)
+    grid_sizes = open_array('grid_sizes', (len(configs),), np.int64, 0)
+
+    for i, config in enumerate(configs):
+        field_spec = FieldSpec.from_config(config)
+        padded = field_spec.field_mask.padded
+        masks[i, :len(padded), :len(padded)] = padded
+        weed_index[i, :len(padded), :len(padded)] = field_spec.weed_index
+        vertices[i, :len(config['field'])] = config['field']
+        num_vertices[i] = len(config['field'])
+        init_positions[i] = config['init_positions']
+        weeds[i, :len(config['infected_locations'])] = config['infected_locations']
+        num_weeds[i] = len(config['infected_locations'])
+        grid_sizes[i] = config['grid_size']
+
+    for array in (masks, weed_index, vertices, num_vertices, init_positions, weeds, num_weeds, grid_sizes):
+        array.flush()
+    with open(os.path.join(path, 'meta.json'), 'w') as meta_file:
+        json.dump({'fields': len(configs), 'size': size, 'experiments': [str(p) for p in experiment_paths]}, meta_file)
+
+# Smallest signed integer type holding the weed indices 0..max_weeds - 1 and -1 for healthy cells
+def weed_index_dtype(max_weeds):
+    for dtype in (np.int8, np.int16, np.int32):
+        if max_weeds - 1 <= np.iinfo(dtype).max:
+            return dtype
+    raise ValueError(f'Field pools can hold at most {np.iinfo(np.int32).max + 1} weeds per field, got {max_weeds}')
+
+# Creates one array of a field pool as a .npy file and returns its writable memory map
+def open_pool_array(path, name, shape, dtype, fill):
+    array = np.lib.format.open_memmap(os.path.join(path, f'{name}.npy'), mode='w+', dtype=dtype, shape=shape)
+    array[:] = fill
+    return array
+
+# Read-only view of a field pool. Pickling a pool only sends its path, so subprocess workers open their own memory
+# maps of the same files
+class FieldPool:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r') as meta_file:
+            self.meta = json.load(meta_file)
+        # Plain ndarray views of the memory maps, which index faster than np.memmap
+        for name in POOL_ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r').view(np.ndarray))
+        self.num_agents = self.init_positions.shape[1]
+        self.max_weeds = self.weeds.shape[1]
+
+    def __len__(self):
+        return len(self.num_weeds)
+
+    def __getstate__(self):
+        return self.path
+
+    def __setstate__(self, path):
+        self.__init__(path)
+
+    # Field spec of one field, using the stored mask and weed index grids instead of rasterizing the polygon
+    def field_spec(self, i):
+        return FieldSpec(
+            self.vertices[i, :self.num_vertices[i]].tolist(),
+            int(self.grid_sizes[i]),
+            self.init_positions[i],
+            self.weeds[i, :self.num_weeds[i]].tolist(),
+            field_mask=FieldMask(None, None, padded=self.masks[i]),
+            weed_index=self.weed_index[i],
+        )
+
+# Loads a field pool as an environment config. Environments given this config sample a field from the pool on each
+# reset, the first field is used until then
+def load_field_pool(path):
+    pool = FieldPool(path)
+    field_spec = pool.field_spec(0)
+    return {
+        'field_pool': pool,
+        'field_spec': field_spec,
+        'field': field_spec.vertices,
+        'grid_size': field_spec.grid_size,
+        'init_positions': list(field_spec.init_positions),
+        'infected_locations': field_spec.weed_locations,
+    }
@@ -0,0 +1,340 @@
+import collections
+import os
+import pickle
+import queue
+import secrets
+import stat
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+import numpy as np
+from src.numpy_policy import NumpyPolicy
+
+# Algorithms of the models that can be served, read from the start of their file names
+ALGORITHMS = ['A2C', 'PPO', 'TRPO', 'DQN', 'ARS', 'RecurrentPPO']
+
+# Parses a server address: host:port for TCP, anything else is the path of a Unix socket
+def parse_address(address):
+    host, _, port = address.rpartition(':')
+    if host and port.isdigit():
+        return (host, int(port))
+    return address
+
+# Generates a random authkey and writes it to a file only the current user can read, for servers started without a
+# key. Clients read it with read_authkey
+def generate_authkey(path):
+    authkey = secrets.token_hex(32)
+    key_file = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.fchmod(key_file, 0o600) # An existing file would keep its permissions
+    with os.fdopen(key_file, 'w') as key_file:
+        key_file.write(authkey)
+    return authkey.encode()
+
+# Reads the authkey of a server, given as a string or in a file, None if neither is given
+def read_authkey(authkey=None, authkey_file=None):
+    if authkey is not None:
+        return authkey.encode()
+    if authkey_file is not None:
+        with open(authkey_file, 'r') as key_file:
+            return key_file.read().strip().encode()
+    return None
+
+# Loads a model to serve, named after its file without the extension. Exported .npz policies run with NumPy only,
+# .zip models with Stable-Baselines3
+def load_served_model(path, device='cpu'):
+    name = os.path.splitext(os.path.basename(path))[0]
+    if path.endswith('.npz'):
+        return name, NumpyPolicy(path)
+    algorithm = name.split('_')[0]
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f'Cannot tell the algorithm of {path}, model files must be named [algorithm]_*.zip')
+    from src.utils import get_algorithm
+    return name, get_algorithm(algorithm).load(path, device=device)
+
+# Request of one client, waiting in the queue of a model
+class Request:
+    def __init__(self, client, obs, episode_start, deterministic):
+        self.client = client
+        self.obs = obs
+        self.episode_start = episode_start
+        self.deterministic = deterministic
+        self.received = time.perf_counter()
+
+# Connection of one client. Replies are sent by the batching threads, so sends are serialized by a lock
+class ClientConnection:
+    def __init__(self, connection, client_id):
+        self.connection = connection
+        self.id = client_id
+        self.lock = threading.Lock()
+        self.open = True
+
+    def send(self, message):
+        try:
+            with self.lock:
+                self.connection.send(message)
+        except (OSError, EOFError):
+            self.open = False
+
+# Batch sizes and latencies of the last `window` batches and requests of a model
+class ModelMetrics:
+    def __init__(self, window=10_000):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.observations = 0
+        self.batches = 0
+        self.batch_sizes = collections.deque(maxlen=window)
+        self.latencies = {'wait': collections.deque(maxlen=window), 'predict': collections.deque(maxlen=window), 'total': collections.deque(maxlen=window)}
+
+    def record(self, batch, started, predicted, replied):
+        with self.lock:
+            self.requests += len(batch)
+            self.observations += sum(len(request.obs) for request in batch)
+            self.batches += 1
+            self.batch_sizes.append(sum(len(request.obs) for request in batch))
+            self.latencies['predict'].append(predicted - started)
+            for request in batch:
+                self.latencies['wait'].append(started - request.received)
+                self.latencies['total'].append(replied - request.received)
+
+    # Totals, the mean batch size and the 50th, 90th and 99th percentile latencies in milliseconds
+    def summary(self):
+        with self.lock:
+            summary = {'requests': self.requests, 'observations': self.observations, 'batches': self.batches}
+            summary['mean_batch'] = float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.0
+            for stage, values in self.latencies.items():
+                if values:
+                    summary[stage] = dict(zip(['p50', 'p90', 'p99'], (np.percentile(values, [50, 90, 99]) * 1e3).tolist()))
+        return summary
+
+# A served model with its request queue and batching thread. Requests are collected until max_batch observations are
+# waiting, the first of them has waited max_wait seconds, or every client of the model has a request in the batch,
+# and the batch goes through one predict call. Clients wait for the reply to each request before sending the next, so
+# no more requests can come then. The LSTM states of recurrent models are kept for each client, as clients only send
+# observations
+class ServedModel:
+    def __init__(self, name, model, max_batch, max_wait):
+        self.name = name
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.metrics = ModelMetrics()
+        self.states = {}
+        self.clients = set()
+        self.obs_nvec = np.array(model.obs_nvec if isinstance(model, NumpyPolicy) else model.observation_space.nvec)
+        self.obs_length = len(self.obs_nvec)
+        # One prediction loads lazy parts of the model before clients wait on it, and gives the shape of the state
+        _, state = model.predict(np.zeros((1, self.obs_length), dtype=np.int64), episode_start=np.ones(1, dtype=bool), deterministic=True)
+        self.zero_state = None if state is None else tuple(np.zeros_like(part) for part in state)
+        self.thread = threading.Thread(target=self.batch_loop, daemon=True)
+        self.thread.start()
+
+    def batch_loop(self):
+        while True:
+            batch = [self.requests.get()]
+            if batch[0] is None:
+                return
+            size = len(batch[0].obs)
+            deadline = batch[0].received + self.max_wait
+            while size < self.max_batch and len(batch) < len(self.clients):
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if request is None:
+                    self.requests.put(None)
+                    break
+                batch.append(request)
+                size += len(request.obs)
+            self.run_batch(batch)
+
+    # LSTM state of a client, zeros for new clients and clients whose number of environments changed
+    def client_state(self, request):
+        state = self.states.get(request.client.id)
+        if state is None or state[0].shape[1] != len(request.obs):
+            state = tuple(np.repeat(part, len(request.obs), axis=1) for part in self.zero_state)
+        return state
+
+    def run_batch(self, batch):
+        started = time.perf_counter()
+        replies = []
+        # Requests for deterministic and stochastic actions need separate predict calls
+        for deterministic in sorted({request.deterministic for request in batch}):
+            group = [request for request in batch if request.deterministic == deterministic]
+            obs = np.concatenate([request.obs for request in group])
+            episode_start = np.concatenate([request.episode_start for request in group])
+            state = None
+            if self.zero_state is not None:
+                states = [self.client_state(request) for request in group]
+                state = tuple(np.concatenate([client_state[i] for client_state in states], axis=1) for i in range(len(self.zero_state)))
+            try:
+                actions, state = self.model.predict(obs, state=state, episode_start=episode_start, deterministic=deterministic)
+            except Exception as error:
+                replies += [(request, ('error', f'{type(error).__name__}: {error}')) for request in group]
+                continue
+            offsets = np.cumsum([0] + [len(request.obs) for request in group])
+            for request, start, end in zip(group, offsets[:-1], offsets[1:]):
+                replies.append((request, ('ok', actions[start:end])))
+                if state is not None and request.client.open:
+                    self.states[request.client.id] = tuple(part[:, start:end] for part in state)
+        predicted = time.perf_counter()
+        for request, reply in replies:
+            request.client.send(reply)
+        self.metrics.record(batch, started, predicted, time.perf_counter())
+
+# Serves models to clients over a Unix socket or TCP. Each client connection is read by its own thread, which queues
+# the requests of the client for the batching thread of the requested model. Messages are pickled, so anyone who can
+# connect could run code in the server: TCP connections, which any user of the machine can open even on localhost,
+# must be authenticated with authkey. Unix sockets are created writable by their owner only and can be used without
+# one, though serve.py gives them a key too
+class InferenceServer:
+    def __init__(self, models, address, max_batch=64, max_wait=0.002, authkey=None):
+        self.models = {name: ServedModel(name, model, max_batch, max_wait) for name, model in models.items()}
+        self.address = parse_address(address)
+        if isinstance(self.address, tuple) and authkey is None:
+            raise ValueError(f'Serving on TCP address {address} needs an authkey, only Unix sockets can be used without one')
+        # A socket file left by a server that did not shut down would make binding fail
+        if isinstance(self.address, str) and os.path.exists(self.address) and stat.S_ISSOCK(os.stat(self.address).st_mode):
+            os.remove(self.address)
+        if isinstance(self.address, str):
+            # The socket file is created with the permissions left by the umask, changing them after binding would
+            # let other users connect in between
+            umask = os.umask(0o077)
+            try:
+                self.listener = Listener(self.address, authkey=authkey)
+            finally:
+                os.umask(umask)
+        else:
+            self.listener = Listener(self.address, authkey=authkey)
+        self.next_client_id = 0
+        self.closed = False
+
+    def serve_forever(self):
+        while True:
+            try:
+                connection = self.listener.accept()
+            except Exception as error:
+                if self.closed:
+                    return
+                # Failed handshakes, e.g. clients without the authkey
+                print(f'Rejected a client: {type(error).__name__}: {error}')
+                continue
+            client = ClientConnection(connection, self.next_client_id)
+            self.next_client_id += 1
+            threading.Thread(target=self.serve_client, args=(client,), daemon=True).start()
+
+    # Reads the requests of a client until it disconnects. A malformed request gets an error reply, and the client can
+    # go on sending requests
+    def serve_client(self, client):
+        try:
+            while True:
+                try:
+                    message = client.connection.recv()
+                except (EOFError, OSError):
+                    break
+                except Exception as error:
+                    client.send(('error', f'Could not read the request: {type(error).__name__}: {error}'))
+                    continue
+                try:
+                    self.handle_request(client, message)
+                except Exception as error:
+                    client.send(('error', f'Invalid request: {type(error).__name__}: {error}'))
+        finally:
+            client.open = False
+            for served in self.models.values():
+                served.clients.discard(client.id)
+                served.states.pop(client.id, None)
+            client.connection.close()
+
+    def handle_request(self, client, message):
+        if not isinstance(message, tuple) or not message:
+            raise ValueError(f'Requests must be tuples starting with their type, got {type(message).__name__}')
+        if message[0] == 'predict':
+            if len(message) != 5:
+                raise ValueError('Predict requests must be (\'predict\', model, obs, episode_start, deterministic)')
+            self.queue_request(client, *message[1:])
+        elif message[0] == 'metrics':
+            client.send(('ok', self.metrics()))
+        elif message[0] == 'models':
+            client.send(('ok', {name: served.obs_nvec.tolist() for name, served in self.models.items()}))
+        else:
+            client.send(('error', f'Unknown request {message[0]}'))
+
+    # Checks a predict request and queues it for its model. Requests that cannot be predicted are answered with an
+    # error here, so that they never reach a batch
+    def queue_request(self, client, name, obs, episode_start, deterministic):
+        served = self.models.get(name) if isinstance(name, str) else None
+        if served is None:
+            client.send(('error', f'Unknown model {name}, serving {", ".join(self.models)}'))
+            return
+        obs = np.asarray(obs)
+        if obs.ndim != 2 or obs.shape[1] != served.obs_length or len(obs) == 0:
+            client.send(('error', f'Observations of {name} must have shape (n, {served.obs_length}), got {obs.shape}'))
+            return
+        if not np.issubdtype(obs.dtype, np.integer):
+            client.send(('error', f'Observations of {name} must be integers, got {obs.dtype}'))
+            return
+        obs = obs.astype(np.int64)
+        if np.any((obs < 0) | (obs >= served.obs_nvec)):
+            client.send(('error', f'Observations of {name} are out of range'))
+            return
+        if episode_start is None:
+            episode_start = np.zeros(len(obs), dtype=bool)
+        else:
+            episode_start = np.asarray(episode_start, dtype=bool)
+            if episode_start.size != len(obs):
+                client.send(('error', f'episode_start must have one entry per observation, got {episode_start.size} for {len(obs)}'))
+                return
+            episode_start = episode_start.reshape(len(obs))
+        served.clients.add(client.id)
+        served.requests.put(Request(client, obs, episode_start, bool(deterministic)))
+
+    def metrics(self):
+        return {name: served.metrics.summary() for name, served in self.models.items()}
+
+    def close(self):
+        self.closed = True
+        self.listener.close()
+        for served in self.models.values():
+            served.requests.put(None)
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+
+# Client of an InferenceServer for one of its models. predict works like the predict of SB3 models, so run.py can use
+# either. The LSTM state of recurrent models is kept by the server, so the returned state is always None, and
+# episode_start resets it
+class InferenceClient:
+    def __init__(self, address, model, authkey=None):
+        self.connection = Client(parse_address(address), authkey=authkey)
+        self.model = model
+
+    def request(self, message):
+        self.connection.send(message)
+        try:
+            status, payload = self.connection.recv()
+        except pickle.UnpicklingError as error:
+            raise RuntimeError('Could not read the reply of the inference server, it may need an authkey') from error
+        if status == 'error':
+            raise RuntimeError(f'Inference server: {payload}')
+        return payload
+
+    def predict(self, observation, state=None, episode_start=None, deterministic=False):
+        observation = np.asarray(observation)
+        vectorized = observation.ndim == 2
+        obs = observation.reshape(-1, observation.shape[-1])
+        actions = self.request(('predict', self.model, obs, episode_start, deterministic))
+        return (actions if vectorized else actions[0]), None
+
+    # Metrics of every model of the server, see ModelMetrics.summary
+    def metrics(self):
+        return self.request(('metrics',))
+
+    # Names of the models of the server, with the number of values of each observation entry
+    def models(self):
+        return self.request(('models',))
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,167 @@
+import json
+import numpy as np
+
+# Activation functions of exported layers, by the name of their torch module
+ACTIVATIONS = {
+    'Identity': lambda x: x,
+    'Tanh': np.tanh,
+    'ReLU': lambda x: np.maximum(x, 0),
+}
+
+# Returns the weights of a torch Linear layer as an (inputs, outputs) float32 array and its bias
+def linear_weights(layer):
+    weight = layer.weight.detach().cpu().numpy().T.astype(np.float32)
+    bias = layer.bias.detach().cpu().numpy().astype(np.float32) if layer.bias is not None else np.zeros(weight.shape[1], dtype=np.float32)
+    return weight, bias
+
+# Splits the modules of an MLP into (weight, bias, activation) layers. An activation follows the layer before it
+def mlp_layers(modules):
+    layers = []
+    for module in modules:
+        name = type(module).__name__
+        if name == 'Linear':
+            layers.append([*linear_weights(module), 'Identity'])
+        elif name in ACTIVATIONS and layers:
+            layers[-1][2] = name
+        elif name != 'Identity' and name != 'Flatten':
+            raise ValueError(f'Cannot export {name} layers, supported activations are {", ".join(ACTIVATIONS)}')
+    return layers
+
+# Exports the policy network of a trained model to an .npz file that NumpyPolicy runs without torch. Only the part of
+# the network that picks actions is kept: the actor of A2C, PPO, TRPO and RecurrentPPO, the Q-network of DQN and the
+# action network of ARS. Observations must be MultiDiscrete, which SB3 one-hot encodes before the first layer
+def export_policy(model, algorithm, path):
+    policy = model.policy
+    observation_space = policy.observation_space
+    action_space = policy.action_space
+    if not hasattr(observation_space, 'nvec'):
+        raise ValueError(f'Only MultiDiscrete observations can be exported, got {observation_space}')
+    if getattr(model, 'get_vec_normalize_env', lambda: None)() is not None:
+        raise ValueError('Models trained with VecNormalize cannot be exported')
+    extractor = policy.q_net.features_extractor if algorithm == 'DQN' else policy.features_extractor
+    if type(extractor).__name__ != 'FlattenExtractor':
+        raise ValueError(f'Only policies with a FlattenExtractor can be exported, got {type(extractor).__name__}')
+
+    meta = {
+        'algorithm': algorithm,
+        'obs_nvec': [int(n) for n in observation_space.nvec],
+        'action_nvec': [int(n) for n in action_space.nvec] if hasattr(action_space, 'nvec') else [int(action_space.n)],
+        'multidiscrete': hasattr(action_space, 'nvec'),
+        # How stochastic actions are picked: sampled from the logits, epsilon-greedy, or not at all
+        'sampling': 'categorical',
+        'exploration_rate': None,
+        'lstm_layers': 0,
+    }
+    arrays = {}
+
+    if algorithm == 'DQN':
+        layers = mlp_layers(policy.q_net.q_net)
+        meta['sampling'] = 'epsilon'
+        meta['exploration_rate'] = float(model.exploration_rate)
+    elif algorithm == 'ARS':
+        layers = mlp_layers(policy.action_net)
+        meta['sampling'] = 'none'
+    else:
+        layers = mlp_layers(policy.mlp_extractor.policy_net) + mlp_layers([policy.action_net])
+        if algorithm == 'RecurrentPPO':
+            lstm = policy.lstm_actor
+            meta['lstm_layers'] = lstm.num_layers
+            meta['lstm_hidden'] = lstm.hidden_size
+            for i in range(lstm.num_layers):
+                arrays[f'lstm_w_ih{i}'] = getattr(lstm, f'weight_ih_l{i}').detach().cpu().numpy().T.astype(np.float32)
+                arrays[f'lstm_w_hh{i}'] = getattr(lstm, f'weight_hh_l{i}').detach().cpu().numpy().T.astype(np.float32)
+                arrays[f'lstm_b{i}'] = (getattr(lstm, f'bias_ih_l{i}') + getattr(lstm, f'bias_hh_l{i}')).detach().cpu().numpy().astype(np.float32)
+
+    for i, (weight, bias, activation) in enumerate(layers):
+        arrays[f'dense_w{i}'] = weight
+        arrays[f'dense_b{i}'] = bias
+    meta['activations'] = [activation for _, _, activation in layers]
+    np.savez(path, meta=np.array(json.dumps(meta)), **arrays)
+
+# Stable sigmoid, as exp overflows for large negative float32 inputs
+def sigmoid(x):
+    return 0.5 * (1 + np.tanh(0.5 * x))
+
+# Log of the summed exponentials of each row, computed like torch.logsumexp
+def log_sum_exp(x):
+    x_max = x.max(axis=1, keepdims=True)
+    return x_max + np.log(np.exp(x - x_max).sum(axis=1, keepdims=True))
+
+# Policy exported by export_policy, evaluated with NumPy only. predict works like the predict of SB3 models, so
+# run.py can use either: it takes one observation or a batch of them, and for RecurrentPPO the LSTM state and episode
+# starts, and returns the actions and the next state
+class NumpyPolicy:
+    def __init__(self, path, seed=None):
+        with np.load(path) as artifact:
+            self.meta = json.loads(str(artifact['meta']))
+            arrays = {name: artifact[name] for name in artifact.files if name != 'meta'}
+        self.algorithm = self.meta['algorithm']
+        self.obs_nvec = np.array(self.meta['obs_nvec'])
+        self.action_nvec = self.meta['action_nvec']
+        self.lstm_layers = self.meta['lstm_layers']
+        self.dense = [(arrays[f'dense_w{i}'], arrays[f'dense_b{i}'], ACTIVATIONS[activation]) for i, activation in enumerate(self.meta['activations'])]
+        self.lstm = [(arrays[f'lstm_w_ih{i}'], arrays[f'lstm_w_hh{i}'], arrays[f'lstm_b{i}']) for i in range(self.lstm_layers)]
+        # Row of the first layer's weights for value 0 of each observation entry. Multiplying a one-hot vector by a
+        # matrix picks one row per entry, so the first layer sums the rows at these offsets plus the observation
+        self.obs_offsets = np.concatenate([[0], np.cumsum(self.obs_nvec)[:-1]])
+        self.action_splits = np.cumsum(self.action_nvec)[:-1]
+        self.rng = np.random.default_rng(seed)
+
+    # Output of a layer whose input is the one-hot encoded observations
+    def one_hot_layer(self, obs, weight, bias):
+        return weight[obs + self.obs_offsets].sum(axis=1) + bias
+
+    # Runs the LSTM layers on one step, resetting the state of the environments whose episode starts
+    def lstm_step(self, obs, state, episode_start):
+        hidden, cell = state
+        keep = (1 - episode_start.astype(np.float32))[None, :, None]
+        hidden, cell = hidden * keep, cell * keep
+        new_hidden, new_cell = np.empty_like(hidden), np.empty_like(cell)
+        x = None
+        for i, (w_ih, w_hh, b) in enumerate(self.lstm):
+            gates = (self.one_hot_layer(obs, w_ih, b) if i == 0 else x @ w_ih + b) + hidden[i] @ w_hh
+            input_gate, forget_gate, cell_gate, output_gate = np.split(gates, 4, axis=1)
+            new_cell[i] = sigmoid(forget_gate) * cell[i] + sigmoid(input_gate) * np.tanh(cell_gate)
+            new_hidden[i] = sigmoid(output_gate) * np.tanh(new_cell[i])
+            x = new_hidden[i]
+        return x, (new_hidden, new_cell)
+
+    # Logits of the actions, or Q-values for DQN, of a batch of observations
+    def forward(self, obs, state=None, episode_start=None):
+        obs = np.asarray(obs, dtype=np.int64)
+        if self.lstm_layers:
+            if state is None:
+                zeros = np.zeros((self.lstm_layers, len(obs), self.meta['lstm_hidden']), dtype=np.float32)
+                state = (zeros, zeros)
+            if episode_start is None:
+                episode_start = np.zeros(len(obs), dtype=bool)
+            x, state = self.lstm_step(obs, state, np.asarray(episode_start))
+            layers = self.dense
+        else:
+            weight, bias, activation = self.dense[0]
+            x = activation(self.one_hot_layer(obs, weight, bias))
+            layers = self.dense[1:]
+        for weight, bias, activation in layers:
+            x = activation(x @ weight + bias)
+        return x, state
+
+    def predict(self, observation, state=None, episode_start=None, deterministic=False):
+        observation = np.asarray(observation)
+        vectorized = observation.ndim == 2
+        obs = observation.reshape(-1, len(self.obs_nvec))
+        logits, state = self.forward(obs, state, episode_start)
+        splits = np.split(logits, self.action_splits, axis=1)
+        if self.meta['sampling'] == 'categorical':
+            # Normalized like torch's Categorical does, as logits that are almost equal can round to the same value,
+            # and the first of them is picked then
+            splits = [split - log_sum_exp(split) for split in splits]
+            if not deterministic:
+                # Gumbel-max trick: the argmax of the logits plus Gumbel noise is a sample of their softmax
+                splits = [split - np.log(-np.log(self.rng.random(split.shape))) for split in splits]
+        actions = np.stack([split.argmax(axis=1) for split in splits], axis=1)
+        if not deterministic and self.meta['sampling'] == 'epsilon':
+            explore = self.rng.random(len(obs)) < self.meta['exploration_rate']
+            actions[explore] = self.rng.integers(0, self.action_nvec, size=(explore.sum(), len(self.action_nvec)))
+        if not self.meta['multidiscrete']:
+            actions = actions[:, 0]
+        return (actions if vectorized else actions[0]), state
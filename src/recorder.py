@@ -0,0 +1,144 @@
+import os
+import queue
+import threading
+import numpy as np
+
+# Tiles the frames of several environments into a single frame, filling the grid row by row. Missing tiles are black
+def tile_frames(frames, columns=None):
+    frames = np.asarray(frames)
+    num_frames, height, width, channels = frames.shape
+    columns = columns or int(np.ceil(np.sqrt(num_frames)))
+    rows = int(np.ceil(num_frames / columns))
+    tiled = np.zeros((rows * height, columns * width, channels), dtype=frames.dtype)
+    for i, frame in enumerate(frames):
+        row, column = divmod(i, columns)
+        tiled[row * height:(row + 1) * height, column * width:(column + 1) * width] = frame
+    return tiled
+
+# Writes frames to chunked .npy files in a directory: frames_00000.npy, frames_00001.npy, ... with up to chunk_size
+# frames each. Frames are gathered in a preallocated chunk, so memory use does not grow with the number of frames
+class NpyChunkWriter:
+    def __init__(self, path, chunk_size=256):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.chunk = None
+        self.filled = 0
+        self.num_chunks = 0
+        os.makedirs(path, exist_ok=True)
+
+    def append_data(self, frame):
+        if self.chunk is None:
+            self.chunk = np.empty((self.chunk_size,) + frame.shape, dtype=frame.dtype)
+        self.chunk[self.filled] = frame
+        self.filled += 1
+        if self.filled == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.filled > 0:
+            np.save(os.path.join(self.path, f'frames_{self.num_chunks:05d}.npy'), self.chunk[:self.filled])
+            self.num_chunks += 1
+            self.filled = 0
+
+    def close(self):
+        self.flush()
+
+# Loads the frames written by a NpyChunkWriter, memory mapping each chunk
+def load_npy_frames(path):
+    chunks = sorted(name for name in os.listdir(path) if name.startswith('frames_') and name.endswith('.npy'))
+    return [np.load(os.path.join(path, name), mmap_mode='r') for name in chunks]
+
+# Writes frames to a looping GIF as they come, each frame quantized to its own 256 colour palette. Pillow's GIF
+# writers keep every frame until the file is saved, so the header and frames are written here with its GIF helpers
+class GifStreamWriter:
+    def __init__(self, path, fps):
+        from PIL import GifImagePlugin, Image
+        self.gif = GifImagePlugin
+        self.image = Image
+        self.duration = 1000 / fps # In milliseconds
+        self.size = None
+        self.file = open(path, 'wb')
+
+    def append_data(self, frame):
+        image = self.image.fromarray(np.ascontiguousarray(frame[..., :3], dtype=np.uint8)).quantize()
+        if self.size is None:
+            self.size = image.size
+            header, _ = self.gif.getheader(image, info={'loop': 0, 'duration': self.duration})
+            self.file.write(b''.join(header))
+        elif image.size != self.size:
+            raise ValueError(f'Frames of a GIF must all have the size {self.size}, got {image.size}')
+        self.file.write(b''.join(self.gif.getdata(image, duration=self.duration, include_color_table=True)))
+
+    def close(self):
+        if self.size is not None:
+            self.file.write(b';') # Trailer
+        self.file.close()
+
+# Opens a frame writer for a path: MP4 files are encoded with imageio and imageio-ffmpeg, GIF files with Pillow,
+# any other path is a directory of chunked .npy files
+def open_writer(path, fps, chunk_size=256):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.gif':
+        try:
+            return GifStreamWriter(path, fps)
+        except ImportError:
+            raise ImportError("Recording to .gif files requires Pillow, install it with 'pip install pillow' or record to a directory of .npy chunks instead")
+    if extension != '.mp4':
+        return NpyChunkWriter(path, chunk_size)
+    try:
+        import imageio.v2 as imageio
+    except ImportError:
+        raise ImportError("Recording to .mp4 files requires imageio, install it with 'pip install imageio imageio-ffmpeg' or record to a directory of .npy chunks instead")
+    return imageio.get_writer(path, fps=fps, macro_block_size=1)
+
+# Records frames in the background: frames go through a bounded queue to an encoder thread, so rollouts are not
+# slowed down by encoding and memory stays flat however long the episode is. When the queue is full, record blocks
+# until the encoder has caught up
+class FrameRecorder:
+    def __init__(self, path, fps=30, queue_size=16, chunk_size=256):
+        self.path = path
+        self.writer = open_writer(path, fps, chunk_size)
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.num_frames = 0
+        self.error = None
+        self.thread = threading.Thread(target=self._encode, daemon=True)
+        self.thread.start()
+
+    def _encode(self):
+        while True:
+            frame = self.frames.get()
+            if frame is None:
+                break
+            if self.error is not None:
+                continue # Keep draining the queue so that record never blocks on a dead encoder
+            try:
+                self.writer.append_data(frame)
+            except Exception as error:
+                self.error = error
+
+    # Queues a frame, or the tiled frames of several environments. The frame must not be modified afterwards
+    def record(self, frame, columns=None):
+        if self.error is not None:
+            raise RuntimeError(f'Encoding {self.path} failed') from self.error
+        if isinstance(frame, (list, tuple)) or np.ndim(frame) == 4:
+            frame = tile_frames(frame, columns)
+        self.frames.put(frame)
+        self.num_frames += 1
+
+    # Waits for the queued frames to be encoded and closes the file
+    def close(self):
+        self.frames.put(None)
+        self.thread.join()
+        if self.error is None:
+            try:
+                self.writer.close()
+            except Exception as error:
+                self.error = error
+        if self.error is not None:
+            raise RuntimeError(f'Encoding {self.path} failed') from self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,82 @@
+import numpy as np
+
+# Colors of the rendered layers
+BACKGROUND_COLOR = (255, 255, 255)
+FIELD_COLOR = (255, 255, 0)
+VISITED_COLOR = (100, 100, 100)
+WEED_COLOR = (0, 255, 255)
+
+# Colors of the agents, the first agent is drawn as a square and the others as circles
+AGENT_COLORS = [(255, 0, 0), (0, 0, 255), (0, 255, 0), (255, 0, 255), (255, 128, 0), (128, 0, 255), (0, 128, 128), (128, 64, 0)]
+
+# Checks which points lie inside a polygon with the even-odd rule, points on the boundary may go either way
+def points_in_polygon(vertices, px, py):
+    inside = np.zeros(np.broadcast(px, py).shape, dtype=bool)
+    for (x1, y1), (x2, y2) in zip(vertices, vertices[1:] + vertices[:1]):
+        if y1 == y2:
+            continue
+        spans = (y1 > py) != (y2 > py)
+        inside ^= spans & (px < x1 + (py - y1) * (x2 - x1) / (y2 - y1))
+    return inside
+
+# Renders the field into NumPy RGB frames of shape (height, width, 3), without pygame. The static layer with the
+# field polygon is drawn once, visited cells are stamped into a persistent frame as they are visited, and only
+# the agents and the remaining weeds are drawn for each frame
+class FieldRenderer:
+    def __init__(self, field_spec, window_size=800):
+        self.field_spec = field_spec
+        self.window_size = window_size
+        self.cell_size = window_size / field_spec.grid_size # The size of a single grid square in pixels
+
+        # Pixel edges of the cells, cells outside of the window are clipped to it
+        edges = np.clip(np.round(np.arange(-1, field_spec.padded_size) * self.cell_size), 0, window_size).astype(np.int64)
+        self.starts, self.ends = edges[:-1], edges[1:] # Indexed by cell + 1 like the padded grids
+
+        # Static layer: the field polygon on a white background
+        centers = (np.arange(window_size) + 0.5) / self.cell_size
+        inside = points_in_polygon(field_spec.vertices, centers[None, :], centers[:, None])
+        self.background = np.empty((window_size, window_size, 3), dtype=np.uint8)
+        self.background[:] = BACKGROUND_COLOR
+        self.background[inside] = FIELD_COLOR
+
+        # Circle drawn for every agent but the first, with a radius of a third of a cell
+        size = int(np.ceil(self.cell_size))
+        offsets = np.arange(size) + 0.5 - self.cell_size / 2
+        self.disc = offsets[:, None] ** 2 + offsets[None, :] ** 2 <= (self.cell_size / 3) ** 2
+
+        # Persistent frame with the visited cells stamped so far
+        self.frame = self.background.copy()
+        self.stamped = np.zeros((field_spec.padded_size, field_spec.padded_size), dtype=np.uint8)
+
+    def _fill_cell(self, frame, x, y, color):
+        frame[self.starts[y + 1]:self.ends[y + 1], self.starts[x + 1]:self.ends[x + 1]] = color
+
+    # Stamps the cells visited since the last call into the persistent frame, starting over after a reset
+    def _stamp_visited(self, visited):
+        if (self.stamped > visited).any():
+            self.frame[:] = self.background
+            self.stamped.fill(0)
+        for x, y in np.argwhere(visited > self.stamped) - 1:
+            self._fill_cell(self.frame, x, y, VISITED_COLOR)
+        self.stamped[:] = visited
+
+    # Renders a frame from the padded visited grid, the agent positions and the 0/1 state of each weed
+    def render(self, visited, agent_positions, weed_state):
+        self._stamp_visited(visited)
+        frame = self.frame.copy()
+
+        # Draw the first agent as a square and the others as circles
+        for i, (x, y) in enumerate(agent_positions):
+            color = AGENT_COLORS[i % len(AGENT_COLORS)]
+            if i == 0:
+                self._fill_cell(frame, x, y, color)
+            else:
+                top, left = int(round(y * self.cell_size)), int(round(x * self.cell_size))
+                patch = frame[top:top + self.disc.shape[0], left:left + self.disc.shape[1]]
+                patch[self.disc[:patch.shape[0], :patch.shape[1]]] = color
+
+        # Draw infected locations
+        for (x, y), collected in zip(self.field_spec.weed_locations, weed_state):
+            if not collected:
+                self._fill_cell(frame, x, y, WEED_COLOR)
+        return frame
@@ -0,0 +1,136 @@
+import glob
+import json
+import os
+import re
+import pandas as pd
+from src.tfevents import read_many
+
+# Log directories of each setting, as written by train.py, tune.py and transfer.py
+LOG_DIRS = {
+    'training': 'training_logs',
+    'tuning': 'tuning_logs',
+    'transfer': 'transfer_logs',
+}
+
+# Default location of the scalar cache and the index of the log files it was built from
+CACHE_PATH = 'logs_cache/scalars.parquet'
+
+# Parquet files are read and written with pyarrow. Without it, the cache is kept in a CSV file next to the parquet path
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+# Columns of the scalar cache. Trial is only set for tuning runs, source and target only for transfer runs
+COLUMNS = ['setting', 'algorithm', 'set', 'trial', 'source', 'target', 'run', 'file', 'tag', 'step', 'value']
+
+# Reads the experiment info from the name of a run directory, e.g. A2C_set1_0 for training, A2C_set1_12_1 for
+# trial 12 of tuning and A2C_from1_to2_1 for transfer. The set of a transfer run is the set it was trained on.
+# Returns None for other runs, like the ones trained on field pools
+def parse_run_name(setting, name):
+    info = {'algorithm': name.split('_')[0], 'set': None, 'trial': None, 'source': None, 'target': None}
+    if setting == 'transfer':
+        match = re.match(r'[^_]+_from(\d+)_to(\d+)', name)
+        if match is None:
+            return None
+        info['source'], info['target'] = int(match.group(1)), int(match.group(2))
+        info['set'] = info['target']
+    else:
+        match = re.match(r'[^_]+_set(\d+)_(\d+)', name)
+        if match is None:
+            return None
+        info['set'] = int(match.group(1))
+        if setting == 'tuning':
+            info['trial'] = int(match.group(2))
+    return info
+
+# Lists the tfevents files of every setting, with their run directory. Runs that are not named after a set are left out
+def find_logs(log_dirs=LOG_DIRS):
+    logs = []
+    for setting, log_dir in log_dirs.items():
+        for path in sorted(glob.glob(os.path.join(log_dir, '*', '*tfevents*'))):
+            run = os.path.basename(os.path.dirname(path))
+            if parse_run_name(setting, run) is not None:
+                logs.append((setting, run, path))
+    return logs
+
+# Builds the rows of one tfevents file from its scalars
+def file_rows(setting, run, path, scalars):
+    tags, steps, values = scalars
+    rows = pd.DataFrame({'tag': tags, 'step': steps, 'value': values})
+    for column, value in parse_run_name(setting, run).items():
+        rows[column] = value
+    rows['setting'], rows['run'], rows['file'] = setting, run, path
+    return rows[COLUMNS]
+
+# Path the cache is stored at, a CSV file instead of a parquet file when pyarrow is not installed
+def storage_path(cache_path):
+    if pyarrow is None and cache_path.endswith('.parquet'):
+        return cache_path[:-len('.parquet')] + '.csv'
+    return cache_path
+
+# Gives the cache columns their types, which CSV files do not keep
+def set_dtypes(cache):
+    for column in ['set', 'trial', 'source', 'target']:
+        cache[column] = cache[column].astype('Int64')
+    for column in ['setting', 'algorithm', 'run', 'file', 'tag']:
+        cache[column] = cache[column].astype('category')
+    return cache
+
+def read_cache(path):
+    return set_dtypes(pd.read_csv(path)) if path.endswith('.csv') else pd.read_parquet(path)
+
+# Writes the cache through a temporary file, so that an interrupted update never leaves a broken cache
+def write_cache(cache, path):
+    if path.endswith('.csv'):
+        cache.to_csv(path + '.tmp', index=False)
+    else:
+        cache.to_parquet(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+
+# Brings the scalar cache up to date with the log directories and returns it. Only files that are new or whose
+# size or modification time changed since the last update are parsed, spread over worker processes, and rows of
+# deleted files are dropped
+def update_cache(cache_path=CACHE_PATH, log_dirs=LOG_DIRS, workers=None, verbose=True):
+    cache_path = storage_path(cache_path)
+    index_path = os.path.splitext(cache_path)[0] + ('_csv_index.json' if cache_path.endswith('.csv') else '_index.json') # One index per format
+    index, cache = {}, None
+    if os.path.exists(cache_path) and os.path.exists(index_path):
+        with open(index_path, 'r') as index_file:
+            index = json.load(index_file)
+        cache = read_cache(cache_path)
+
+    # Compare the files on disk with the ones the cache was built from
+    logs = find_logs(log_dirs)
+    current = {path: [os.stat(path).st_size, os.stat(path).st_mtime_ns] for _, _, path in logs}
+    changed = [(setting, run, path) for setting, run, path in logs if index.get(path) != current[path]]
+    removed = set(index) - set(current)
+    if cache is not None and not changed and not removed:
+        return cache
+
+    # Parse the changed files and replace their rows
+    if verbose:
+        print(f'Updating scalar cache: parsing {len(changed)} of {len(logs)} log files, dropping {len(removed)}')
+        if pyarrow is None:
+            print(f"pyarrow is not installed, keeping the cache in {cache_path} instead. Install it with 'pip install pyarrow' for a smaller and faster cache")
+    stale = removed | {path for _, _, path in changed}
+    frames = [cache[~cache['file'].isin(stale)]] if cache is not None else []
+    parsed = read_many([path for _, _, path in changed], workers=workers)
+    frames += [file_rows(setting, run, path, scalars) for (setting, run, path), scalars in zip(changed, parsed)]
+    cache = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=COLUMNS)
+    cache = set_dtypes(cache)
+
+    # Write the cache before its index, both through temporary files, so that an interrupted update is redone
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    write_cache(cache, cache_path)
+    with open(index_path + '.tmp', 'w') as index_file:
+        json.dump(current, index_file)
+    os.replace(index_path + '.tmp', index_path)
+    return cache
+
+# Loads the values of one tag for a setting from the scalar cache, updating it first
+def load_scalars(setting, tag='rollout/ep_rew_mean', cache_path=CACHE_PATH):
+    cache = update_cache(cache_path)
+    scalars = cache[(cache['setting'] == setting) & (cache['tag'] == tag)]
+    scalars = scalars.drop(columns=['setting', 'tag', 'file']).astype({'algorithm': str, 'run': str})
+    return scalars.reset_index(drop=True)
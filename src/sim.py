@@ -1,8 +1,16 @@
 import numpy as np
 
-# CoppeliaSim drone simulator
-class DroneSimulator:    
-    def __init__(self, sim, polygon, scaling_factor, height):
+# Formats a list of numbers as a Lua table
+def lua_table(values):
+    return '{' + ','.join(repr(float(v)) for v in values) + '}'
+
+# CoppeliaSim drone simulator. Every call on `sim` is a round trip to the simulator, so object handles are resolved
+# once, the positions of the targets are tracked locally and the updates of all drones are sent as one Lua script
+# through sim.executeScriptString. If the simulator cannot run scripts, the updates fall back to one call per object.
+# With a client and stepping enabled, the simulation advances by sim_steps steps after each move, in lockstep with
+# the environment
+class DroneSimulator:
+    def __init__(self, sim, polygon, scaling_factor, height, client=None, stepping=False, sim_steps=1):
         self.sim = sim
         self.scaling_factor = scaling_factor
         self.scaled_polygon = [(x/scaling_factor,y/scaling_factor) for (x,y) in polygon]
@@ -10,15 +18,54 @@ class DroneSimulator:
         self.color = [[255,0,0],[255,0,255],[0,0,255]]
         self.edges_3d = self.calc_edges_3d()
         self.height = height
+        self.client = client
+        self.stepping = stepping and client is not None
+        self.sim_steps = sim_steps
+        self.batching = True # Cleared when the simulator fails to run a batch script
+        self.drone_handles = [] # Cached handles of the drones and their targets
+        self.target_handles = []
+        self.target_positions = [] # Last known positions of the targets
+
+    # Runs a list of Lua statements in one round trip, returns False if scripts are not supported
+    def execute_batch(self, statements):
+        if not self.batching:
+            return False
+        try:
+            self.sim.executeScriptString('\n'.join(statements), self.sim.scripttype_sandboxscript)
+            return True
+        except Exception as error:
+            print(f'Batched simulator calls are not supported, falling back to single calls: {error}')
+            self.batching = False
+            return False
+
+    # Scaled 3D position of an agent from the info of the environment
+    def agent_position(self, info, i):
+        return [xi/self.scaling_factor for xi in info['agent'+str(i+1)]] + [self.height]
+
+    def get_drone_handles(self, k):
+        while len(self.drone_handles) < k:
+            self.drone_handles.append(self.sim.getObject('/Quadcopter[' + str(len(self.drone_handles)) + ']'))
+        return self.drone_handles
+
+    def get_target_handles(self, k):
+        while len(self.target_handles) < k:
+            handle = self.sim.getObject('/target[' + str(len(self.target_handles)) + ']')
+            self.target_handles.append(handle)
+            self.target_positions.append(list(self.sim.getObjectPosition(handle, -1)))
+        return self.target_handles
 
     def start_simulation(self):
         self.trace_line = self.sim.addDrawingObject(self.sim.drawing_lines, 2, 0, -1, 9999, [255,0,0]) # red line
+        if self.stepping:
+            self.client.setStepping(True)
         self.sim.startSimulation()
         print('Program started')
 
     def stop_simulation(self):
         self.sim.removeDrawingObject(self.trace_line)
         self.sim.stopSimulation()
+        if self.stepping:
+            self.client.setStepping(False)
 
     # To calculate the edges in the polygon
     def calc_edges_3d(self):
@@ -30,45 +77,46 @@ class DroneSimulator:
     def draw_field(self):
         white = [255, 255, 255]
         lineContainer = self.sim.addDrawingObject(self.sim.drawing_lines, 2, 0, -1, 9999, white)
+        lines = []
         for l in self.edges_3d: # Drawing the field with white lines
             line = l[0] + [self.height] + l[1] + [self.height]
             for j in range(len(line)):
                 if line[j] != self.height:
                     line[j] = int(line[j])
-            # print(line)
-            self.sim.addDrawingObjectItem(lineContainer, line)
+            lines.append(line)
+        if not self.execute_batch([f'sim.addDrawingObjectItem({lineContainer},{lua_table(line)})' for line in lines]):
+            for line in lines:
+                self.sim.addDrawingObjectItem(lineContainer, line)
 
     def set_agent_positions(self, k, info):
-        for i in range(k):
-            drone = '/Quadcopter['
-            obj_path = drone+str(i)+']'
-            objHandle = self.sim.getObject(obj_path)
-            print(np.append(info['agent'+str(i+1)],[self.height]))
-            x = info['agent'+str(i+1)]
-            x = [xi/self.scaling_factor for xi in x]
-            x = x + [self.height]
-            print(x)
-            self.sim.setObjectPosition(objHandle, -1, x) # Initiate the position of the robots
-    
+        handles = self.get_drone_handles(k)
+        positions = [self.agent_position(info, i) for i in range(k)]
+        if not self.execute_batch([f'sim.setObjectPosition({handle},-1,{lua_table(x)})' for handle, x in zip(handles, positions)]):
+            for handle, x in zip(handles, positions):
+                self.sim.setObjectPosition(handle, -1, x) # Initiate the position of the robots
+
     def set_weed_locations(self, weed_locations):
         weed_obj = self.sim.getObject('/weed')
-        for i, loc in enumerate(weed_locations):
-            new_weed_obj = self.sim.copyPasteObjects([weed_obj])[0]
-            x = [xi/self.scaling_factor for xi in loc]
-            new_pos = x + [0]
-            self.sim.setObjectPosition(new_weed_obj, -1, new_pos)
+        positions = [[xi/self.scaling_factor for xi in loc] + [0] for loc in weed_locations]
+        # Lua tables are 1-based, [1] is the handle of the copy
+        if not self.execute_batch([f'sim.setObjectPosition(sim.copyPasteObjects({{{weed_obj}}},0)[1],-1,{lua_table(x)})' for x in positions]):
+            for new_pos in positions:
+                new_weed_obj = self.sim.copyPasteObjects([weed_obj])[0]
+                self.sim.setObjectPosition(new_weed_obj, -1, new_pos)
 
     def move_agents(self, k, info):
-        for i in range(k):
-            obj_path = '/target[' + str(i) + ']'
-            objHandle = self.sim.getObject(obj_path)
-            prev_pos = self.sim.getObjectPosition(objHandle, -1) # current object position
-            print(np.append(info['agent'+str(i+1)],[self.height]))
-            x = info['agent'+str(i+1)] # Get the x,y from info of gym env
-            x = [xi/self.scaling_factor for xi in x] # scale the x,y
-            x = x + [self.height] # add the z (height)
-            # print(x)
-            self.sim.setObjectPosition(objHandle, -1, x) # Initiate the position of the robots
-            # draw the line
-            line_data = prev_pos + x
-            self.sim.addDrawingObjectItem(self.trace_line, line_data)
+        handles = self.get_target_handles(k)
+        statements = []
+        for i, handle in enumerate(handles):
+            x = self.agent_position(info, i) # Get the x,y from info of gym env, scaled, with the z (height)
+            line_data = self.target_positions[i] + x # draw the line from the previous position
+            self.target_positions[i] = x
+            statements.append((handle, x, line_data))
+        if not self.execute_batch([f'sim.setObjectPosition({handle},-1,{lua_table(x)})\nsim.addDrawingObjectItem({self.trace_line},{lua_table(line_data)})'
+                                   for handle, x, line_data in statements]):
+            for handle, x, line_data in statements:
+                self.sim.setObjectPosition(handle, -1, x)
+                self.sim.addDrawingObjectItem(self.trace_line, line_data)
+        if self.stepping:
+            for _ in range(self.sim_steps):
+                self.client.step()
@@ -0,0 +1,164 @@
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# Reads scalars from TensorBoard tfevents files without TensorFlow. A tfevents file is a TFRecord file: each record is
+# a little-endian uint64 length, the masked CRC32C of the length, the data and the masked CRC32C of the data. The
+# data is a serialized Event proto, of which only the fields holding scalars are decoded
+
+# Protobuf wire types
+VARINT, FIXED64, BYTES, FIXED32 = 0, 1, 2, 5
+
+# TensorFlow data types of scalar tensors
+DT_FLOAT, DT_DOUBLE = 1, 2
+
+# The crc32c package computes checksums natively, without it they are computed in Python with a table
+try:
+    from crc32c import crc32c as native_crc32c
+except ImportError:
+    native_crc32c = None
+
+# Table of the CRC32C (Castagnoli) polynomial
+crc_table = []
+for byte in range(256):
+    crc = byte
+    for _ in range(8):
+        crc = (crc >> 1) ^ 0x82F63B78 if crc & 1 else crc >> 1
+    crc_table.append(crc)
+
+# Computes the CRC32C of some bytes
+def crc32c(data):
+    if native_crc32c is not None:
+        return native_crc32c(data)
+    crc = 0xFFFFFFFF
+    for byte in data:
+        crc = crc_table[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+    return crc ^ 0xFFFFFFFF
+
+# Masks a CRC the way TFRecord files store it
+def masked_crc(data):
+    crc = crc32c(data)
+    return (((crc >> 15) | (crc << 17)) + 0xA282EAD8) & 0xFFFFFFFF
+
+# Yields the data of each record of a TFRecord file. A record cut off at the end, as in a file that is still being
+# written, ends the file. With verify_crc, records whose checksums do not match raise a ValueError
+def read_records(path, verify_crc=False):
+    with open(path, 'rb') as record_file:
+        while True:
+            header = record_file.read(12)
+            if len(header) < 12:
+                return
+            length, length_crc = struct.unpack('<QI', header)
+            data = record_file.read(length)
+            footer = record_file.read(4)
+            if len(data) < length or len(footer) < 4:
+                return
+            if verify_crc and (masked_crc(header[:8]) != length_crc or masked_crc(data) != struct.unpack('<I', footer)[0]):
+                raise ValueError(f'Corrupted record at offset {record_file.tell() - length - 16} of {path}')
+            yield data
+
+# Decodes a varint starting at pos, returning its value and the position after it
+def read_varint(buffer, pos):
+    result, shift = 0, 0
+    while True:
+        byte = buffer[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+# Yields the field number, wire type and value of each field of a serialized message. Length-delimited values are
+# given as memoryviews, so nested messages are decoded without copying
+def read_fields(buffer):
+    pos, end = 0, len(buffer)
+    while pos < end:
+        key, pos = read_varint(buffer, pos)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == VARINT:
+            value, pos = read_varint(buffer, pos)
+        elif wire_type == FIXED64:
+            value, pos = buffer[pos:pos + 8], pos + 8
+        elif wire_type == BYTES:
+            length, pos = read_varint(buffer, pos)
+            value, pos = buffer[pos:pos + length], pos + length
+        elif wire_type == FIXED32:
+            value, pos = buffer[pos:pos + 4], pos + 4
+        else:
+            raise ValueError(f'Unsupported protobuf wire type {wire_type}')
+        yield field, wire_type, value
+
+# Reads the value of a scalar TensorProto, or None for other tensors
+def tensor_scalar(buffer):
+    dtype, content, value = None, None, None
+    for field, wire_type, data in read_fields(buffer):
+        if field == 1:
+            dtype = data
+        elif field == 4:
+            content = data
+        elif field == 5: # float_val, packed or not
+            value = struct.unpack_from('<f', data, len(data) - 4)[0]
+        elif field == 6: # double_val, packed or not
+            value = struct.unpack_from('<d', data, len(data) - 8)[0]
+    if value is None and content is not None:
+        if dtype == DT_FLOAT and len(content) == 4:
+            value = struct.unpack('<f', content)[0]
+        elif dtype == DT_DOUBLE and len(content) == 8:
+            value = struct.unpack('<d', content)[0]
+    return value
+
+# Reads the tag and value of a Summary.Value holding a scalar, either as a simple_value or as a scalar tensor
+def summary_value(buffer, tags):
+    tag, value = None, None
+    for field, wire_type, data in read_fields(buffer):
+        if field == 1:
+            tag = bytes(data).decode()
+            if tags is not None and tag not in tags:
+                return None, None
+        elif field == 2 and wire_type == FIXED32:
+            value = struct.unpack('<f', data)[0]
+        elif field == 8:
+            value = tensor_scalar(data)
+    return tag, value
+
+# Yields the tag, step and value of each scalar in a tfevents file, only for the given tags if any
+def iter_scalars(path, tags=None, verify_crc=False):
+    tags = set(tags) if tags is not None else None
+    encoded_tags = [tag.encode() for tag in tags] if tags is not None else None
+    for record in read_records(path, verify_crc):
+        # Skip events that cannot hold the tags without decoding them
+        if encoded_tags is not None and not any(tag in record for tag in encoded_tags):
+            continue
+        step, summary = 0, None
+        for field, wire_type, data in read_fields(memoryview(record)):
+            if field == 2:
+                step = data
+            elif field == 5:
+                summary = data
+        if summary is None:
+            continue
+        for field, wire_type, data in read_fields(summary):
+            if field == 1:
+                tag, value = summary_value(data, tags)
+                if tag is not None and value is not None:
+                    yield tag, step, value
+
+# Reads the scalars of a tfevents file, returning the tags, steps and values as arrays
+def read_scalars(path, tags=None, verify_crc=False):
+    scalars = list(iter_scalars(path, tags, verify_crc))
+    return (
+        np.array([tag for tag, _, _ in scalars], dtype=object),
+        np.array([step for _, step, _ in scalars], dtype=np.int64),
+        np.array([value for _, _, value in scalars], dtype=np.float64),
+    )
+
+# Reads the scalars of many tfevents files, spread over worker processes. Returns one result of read_scalars per
+# path, in the same order
+def read_many(paths, tags=None, verify_crc=False, workers=None):
+    paths = list(paths)
+    workers = min(workers or os.cpu_count(), len(paths))
+    if workers <= 1:
+        return [read_scalars(path, tags, verify_crc) for path in paths]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(read_scalars, paths, [tags] * len(paths), [verify_crc] * len(paths), chunksize=max(len(paths) // (workers * 4), 1)))
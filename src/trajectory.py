@@ -0,0 +1,182 @@
+import json
+import os
+import numpy as np
+from src.env import MOVEMENTS
+from src.utils import decode_table
+
+# Columns of a trajectory log. Every row is the state after a step, or the initial state of an episode, where the
+# action is -1 and the reward 0. Weeds are stored as a bitmask packed into bytes, the first weed being the first bit
+COLUMNS = ('positions', 'actions', 'rewards', 'weeds')
+
+# Field of a field spec as stored in meta.json
+def field_config(spec):
+    return {
+        'field': [list(vertex) for vertex in spec.vertices],
+        'grid_size': spec.grid_size,
+        'init_positions': spec.init_positions.tolist(),
+        'infected_locations': [list(location) for location in spec.weed_locations],
+    }
+
+# Writes trajectories to a directory of chunked columnar .npy files, positions_00000.npy, actions_00000.npy, ...,
+# described by meta.json. Episodes are gathered in small per-episode buffers and never split across chunks, so
+# several environments can be logged at once by giving each one its own slot. With a field pool, each episode records
+# the index and the field it was run on, and the weeds column is as wide as the field with the most weeds
+class TrajectoryWriter:
+    def __init__(self, path, env_config, obs_mode='decimal', action_mode='discrete', chunk_size=65536, metadata=None):
+        self.path = path
+        self.chunk_size = chunk_size
+        spec = env_config['field_spec']
+        pool = env_config.get('field_pool')
+        self.num_agents = spec.init_positions.shape[0]
+        self.num_weeds = pool.max_weeds if pool is not None else spec.infected_length
+        self.decode_table = decode_table(self.num_agents)
+        self.meta = {
+            'num_agents': self.num_agents,
+            'num_weeds': self.num_weeds,
+            'obs_mode': obs_mode,
+            'action_mode': action_mode,
+            'config': field_config(spec), # The first field of a pool
+            'chunks': [],
+            'episodes': [],
+            **(metadata or {}),
+        }
+        if pool is not None:
+            self.meta['field_pool'] = str(pool.path)
+        self.episodes = {} # Buffers of the running episode of each slot
+        self.chunk = [] # Finished episodes waiting to be written
+        self.chunk_rows = 0
+        os.makedirs(path, exist_ok=True)
+
+    def _append(self, slot, positions, actions, reward, weeds):
+        episode = self.episodes[slot]
+        row = episode['length']
+        if row == len(episode['rewards']): # Grow the buffers of unusually long episodes
+            for column in COLUMNS:
+                episode[column] = np.concatenate([episode[column], np.zeros_like(episode[column])])
+        episode['positions'][row] = positions
+        episode['actions'][row] = actions
+        episode['rewards'][row] = reward
+        episode['weeds'][row] = weeds
+        episode['length'] = row + 1
+
+    # Starts an episode from the state of a freshly reset environment
+    def begin(self, env, slot=0, seed=None, max_steps=2000):
+        env = env.unwrapped
+        self.episodes[slot] = {
+            'positions': np.zeros((max_steps + 1, self.num_agents, 2), dtype=np.int16),
+            'actions': np.zeros((max_steps + 1, self.num_agents), dtype=np.int8),
+            'rewards': np.zeros(max_steps + 1),
+            'weeds': np.zeros((max_steps + 1, self.num_weeds), dtype=bool),
+            'length': 0,
+            'seed': seed,
+            'field': env.field_index,
+            'config': field_config(env.field_spec) if env.field_index is not None else None,
+        }
+        self._append(slot, env.agent_positions, -1, 0, env.weed_state)
+
+    # Logs the state of the environment after a step. Discrete actions are stored decoded, as one movement per agent
+    def step(self, env, action, reward, slot=0):
+        env = env.unwrapped
+        actions = self.decode_table[action] if np.ndim(action) == 0 else action
+        self._append(slot, env.agent_positions, actions, reward, env.weed_state)
+
+    # Finishes the episode of a slot, writing a chunk once enough rows are gathered
+    def end(self, terminated, truncated, slot=0):
+        episode = self.episodes.pop(slot)
+        if self.chunk_rows + episode['length'] > self.chunk_size:
+            self.flush()
+        self.meta['episodes'].append({
+            'chunk': len(self.meta['chunks']),
+            'offset': self.chunk_rows,
+            'length': episode['length'],
+            'total_reward': float(episode['rewards'][:episode['length']].sum()),
+            'terminated': bool(terminated),
+            'truncated': bool(truncated),
+            'seed': episode['seed'],
+        })
+        if episode['field'] is not None:
+            self.meta['episodes'][-1].update(field=episode['field'], config=episode['config'])
+        self.chunk.append(episode)
+        self.chunk_rows += episode['length']
+
+    def flush(self):
+        if not self.chunk:
+            return
+        chunk = len(self.meta['chunks'])
+        for column in COLUMNS:
+            data = np.concatenate([episode[column][:episode['length']] for episode in self.chunk])
+            if column == 'weeds':
+                data = np.packbits(data, axis=1)
+            np.save(os.path.join(self.path, f'{column}_{chunk:05d}.npy'), data)
+        self.meta['chunks'].append({'rows': self.chunk_rows})
+        self.chunk, self.chunk_rows = [], 0
+
+    # Writes the remaining finished episodes and the metadata. Unfinished episodes are dropped
+    def close(self):
+        self.flush()
+        with open(os.path.join(self.path, 'meta.json'), 'w') as meta_file:
+            json.dump(self.meta, meta_file, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# Reads a trajectory log, memory mapping the chunks as they are needed
+class Trajectory:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r') as meta_file:
+            self.meta = json.load(meta_file)
+        self.episodes = self.meta['episodes']
+        self.chunks = {}
+
+    # Experiment config of the logged environment, without the need for the experiment file. For logs of field pools,
+    # this is the first field of the pool, the field of each episode is given by episode_config
+    @property
+    def env_config(self):
+        return self._env_config(self.meta['config'])
+
+    # Experiment config of the field an episode was run on
+    def episode_config(self, index):
+        return self._env_config(self.episodes[index].get('config') or self.meta['config'])
+
+    @staticmethod
+    def _env_config(config):
+        return {
+            'field': [tuple(vertex) for vertex in config['field']],
+            'grid_size': config['grid_size'],
+            'init_positions': [np.array(position) for position in config['init_positions']],
+            'infected_locations': [tuple(location) for location in config['infected_locations']],
+        }
+
+    # Observation and action modes of the logged environment. Logs written before they were recorded replay with
+    # 'bits' observations, which support any number of weeds
+    @property
+    def obs_mode(self):
+        return self.meta.get('obs_mode', 'bits')
+
+    @property
+    def action_mode(self):
+        return self.meta.get('action_mode', 'discrete')
+
+    def _chunk(self, chunk):
+        if chunk not in self.chunks:
+            self.chunks[chunk] = {column: np.load(os.path.join(self.path, f'{column}_{chunk:05d}.npy'), mmap_mode='r') for column in COLUMNS}
+        return self.chunks[chunk]
+
+    # Columns of one episode, with the weeds unpacked into a 0/1 array per row, one entry per weed of its field
+    def episode(self, index):
+        episode = self.episodes[index]
+        rows = slice(episode['offset'], episode['offset'] + episode['length'])
+        columns = {column: data[rows] for column, data in self._chunk(episode['chunk']).items()}
+        num_weeds = len(episode['config']['infected_locations']) if episode.get('config') else self.meta['num_weeds']
+        columns['weeds'] = np.unpackbits(columns['weeds'], axis=1, count=self.meta['num_weeds'])[:, :num_weeds]
+        return columns
+
+    # Cells the agents tried to move to at each step of an episode, shape (length - 1, num_agents, 2). Replaying
+    # them in order rebuilds the visited cells, including attempts to leave the field
+    @staticmethod
+    def targets(columns):
+        return columns['positions'][:-1].astype(np.int64) + np.array(MOVEMENTS)[columns['actions'][1:]]
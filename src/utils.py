@@ -1,44 +1,68 @@
+import functools
+import hashlib
 import yaml
 import numpy as np
-from stable_baselines3 import A2C, PPO, DQN
-from sb3_contrib import TRPO, ARS, RecurrentPPO
+from src.field import FieldSpec
 import distutils
 import inspect
 
+# Compiled field specs, keyed by the hash of the experiment file contents
+field_specs = {}
+
 # Loads in an experiment config file
 def load_experiment(path):
-    with open(path, 'r') as experiment_file:
-        config = yaml.load(experiment_file, Loader=yaml.FullLoader)
-        config['field'] = list(map(lambda x: tuple(x), config['field']))
-        config['init_positions'] = list(map(lambda x: np.array(x), config['init_positions']))
-        config['infected_locations'] = list(map(lambda x: tuple(x), config['infected_locations']))
+    with open(path, 'rb') as experiment_file:
+        contents = experiment_file.read()
+    config = yaml.load(contents, Loader=yaml.FullLoader)
+    config['field'] = list(map(lambda x: tuple(x), config['field']))
+    config['init_positions'] = list(map(lambda x: np.array(x), config['init_positions']))
+    config['infected_locations'] = list(map(lambda x: tuple(x), config['infected_locations']))
+
+    # Compile the field once per process and share it between all environments
+    key = hashlib.sha256(contents).hexdigest()
+    if key not in field_specs:
+        field_specs[key] = FieldSpec.from_config(config)
+    config['field_spec'] = field_specs[key]
     return config
 
+# Returns the class of a DRL algorithm. Imported here so that the environment and trajectory replays do not need torch
+def get_algorithm(algorithm):
+    from stable_baselines3 import A2C, PPO, DQN
+    from sb3_contrib import TRPO, ARS, RecurrentPPO
+    algorithms = {'A2C': A2C, 'PPO': PPO, 'TRPO': TRPO, 'DQN': DQN, 'ARS': ARS}
+    return algorithms.get(algorithm, RecurrentPPO)
+
 # Loads in a trained model
-def load_model(algorithm, experiment_set, seed, device, models_dir, verbose, log_dir):
+def load_model(algorithm, experiment_set, seed, device, models_dir, verbose, log_dir, name=None):
+    name = name or f'{algorithm}_set{experiment_set}' # Models of field pools and named runs have other names
     model_args = {
-        'path': f'{models_dir}/{algorithm}_set{experiment_set}.zip',
-        'tb_log_name': f'{algorithm}_set{experiment_set}',
+        'path': f'{models_dir}/{name}.zip',
+        'tb_log_name': name,
         'device': device,
         'seed': seed,
         'verbose': verbose,
         'tensorboard_log': log_dir,
     }
+    return get_algorithm(algorithm).load(**model_args)
 
-    if algorithm == 'A2C':
-        model = A2C.load(**model_args)
-    elif algorithm == 'PPO':
-        model = PPO.load(**model_args)
-    elif algorithm == 'TRPO':
-        model = TRPO.load(**model_args)
-    elif algorithm == 'DQN':
-        model = DQN.load(**model_args)
-    elif algorithm == 'ARS':
-        model = ARS.load(**model_args)
-    else:
-        model = RecurrentPPO.load(**model_args)
+# Records the observation and action modes a model is trained with. They are saved in the model file with the rest
+# of its attributes, so that model_modes can read them back
+def set_model_modes(model, obs_mode, action_mode):
+    model.obs_mode = obs_mode
+    model.action_mode = action_mode
     return model
 
+# Observation and action modes of the environment a model was trained on. Models saved before the modes were
+# recorded have them read from their spaces
+def model_modes(model):
+    obs_mode = getattr(model, 'obs_mode', None)
+    if obs_mode is None:
+        obs_mode = 'decimal' if model.observation_space.nvec[-1] == 1024 else 'bits'
+    action_mode = getattr(model, 'action_mode', None)
+    if action_mode is None:
+        action_mode = 'discrete' if hasattr(model.action_space, 'n') else 'multidiscrete'
+    return obs_mode, action_mode
+
 # Converts a list of binary digits to its decimal equivalent
 def binary_list_to_decimal(bin_list):
     bin = ''
@@ -63,6 +87,15 @@ def decode_action(action):
     z = action % 5
     return np.array([x, y, z])
 
+# Decoding table: Discrete → one movement per agent, for any number of agents. The first agent is the most
+# significant digit, so for 3 agents row a equals decode_action(a)
+@functools.lru_cache(maxsize=None)
+def decode_table(num_agents):
+    digits = 5 ** np.arange(num_agents - 1, -1, -1)
+    table = ((np.arange(5 ** num_agents)[:, None] // digits) % 5).astype(np.int8)
+    table.setflags(write=False)
+    return table
+
 # Filters out arguments that are not present in a model's constructor
 def filter_args(args, model):
     model_kwargs = inspect.getfullargspec(model).args
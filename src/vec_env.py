@@ -0,0 +1,346 @@
+import os
+import time
+import multiprocessing as mp
+import numpy as np
+import gymnasium as gym
+from gymnasium import spaces
+from stable_baselines3.common.env_util import make_vec_env
+from stable_baselines3.common.monitor import Monitor
+from stable_baselines3.common.vec_env import VecEnv, SubprocVecEnv
+from src.env import MultiAgentGridworldEnv, MOVEMENTS
+from src.field import FieldSpec
+from src.render import FieldRenderer
+from src.utils import decode_table
+
+# Vectorized version of MultiAgentGridworldEnv that keeps the state of all environments in NumPy arrays.
+# Every array indexed by a grid cell is padded by one cell on each side, so that moves leaving the grid
+# can be looked up without bounds checks. Rewards, terminations and observations match the gym environment
+# wrapped in Monitor and TimeLimit, the same way make_vec_env builds it. With render_mode='rgb_array', render tiles the
+# frames of all environments, there is no window to render to in 'human' mode.
+class BatchedGridworldVecEnv(VecEnv):
+    def __init__(self, env_config, num_envs, max_episode_steps=2000, obs_mode='decimal', action_mode='discrete', render_mode=None):
+        self.config = env_config
+        if self.config.get('field_pool') is not None:
+            raise ValueError('The batched environment uses a single field, use the dummy, subproc or shm environment with field pools')
+        self.field_spec = self.config.get('field_spec') or FieldSpec.from_config(self.config)
+        self.poly_vertices = self.field_spec.vertices
+        self.grid_size = self.field_spec.grid_size
+        self.max_episode_steps = max_episode_steps
+        self.obs_mode = obs_mode
+        self.action_mode = action_mode
+        if render_mode not in (None, 'rgb_array'):
+            raise ValueError(f"The batched environment only renders in 'rgb_array' mode, got {render_mode!r}")
+        self.render_mode = render_mode
+        self.window_size = 800
+        self.renderers = [None] * num_envs # Built on the first render, they keep the visited cells drawn so far
+        self.observation_length = self.field_spec.observation_length
+        self.infected_state_length = 2**10 # 10 weeds max, binary to decimal
+
+        # Field mask: True for the cells that are strictly inside the polygon
+        self.field_mask = self.field_spec.field_mask
+        self.padded_size = self.field_spec.padded_size
+
+        # Weed index grid: -1 for healthy cells, otherwise the index of the weed in infected_locations
+        self.infected_locations = self.field_spec.weed_locations
+        self.infected_length = self.field_spec.infected_length
+        self.weed_index = self.field_spec.weed_index
+        # The first weed is the most significant bit, matching binary_list_to_decimal
+        self.weed_weights = 1 << np.arange(self.infected_length - 1, -1, -1, dtype=np.int64)
+
+        self.init_positions = self.field_spec.init_positions
+        self.num_agents = len(self.init_positions)
+        self.movements = np.array(MOVEMENTS)
+
+        # Per-environment state
+        self.env_indices = np.arange(num_envs)
+        self.agent_positions = np.empty((num_envs, self.num_agents, 2), dtype=np.int64)
+        self.visited = np.empty((num_envs, self.padded_size, self.padded_size), dtype=np.uint8)
+        self.collected = np.empty((num_envs, self.infected_length), dtype=bool)
+        self.step_count = np.empty(num_envs, dtype=np.int64)
+        self.episode_rewards = np.empty(num_envs, dtype=np.int64)
+        self.episode_start_time = time.time()
+        self.actions = None
+
+        if self.action_mode == 'multidiscrete':
+            action_space = spaces.MultiDiscrete([5] * self.num_agents)
+        else:
+            action_space = spaces.Discrete(5 ** self.num_agents)
+            self.decode_table = decode_table(self.num_agents)
+        if self.obs_mode == 'bits':
+            observation_space = spaces.MultiDiscrete([self.observation_length] * self.num_agents + [2] * self.infected_length)
+        else:
+            if self.infected_length > 10:
+                raise ValueError(f"The 'decimal' observation mode supports at most 10 weeds, the field has {self.infected_length}. Use obs_mode='bits' instead")
+            observation_space = spaces.MultiDiscrete([self.observation_length] * self.num_agents + [self.infected_state_length])
+        super().__init__(num_envs, observation_space, action_space)
+        self._reset_envs(np.ones(num_envs, dtype=bool))
+
+    def _reset_envs(self, mask):
+        self.agent_positions[mask] = self.init_positions
+        self.visited[mask] = 0
+        self.collected[mask] = False
+        self.step_count[mask] = 0
+        self.episode_rewards[mask] = 0
+
+    def _get_obs(self):
+        obs = np.empty((self.num_envs,) + self.observation_space.shape, dtype=np.int64)
+        obs[:, :self.num_agents] = self.agent_positions[:, :, 0] * 100 + self.agent_positions[:, :, 1]
+        if self.obs_mode == 'bits':
+            obs[:, self.num_agents:] = self.collected
+        else:
+            obs[:, -1] = self.collected @ self.weed_weights
+        return obs
+
+    def reset(self):
+        self._reset_envs(np.ones(self.num_envs, dtype=bool))
+        self._reset_seeds()
+        self._reset_options()
+        return self._get_obs()
+
+    def step_async(self, actions):
+        self.actions = np.asarray(actions).reshape((self.num_envs,) + self.action_space.shape)
+
+    def step_wait(self):
+        rewards = np.zeros(self.num_envs, dtype=np.int64)
+        self.step_count += 1
+        decoded_actions = self.decode_table[self.actions] if self.action_mode == 'discrete' else self.actions
+
+        # Move the agents one after another, so that an agent sees the cells visited earlier in the same step
+        for i in range(self.num_agents):
+            new_positions = self.agent_positions[:, i] + self.movements[decoded_actions[:, i]]
+            x, y = new_positions[:, 0] + 1, new_positions[:, 1] + 1
+            inside = self.field_mask.padded[x, y]
+            self.agent_positions[inside, i] = new_positions[inside]
+            rewards -= np.where(inside, 0, 10)
+            rewards -= np.where(self.visited[self.env_indices, x, y] != 0, 10, 1)
+            self.visited[self.env_indices, x, y] = 1
+
+        # Collect the weeds under the agents, every agent standing on an uncollected weed is rewarded
+        weeds = self.weed_index[self.agent_positions[:, :, 0] + 1, self.agent_positions[:, :, 1] + 1]
+        hits = weeds >= 0
+        hits[hits] = ~self.collected[np.nonzero(hits)[0], weeds[hits]]
+        rewards += 100 * hits.sum(axis=1)
+        self.collected[np.nonzero(hits)[0], weeds[hits]] = True
+
+        terminated = self.collected.all(axis=1)
+        rewards[terminated] += 100000
+
+        # Collisions: two agents sharing a cell
+        cells = self.agent_positions[:, :, 0] * self.padded_size + self.agent_positions[:, :, 1]
+        cells.sort(axis=1)
+        collided = (cells[:, 1:] == cells[:, :-1]).any(axis=1)
+        rewards[collided] -= 100000
+        terminated |= collided
+
+        truncated = self.step_count >= self.max_episode_steps
+        dones = terminated | truncated
+        self.episode_rewards += rewards
+        obs = self._get_obs()
+
+        infos = [{} for _ in range(self.num_envs)]
+        if dones.any():
+            now = time.time()
+            for i in np.nonzero(dones)[0]:
+                infos[i]['TimeLimit.truncated'] = bool(truncated[i] and not terminated[i])
+                infos[i]['terminal_observation'] = obs[i].copy()
+                infos[i]['episode'] = {
+                    'r': round(float(self.episode_rewards[i]), 6),
+                    'l': int(self.step_count[i]),
+                    't': round(now - self.episode_start_time, 6),
+                }
+            self._reset_envs(dones)
+            obs[dones] = self._get_obs()[dones]
+        return obs, rewards.astype(np.float32), dones, infos
+
+    def close(self):
+        pass
+
+    # Frames of every environment, drawn from the batched state
+    def get_images(self):
+        images = []
+        for i in range(self.num_envs):
+            if self.renderers[i] is None:
+                self.renderers[i] = FieldRenderer(self.field_spec, self.window_size)
+            images.append(self.renderers[i].render(self.visited[i], self.agent_positions[i].tolist(), self.collected[i].tolist()))
+        return images
+
+    def _get_indices(self, indices):
+        if indices is None:
+            return range(self.num_envs)
+        if isinstance(indices, int):
+            return [indices]
+        return indices
+
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self, attr_name) for _ in self._get_indices(indices)]
+
+    # Attributes are shared by all environments, so they can only be set for all of them at once
+    def set_attr(self, attr_name, value, indices=None):
+        if indices is not None and sorted(self._get_indices(indices)) != list(range(self.num_envs)):
+            raise ValueError('The batched environment shares its attributes between environments, they cannot be set for only some of them')
+        setattr(self, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return [getattr(self, method_name)(*method_args, **method_kwargs) for _ in self._get_indices(indices)]
+
+    # Episode statistics are reported in the same way as the Monitor wrapper
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [wrapper_class is Monitor for _ in self._get_indices(indices)]
+
+# Worker process of SharedMemoryVecEnv, stepping the environments in env_indices. Observations, rewards and
+# dones are written straight into the shared buffers, only the infos of finished episodes go through the pipe
+def shm_worker(remote, parent_remote, env_config, env_kwargs, env_indices, shared_buffers, core):
+    parent_remote.close()
+    if core is not None:
+        os.sched_setaffinity(0, {core})
+    obs_buf, rew_buf, done_buf, act_buf = [np.frombuffer(raw, dtype=dtype).reshape(shape) for raw, dtype, shape in shared_buffers]
+    envs = [Monitor(gym.make('MultiAgentGridworld-v1', env_config=env_config, **env_kwargs)) for _ in env_indices]
+    try:
+        while True:
+            cmd, data = remote.recv()
+            if cmd == 'step':
+                infos = {}
+                for env, i in zip(envs, env_indices):
+                    obs, reward, terminated, truncated, info = env.step(act_buf[i])
+                    done = terminated or truncated
+                    if done:
+                        infos[i] = {'TimeLimit.truncated': truncated and not terminated, 'terminal_observation': obs, 'episode': info['episode']}
+                        obs, _ = env.reset()
+                    obs_buf[i], rew_buf[i], done_buf[i] = obs, reward, done
+                remote.send(infos)
+            elif cmd == 'reset':
+                seeds, options = data
+                for env, i in zip(envs, env_indices):
+                    obs_buf[i], _ = env.reset(seed=seeds[i], options=options[i])
+                remote.send(None)
+            elif cmd == 'get_attr':
+                remote.send({i: env.get_wrapper_attr(data) for env, i in zip(envs, env_indices)})
+            elif cmd == 'set_attr':
+                name, value, indices = data
+                for env, i in zip(envs, env_indices):
+                    if i in indices:
+                        setattr(env.unwrapped, name, value)
+                remote.send(None)
+            elif cmd == 'env_method':
+                name, args, kwargs, indices = data
+                remote.send({i: env.get_wrapper_attr(name)(*args, **kwargs) for env, i in zip(envs, env_indices) if i in indices})
+            elif cmd == 'is_wrapped':
+                remote.send({i: isinstance(env, data) for env, i in zip(envs, env_indices)})
+            elif cmd == 'close':
+                remote.close()
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for env in envs:
+            env.close()
+
+# Multiprocess vectorized environment where each worker steps a contiguous slice of the environments and
+# exchanges observations, rewards, dones and actions through shared memory NumPy buffers instead of pickling
+# them through pipes. Workers are pinned to the cores this process is allowed to run on (the cores allocated
+# by Slurm), one core per worker. Per step infos are only forwarded for finished episodes.
+class SharedMemoryVecEnv(VecEnv):
+    def __init__(self, env_config, num_envs, obs_mode='decimal', action_mode='discrete', num_workers=None, start_method='forkserver'):
+        cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else []
+        self.num_workers = min(num_envs, num_workers or max(len(cores), 1))
+
+        # Spaces of a single environment
+        env_kwargs = {'obs_mode': obs_mode, 'action_mode': action_mode}
+        probe = MultiAgentGridworldEnv(env_config=env_config, **env_kwargs)
+        observation_space, action_space = probe.observation_space, probe.action_space
+        probe.close()
+
+        ctx = mp.get_context(start_method)
+        shapes = [
+            ((num_envs,) + observation_space.shape, observation_space.dtype),
+            ((num_envs,), np.dtype(np.float32)),
+            ((num_envs,), np.dtype(bool)),
+            ((num_envs,) + action_space.shape, action_space.dtype),
+        ]
+        shared_buffers = [(ctx.RawArray('b', int(np.prod(shape)) * dtype.itemsize), dtype, shape) for shape, dtype in shapes]
+        self.obs_buf, self.rew_buf, self.done_buf, self.act_buf = [np.frombuffer(raw, dtype=dtype).reshape(shape) for raw, dtype, shape in shared_buffers]
+
+        self.remotes, self.processes = [], []
+        for worker, env_indices in enumerate(np.array_split(np.arange(num_envs), self.num_workers)):
+            remote, work_remote = ctx.Pipe()
+            core = cores[worker % len(cores)] if cores else None
+            args = (work_remote, remote, env_config, env_kwargs, env_indices.tolist(), shared_buffers, core)
+            process = ctx.Process(target=shm_worker, args=args, daemon=True)
+            process.start()
+            work_remote.close()
+            self.remotes.append(remote)
+            self.processes.append(process)
+        self.closed = False
+        super().__init__(num_envs, observation_space, action_space)
+
+    def _request(self, cmd, data=None):
+        for remote in self.remotes:
+            remote.send((cmd, data))
+        return [remote.recv() for remote in self.remotes]
+
+    def _gather(self, results, indices):
+        merged = {}
+        for result in results:
+            merged.update(result)
+        return [merged[i] for i in self._get_indices(indices)]
+
+    def _get_indices(self, indices):
+        if indices is None:
+            return range(self.num_envs)
+        if isinstance(indices, int):
+            return [indices]
+        return indices
+
+    def reset(self):
+        self._request('reset', (self._seeds, self._options))
+        self._reset_seeds()
+        self._reset_options()
+        return self.obs_buf.copy()
+
+    def step_async(self, actions):
+        self.act_buf[:] = np.asarray(actions).reshape(self.act_buf.shape)
+        for remote in self.remotes:
+            remote.send(('step', None))
+
+    def step_wait(self):
+        infos = [{} for _ in range(self.num_envs)]
+        for remote in self.remotes:
+            for i, info in remote.recv().items():
+                infos[i] = info
+        return self.obs_buf.copy(), self.rew_buf.copy(), self.done_buf.copy(), infos
+
+    def close(self):
+        if self.closed:
+            return
+        for remote in self.remotes:
+            remote.send(('close', None))
+        for process in self.processes:
+            process.join()
+        self.closed = True
+
+    def get_attr(self, attr_name, indices=None):
+        return self._gather(self._request('get_attr', attr_name), indices)
+
+    # Only the environments in indices are changed, or have the method called
+    def set_attr(self, attr_name, value, indices=None):
+        self._request('set_attr', (attr_name, value, set(self._get_indices(indices))))
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return self._gather(self._request('env_method', (method_name, method_args, method_kwargs, set(self._get_indices(indices)))), indices)
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return self._gather(self._request('is_wrapped', wrapper_class), indices)
+
+# Builds the vectorized environment used for training
+def make_env(env_config, num_envs, seed, vec_env='dummy', obs_mode='decimal', action_mode='discrete'):
+    if vec_env == 'batched':
+        env = BatchedGridworldVecEnv(env_config, num_envs, obs_mode=obs_mode, action_mode=action_mode)
+    elif vec_env == 'shm':
+        env = SharedMemoryVecEnv(env_config, num_envs, obs_mode=obs_mode, action_mode=action_mode)
+    else:
+        vec_env_cls = SubprocVecEnv if vec_env == 'subproc' else None
+        env_kwargs = {'env_config': env_config, 'seed': seed, 'obs_mode': obs_mode, 'action_mode': action_mode}
+        env = make_vec_env('MultiAgentGridworld-v1', env_kwargs=env_kwargs, n_envs=num_envs, vec_env_cls=vec_env_cls)
+    env.seed(seed=seed)
+    env.action_space.seed(seed=seed)
+    return env
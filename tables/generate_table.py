@@ -1,11 +1,12 @@
-import glob
-import logging
-import os
-os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
-logging.getLogger('tensorflow').disabled = True
-import tensorflow as tf
 import pandas as pd
 
+# Weird Python hackery to get the last import to work
+import sys
+import os
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPT_DIR))
+from src.scalars import load_scalars
+
 if __name__ == '__main__':
     
     print('Generating results table...')
@@ -22,23 +23,7 @@ if __name__ == '__main__':
 & & $\\times 10^{5}$ & $\\times 10^{5}$ & $\\times 10^{5}$ & $\\times 10^{5}$ \\\\ \\hline'''
 
     # Gather training data
-    training_data = []
-    training_logs = glob.glob("./training_logs/*/*")
-    for log in training_logs:
-        experiment_info = log.split('/')[2].split('_')
-        algorithm = experiment_info[0]
-        st = int(experiment_info[1][3:])
-
-        for e in tf.compat.v1.train.summary_iterator(log):
-            for v in e.summary.value:
-                if v.tag == 'rollout/ep_rew_mean':
-                    training_data.append({
-                        'algorithm': algorithm,
-                        'set': st,
-                        'step': e.step,
-                        'reward': v.simple_value
-                    })
-    train_df = pd.DataFrame(training_data)
+    train_df = load_scalars('training').rename(columns={'value': 'reward'})
     
     # Add setting A results to table
     table += '\n\\multirow{6}{*}{A} '
@@ -57,25 +42,7 @@ if __name__ == '__main__':
     table += '\\hline'
         
     # Gather tuning data
-    tuning_data = []
-    tuning_logs = glob.glob("./tuning_logs/*/*")
-    for log in tuning_logs:
-        experiment_info = log.split('/')[2].split('_')
-        algorithm = experiment_info[0]
-        st = int(experiment_info[1][3:])
-        trial = int(experiment_info[2])
-
-        for e in tf.compat.v1.train.summary_iterator(log):
-            for v in e.summary.value:
-                if v.tag == 'rollout/ep_rew_mean':
-                    tuning_data.append({
-                        'algorithm': algorithm,
-                        'set': st,
-                        'step': e.step,
-                        'reward': v.simple_value,
-                        'trial': trial
-                    })
-    tune_df = pd.DataFrame(tuning_data)
+    tune_df = load_scalars('tuning').rename(columns={'value': 'reward'})
     
     # Add setting B results to table
     table += '\n\\multirow{6}{*}{B} '
@@ -94,23 +61,7 @@ if __name__ == '__main__':
     table += '\\hline'
         
     # Gather transfer data
-    transfer_data = []
-    transfer_logs = glob.glob("./transfer_logs/*/*")
-    for log in transfer_logs:
-        experiment_info = log.split('/')[2].split('_')
-        algorithm = experiment_info[0]
-        st = int(experiment_info[2][2:])
-
-        for e in tf.compat.v1.train.summary_iterator(log):
-            for v in e.summary.value:
-                if v.tag == 'rollout/ep_rew_mean':
-                    transfer_data.append({
-                        'algorithm': algorithm,
-                        'set': st,
-                        'step': e.step,
-                        'reward': v.simple_value
-                    })
-    transfer_df = pd.DataFrame(transfer_data)
+    transfer_df = load_scalars('transfer').rename(columns={'value': 'reward'})
     
     # Add setting C results to table
     table += '\n\\multirow{6}{*}{C} '
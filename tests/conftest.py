@@ -0,0 +1,4 @@
+# Weird Python hackery so that the tests can import src when pytest is run from anywhere
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,114 @@
+import collections
+import re
+import gymnasium as gym
+import src
+from src.sim import DroneSimulator
+
+# In-process stand-in for CoppeliaSim's `sim` object. Every method call counts as one round trip, the objects and
+# drawings are kept in dicts so that runs can be compared. Batch scripts are run by evaluating each Lua statement
+# as Python, which works for the calls and tables DroneSimulator generates
+class FakeSim:
+    drawing_lines = 1
+    intparam_idle_fps = 2
+    scripttype_sandboxscript = 6
+
+    def __init__(self, scripts=True):
+        self.scripts = scripts
+        self.calls = collections.Counter()
+        self.objects = {} # Handle: path, position
+        self.drawings = collections.defaultdict(list)
+        self.in_script = False
+        self.running = False
+
+    def _call(self, name):
+        if not self.in_script:
+            self.calls[name] += 1
+
+    def _new_object(self, path, position=(0.0, 0.0, 0.0)):
+        handle = len(self.objects) + 1
+        self.objects[handle] = [path, list(position)]
+        return handle
+
+    def getObject(self, path):
+        self._call('getObject')
+        for handle, (object_path, _) in self.objects.items():
+            if object_path == path:
+                return handle
+        return self._new_object(path)
+
+    def getObjectPosition(self, handle, relative_to):
+        self._call('getObjectPosition')
+        return list(self.objects[handle][1])
+
+    def setObjectPosition(self, handle, relative_to, position):
+        self._call('setObjectPosition')
+        self.objects[handle][1] = [float(v) for v in position]
+
+    def copyPasteObjects(self, handles, options=0):
+        self._call('copyPasteObjects')
+        copies = [self._new_object(self.objects[handle][0] + '_copy', self.objects[handle][1]) for handle in handles]
+        return {i + 1: handle for i, handle in enumerate(copies)} if self.in_script else copies
+
+    def addDrawingObject(self, *args):
+        self._call('addDrawingObject')
+        return 1000 + len(self.drawings)
+
+    def addDrawingObjectItem(self, handle, data):
+        self._call('addDrawingObjectItem')
+        self.drawings[handle].append([float(v) for v in data])
+
+    def removeDrawingObject(self, handle):
+        self._call('removeDrawingObject')
+
+    def startSimulation(self):
+        self._call('startSimulation')
+        self.running = True
+
+    def stopSimulation(self):
+        self._call('stopSimulation')
+        self.running = False
+
+    def executeScriptString(self, code, script):
+        self._call('executeScriptString')
+        if not self.scripts:
+            raise RuntimeError('executeScriptString is not available')
+        self.in_script = True
+        for statement in code.split('\n'):
+            eval(re.sub(r'\{([^{}]*)\}', r'[\1]', statement), {'sim': self})
+        self.in_script = False
+
+# Counts the client side calls of the stepping mode
+class FakeClient:
+    def __init__(self, sim):
+        self.sim = sim
+
+    def setStepping(self, enabled):
+        self.sim.calls['setStepping'] += 1
+
+    def step(self):
+        self.sim.calls['step'] += 1
+
+# Runs an episode with random actions through a DroneSimulator on a fake sim, returning the fake
+def run(env_config, steps, seed, scripts, stepping):
+    env = gym.make('MultiAgentGridworld-v1', env_config=env_config)
+    obs, info = env.reset(seed=seed)
+    env.action_space.seed(seed)
+    sim = FakeSim(scripts=scripts)
+    for i in range(env.unwrapped.num_agents): # Targets start where the scene places them
+        sim._new_object('/target[' + str(i) + ']', (float(i), 0.0, 0.35))
+
+    drone_simulator = DroneSimulator(sim, polygon=env.unwrapped.poly_vertices, scaling_factor=5, height=0.35, client=FakeClient(sim), stepping=stepping)
+    drone_simulator.draw_field()
+    drone_simulator.set_agent_positions(k=env.unwrapped.num_agents, info=info)
+    drone_simulator.set_weed_locations(weed_locations=env.unwrapped.infected_locations)
+    drone_simulator.start_simulation()
+    setup_calls = sum(sim.calls.values())
+    for _ in range(steps):
+        obs, reward, terminated, truncated, info = env.step(env.action_space.sample())
+        drone_simulator.move_agents(k=env.unwrapped.num_agents, info=info)
+        if terminated or truncated:
+            break
+    drone_simulator.stop_simulation()
+    sim.setup_calls = setup_calls
+    sim.steps = env.unwrapped.step_count
+    return sim
@@ -0,0 +1,174 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import pytest
+from stable_baselines3 import A2C
+from stable_baselines3.common.callbacks import BaseCallback, CallbackList
+import src.checkpoint
+from src.checkpoint import BackgroundCheckpointCallback, atomic_write, clear_completed, completed_run, latest_checkpoint, mark_completed
+from src.utils import load_experiment
+from src.vec_env import make_env
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def make_model():
+    env = make_env(load_experiment('experiments/set1.yaml'), 1, 0, 'batched')
+    return A2C('MlpPolicy', env, n_steps=5, seed=0)
+
+# Sends a signal to the test process at a given step, before the checkpoint callback sees that step
+class SignalCallback(BaseCallback):
+    def __init__(self, signum, at_step):
+        super().__init__()
+        self.signum = signum
+        self.at_step = at_step
+
+    def _on_step(self):
+        if self.num_timesteps == self.at_step:
+            os.kill(os.getpid(), self.signum)
+        return True
+
+# A finished run is marked in its checkpoint directory until a new run starts in it
+def test_completion_marker(tmp_path):
+    directory = str(tmp_path / 'A2C_set1')
+    assert completed_run(directory) is None
+    mark_completed(directory, 2000, 'trained_models/A2C_set1.zip')
+    completed = completed_run(directory)
+    assert completed['steps'] == 2000 and completed['model'] == 'trained_models/A2C_set1.zip'
+    clear_completed(directory)
+    clear_completed(directory)
+    assert completed_run(directory) is None
+
+# A failed write leaves the old content in place, and a successful one leaves no temporary file behind
+def test_atomic_write(tmp_path, monkeypatch):
+    path = str(tmp_path / 'latest.json')
+    atomic_write(path, b'old')
+    assert os.listdir(tmp_path) == ['latest.json']
+
+    def failing_replace(src, dst):
+        raise OSError('disk full')
+    monkeypatch.setattr(os, 'replace', failing_replace)
+    with pytest.raises(OSError):
+        atomic_write(path, b'new')
+    monkeypatch.undo()
+    with open(path, 'rb') as file:
+        assert file.read() == b'old'
+
+    atomic_write(path, b'new')
+    with open(path, 'rb') as file:
+        assert file.read() == b'new'
+    assert os.listdir(tmp_path) == ['latest.json']
+
+# Only the keep newest checkpoints are kept, with their side files. Age is by modification time, so the higher step
+# counts of an older run do not outlive a new one, and files of other runs are left alone
+def test_retention(tmp_path):
+    directory = str(tmp_path)
+    names = ['A2C_set1_9000_steps.zip', 'A2C_set1_replay_buffer_9000_steps.pkl', 'A2C_set1_8000_steps.zip',
+             'A2C_set1_100_steps.zip', 'A2C_set1_vecnormalize_100_steps.pkl', 'A2C_set1_200_steps.zip',
+             'A2C_set12_50_steps.zip', 'latest.json']
+    for age, name in enumerate(reversed(names)):
+        atomic_write(os.path.join(directory, name), b'')
+        os.utime(os.path.join(directory, name), (1000 + age, 1000 + age)) # Earlier in the list is newer
+    BackgroundCheckpointCallback(directory, 'A2C_set1', keep=2)._remove_old_checkpoints()
+    assert sorted(os.listdir(directory)) == sorted(['A2C_set1_9000_steps.zip', 'A2C_set1_replay_buffer_9000_steps.pkl',
+                                                    'A2C_set1_8000_steps.zip', 'A2C_set12_50_steps.zip', 'latest.json'])
+
+    # Checkpoints of the new run are the newest ones
+    for name, mtime in (('A2C_set1_100_steps.zip', 2000), ('A2C_set1_200_steps.zip', 2001)):
+        atomic_write(os.path.join(directory, name), b'')
+        os.utime(os.path.join(directory, name), (mtime, mtime))
+    BackgroundCheckpointCallback(directory, 'A2C_set1', keep=2)._remove_old_checkpoints()
+    assert sorted(os.listdir(directory)) == sorted(['A2C_set1_100_steps.zip', 'A2C_set1_200_steps.zip', 'A2C_set12_50_steps.zip', 'latest.json'])
+
+    BackgroundCheckpointCallback(directory, 'A2C_set1', keep=0)._remove_old_checkpoints()
+    assert len(os.listdir(directory)) == 4
+
+# Checkpoints are written by the background thread while training goes on, and the last one is on disk when learn
+# returns, even when writing is slower than training
+def test_background_save_finishes(tmp_path, monkeypatch):
+    write = src.checkpoint.atomic_write
+    def slow_write(path, data):
+        time.sleep(0.2)
+        write(path, data)
+    monkeypatch.setattr(src.checkpoint, 'atomic_write', slow_write)
+
+    directory = str(tmp_path)
+    model = make_model()
+    callback = BackgroundCheckpointCallback(directory, 'A2C_set1', save_steps=25, keep=2, target_steps=100)
+    model.learn(total_timesteps=100, callback=callback)
+    assert callback.writer is None
+    checkpoint = latest_checkpoint(directory)
+    assert checkpoint['steps'] == 100 and checkpoint['target_steps'] == 100
+    assert checkpoint['model'] == os.path.join(directory, 'A2C_set1_100_steps.zip') and os.path.exists(checkpoint['model'])
+    assert sorted(os.listdir(directory)) == ['A2C_set1_100_steps.zip', 'A2C_set1_75_steps.zip', 'latest.json']
+    model.get_env().close()
+
+# An error of the writer thread stops training instead of being lost
+def test_background_save_error(tmp_path, monkeypatch):
+    def failing_write(path, data):
+        raise OSError('disk full')
+    monkeypatch.setattr(src.checkpoint, 'atomic_write', failing_write)
+    model = make_model()
+    callback = BackgroundCheckpointCallback(str(tmp_path), 'A2C_set1', save_steps=25)
+    with pytest.raises(OSError, match='disk full'):
+        model.learn(total_timesteps=100, callback=callback)
+    model.get_env().close()
+
+# SIGTERM and SIGUSR1 write a checkpoint of the step they arrive at and stop training
+@pytest.mark.parametrize('signum', [signal.SIGTERM, signal.SIGUSR1])
+def test_signal_saves_and_stops(tmp_path, signum):
+    handlers = {s: signal.getsignal(s) for s in (signal.SIGTERM, signal.SIGUSR1)}
+    directory = str(tmp_path)
+    model = make_model()
+    callback = BackgroundCheckpointCallback(directory, 'A2C_set1', save_steps=0, save_minutes=0)
+    try:
+        callback.install_signal_handlers()
+        model.learn(total_timesteps=1000, callback=CallbackList([SignalCallback(signum, 30), callback]))
+    finally:
+        for s, handler in handlers.items():
+            signal.signal(s, handler)
+    assert callback.interrupted and model.num_timesteps == 30
+    assert latest_checkpoint(directory)['steps'] == 30
+    assert os.path.exists(os.path.join(directory, 'A2C_set1_30_steps.zip'))
+    model.get_env().close()
+
+def run_train(directory, *arguments):
+    command = [sys.executable, os.path.join(ROOT, 'train.py'), '--algorithm', 'A2C', '--set', '1', '--num_envs', '1',
+               '--vec_env', 'batched', '--seed', '0', '--checkpoint_steps', '10', *arguments]
+    return subprocess.run(command, cwd=directory, check=True, capture_output=True, text=True).stdout
+
+# Without a checkpoint to resume, --resume True trains the saved model for --steps more steps. An unfinished run is
+# resumed up to the step count it was started with, and --skip_completed leaves a finished run alone
+def test_train_resume(tmp_path):
+    directory = str(tmp_path)
+    os.symlink(os.path.join(ROOT, 'experiments'), os.path.join(directory, 'experiments'))
+    model_path = os.path.join(directory, 'trained_models', 'A2C_set1.zip')
+    checkpoint_dir = os.path.join(directory, 'checkpoints', 'A2C_set1')
+
+    run_train(directory, '--steps', '20')
+    assert A2C.load(model_path).num_timesteps == 20
+    assert completed_run(checkpoint_dir)['steps'] == 20
+
+    stdout = run_train(directory, '--steps', '20', '--resume', 'True')
+    assert 'for 20 more steps' in stdout
+    assert A2C.load(model_path).num_timesteps == 40
+    assert latest_checkpoint(checkpoint_dir)['target_steps'] == 40
+
+    # A run stopped after its last checkpoint is resumed to its own target, whatever --steps is
+    clear_completed(checkpoint_dir)
+    stdout = run_train(directory, '--steps', '1000', '--resume', 'True')
+    assert 'Resuming from the checkpoint at step 40, 0 steps left' in stdout
+    assert A2C.load(model_path).num_timesteps == 40
+
+    stdout = run_train(directory, '--steps', '20', '--resume', 'True', '--skip_completed', 'True')
+    assert 'A2C_set1 already finished at step 40' in stdout
+    assert A2C.load(model_path).num_timesteps == 40
+
+    # A new run does not resume the checkpoints of the older one
+    run_train(directory, '--steps', '10')
+    assert latest_checkpoint(checkpoint_dir)['steps'] == 10
+    assert A2C.load(model_path).num_timesteps == 10
+    with open(os.path.join(checkpoint_dir, 'completed.json')) as completed_file:
+        assert json.load(completed_file)['steps'] == 10
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+from src.env import MultiAgentGridworldEnv
+from src.utils import load_experiment
+
+# Agents standing on weeds collect each weed once, which sets its bit in the weed state and the bitmask, the first
+# weed being the most significant bit
+@pytest.mark.parametrize('obs_mode', ['decimal', 'bits'])
+def test_collect_weeds(obs_mode):
+    env_config = load_experiment('experiments/set1.yaml')
+    env = MultiAgentGridworldEnv(env_config=env_config, obs_mode=obs_mode, action_mode='multidiscrete')
+    weeds = env_config['infected_locations']
+    env.set_state([weeds[0], weeds[2], env_config['init_positions'][2]], np.zeros(len(weeds)))
+    stay = [4, 4, 4]
+
+    obs, reward, terminated, _, _ = env.step(stay)
+    assert reward == 2 * 100 - 3 and not terminated
+    assert env.weed_state.tolist() == [1, 0, 1, 0, 0, 0]
+    assert env.collected == 0b101000
+    assert obs[3:].tolist() == ([1, 0, 1, 0, 0, 0] if obs_mode == 'bits' else [0b101000])
+
+    _, reward, _, _, _ = env.step(stay)
+    assert reward == -30
+    assert env.infected_locations == [tuple(weed) for i, weed in enumerate(weeds) if i not in (0, 2)]
+
+# Collecting the last weed ends the episode
+def test_all_weeds_collected():
+    env_config = load_experiment('experiments/set1.yaml')
+    env = MultiAgentGridworldEnv(env_config=env_config, action_mode='multidiscrete')
+    weeds = env_config['infected_locations']
+    env.set_state([weeds[5], env_config['init_positions'][1], env_config['init_positions'][2]], [1, 1, 1, 1, 1, 0])
+    obs, reward, terminated, _, _ = env.step([4, 4, 4])
+    assert terminated and reward == 100 - 3 + 100000
+    assert obs[-1] == 2**6 - 1
+
+# Profiling only times the step phases, the transitions are the same as without it
+def test_profiled_step_matches_step():
+    env_config = load_experiment('experiments/set1.yaml')
+    env = MultiAgentGridworldEnv(env_config=env_config, profile=False)
+    profiled = MultiAgentGridworldEnv(env_config=env_config, profile=True, profile_interval=50)
+    env.reset(seed=0)
+    profiled.reset(seed=0)
+    rng = np.random.default_rng(0)
+    for step in range(200):
+        action = int(rng.integers(env.action_space.n))
+        expected, result = env.step(action), profiled.step(action)
+        assert np.array_equal(expected[0], result[0])
+        assert expected[1:4] == result[1:4]
+        assert ('profile' in result[4]) == ((step + 1) % 50 == 0)
+        if expected[2]:
+            env.reset(seed=step)
+            profiled.reset(seed=step)
+    assert env.get_profile() == {}
+    assert profiled.get_profile()['obs']['calls'] == 200
@@ -0,0 +1,48 @@
+import os
+import subprocess
+import sys
+import pandas as pd
+from stable_baselines3 import A2C
+from src.utils import load_experiment, model_modes, set_model_modes
+from src.vec_env import make_env
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Saves an untrained model of set1 with 'bits' observations, whose spaces only fit fields with 6 weeds and 3 agents
+def save_model(models_dir):
+    env = make_env(load_experiment('experiments/set1.yaml'), 1, 0, 'dummy', 'bits', 'multidiscrete')
+    model = set_model_modes(A2C('MlpPolicy', env, n_steps=5, seed=0), 'bits', 'multidiscrete')
+    model.save(os.path.join(models_dir, 'A2C_set1.zip'))
+    env.close()
+
+def evaluate(models_dir, output, sets):
+    command = [sys.executable, 'evaluate.py', '--models_dir', models_dir, '--sets', *map(str, sets), '--modes', 'deterministic',
+               '--episodes', '1', '--num_envs', '1', '--vec_env', 'dummy', '--workers', '1', '--output', output]
+    return subprocess.run(command, cwd=ROOT, check=True, capture_output=True, text=True).stdout
+
+# The modes are saved in the model file
+def test_model_modes_are_saved(tmp_path):
+    save_model(str(tmp_path))
+    assert model_modes(A2C.load(str(tmp_path / 'A2C_set1.zip'))) == ('bits', 'multidiscrete')
+
+# Sets whose spaces do not fit the model get a skipped row, and a second run only evaluates what the table is missing
+def test_evaluate_skips_mismatched_sets_and_resumes(tmp_path):
+    models_dir, output = str(tmp_path / 'models'), str(tmp_path / 'results.csv')
+    os.makedirs(models_dir)
+    save_model(models_dir)
+
+    stdout = evaluate(models_dir, output, [1, 2])
+    assert 'skipped sets [2]' in stdout
+    results = pd.read_csv(output)
+    assert sorted(zip(results['set'], results['skipped'])) == [(1, False), (2, True)]
+    first_run = results.set_index('set')['evaluated_on']
+
+    stdout = evaluate(models_dir, output, [1, 2])
+    assert '0 models to evaluate, 1 already evaluated' in stdout
+    assert pd.read_csv(output).set_index('set')['evaluated_on'].equals(first_run)
+
+    stdout = evaluate(models_dir, output, [1, 2, 5])
+    assert '1 models to evaluate' in stdout
+    results = pd.read_csv(output).set_index('set')
+    assert sorted(results.index) == [1, 2, 5] and not results.loc[5, 'skipped']
+    assert results['evaluated_on'][[1, 2]].equals(first_run)
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+import yaml
+from src.env import MultiAgentGridworldEnv
+from src.field import FieldSpec
+from src.field_pool import FieldPool, build_field_pool, load_field_pool, weed_index_dtype
+from src.utils import load_experiment
+from src.vec_env import make_env
+
+def test_weed_index_dtype():
+    assert weed_index_dtype(128) == np.int8
+    assert weed_index_dtype(129) == np.int16
+    assert weed_index_dtype(40_000) == np.int32
+
+# Fields with more weeds than an int8 can number keep every weed index
+def test_pool_with_many_weeds(tmp_path):
+    with open('experiments/set1.yaml', 'r') as experiment_file:
+        config = yaml.load(experiment_file, Loader=yaml.FullLoader)
+    inside = np.argwhere(FieldSpec.from_config(config).field_mask.mask)
+    config['infected_locations'] = inside[:200].tolist()
+    experiment_path = tmp_path / 'many_weeds.yaml'
+    with open(experiment_path, 'w') as experiment_file:
+        yaml.dump(config, experiment_file)
+
+    build_field_pool(['experiments/set1.yaml', experiment_path], tmp_path / 'pool')
+    pool = FieldPool(tmp_path / 'pool')
+    assert pool.max_weeds == 200
+    expected = FieldSpec.from_config(config).weed_index
+    np.testing.assert_array_equal(pool.field_spec(1).weed_index[:len(expected), :len(expected)], expected)
+    assert pool.weed_index[1].max() == 199
+
+SETS = [f'experiments/set{i}.yaml' for i in range(1, 11)]
+
+@pytest.fixture(scope='module')
+def pool_config(tmp_path_factory):
+    path = tmp_path_factory.mktemp('pool')
+    build_field_pool(SETS, path)
+    return load_field_pool(str(path))
+
+# Each field of a pool of the sets steps like the environment built from its experiment file
+@pytest.mark.parametrize('obs_mode, action_mode', [('decimal', 'discrete'), ('bits', 'multidiscrete')])
+def test_pool_fields_step_like_their_sets(pool_config, obs_mode, action_mode):
+    pool_env = MultiAgentGridworldEnv(env_config=pool_config, obs_mode=obs_mode, action_mode=action_mode)
+    max_weeds = pool_config['field_pool'].max_weeds
+    for field, path in enumerate(SETS):
+        env = MultiAgentGridworldEnv(env_config=load_experiment(path), obs_mode=obs_mode, action_mode=action_mode)
+        obs, _ = env.reset(seed=field)
+        pool_obs, info = pool_env.reset(seed=field, options={'field': field})
+        assert info['field'] == field
+        env.action_space.seed(field)
+        for _ in range(300):
+            if obs_mode == 'bits': # The pool observes as many weeds as its largest field has
+                assert np.array_equal(pool_obs[:len(obs)], obs) and not pool_obs[len(obs):].any()
+                assert len(pool_obs) == env.num_agents + max_weeds
+            else:
+                assert np.array_equal(pool_obs, obs)
+            action = env.action_space.sample()
+            obs, reward, terminated, truncated, _ = env.step(action)
+            pool_obs, pool_reward, pool_terminated, pool_truncated, _ = pool_env.step(action)
+            assert (reward, terminated, truncated) == (pool_reward, pool_terminated, pool_truncated)
+            if terminated:
+                break
+
+# The fields sampled on reset only depend on the reset seed
+def test_field_sampling_is_reproducible(pool_config):
+    fields = lambda seed: [MultiAgentGridworldEnv(env_config=pool_config).reset(seed=seed + i)[1]['field'] for i in range(20)]
+    assert fields(0) == fields(0)
+    assert len(set(fields(0))) > 1
+
+# Every vectorized environment backend samples the same fields and steps them the same way
+def test_vec_envs_sample_same_fields(pool_config):
+    results = []
+    for vec_env in ['dummy', 'subproc', 'shm']:
+        env = make_env(pool_config, 3, 5, vec_env)
+        try:
+            env.action_space.seed(5)
+            observations = [env.reset()]
+            for _ in range(50):
+                observations.append(env.step(np.array([env.action_space.sample() for _ in range(3)]))[0])
+            results.append((np.array(observations), [state['field'] for state in env.env_method('get_state')]))
+        finally:
+            env.close()
+    for observations, fields in results[1:]:
+        assert np.array_equal(observations, results[0][0]) and fields == results[0][1]
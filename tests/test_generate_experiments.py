@@ -0,0 +1,51 @@
+import argparse
+import numpy as np
+import pytest
+from shapely import Polygon
+from shapely.geometry import Point
+from generate_experiments import generate_experiment, sample_field
+from src.field import rasterize_polygon
+from src.utils import load_experiment
+
+def batch_args(**kwargs):
+    args = {'max_size': 50, 'num_agents': 3, 'min_weeds': 5, 'max_weeds': 9, 'min_spacing': 5, 'min_area': 0.2, 'max_attempts': 1000}
+    return argparse.Namespace(**{**args, **kwargs})
+
+# Generated experiments load like the hand made sets and meet every constraint, with all points strictly inside the field
+@pytest.mark.parametrize('kwargs', [{}, {'num_agents': 5, 'min_weeds': 12, 'max_weeds': 20, 'min_spacing': 8, 'max_size': 30}])
+def test_generated_experiments_meet_constraints(tmp_path, kwargs):
+    args = batch_args(**kwargs)
+    for i, seed in enumerate(np.random.SeedSequence(0).spawn(20)):
+        path = generate_experiment(str(tmp_path / f'set{i + 1}.yaml'), seed, args)
+        experiment = load_experiment(path)
+        field = Polygon(experiment['field'])
+        positions = np.array(experiment['init_positions'])
+        weeds = experiment['infected_locations']
+
+        assert experiment['grid_size'] == args.max_size
+        assert len(positions) == args.num_agents
+        assert args.min_weeds <= len(weeds) <= args.max_weeds and len(set(weeds)) == len(weeds)
+        assert all(field.contains(Point(point)) for point in list(map(tuple, positions)) + weeds)
+        distances = np.linalg.norm(positions[:, None] - positions[None], axis=-1)
+        assert distances[~np.eye(len(positions), dtype=bool)].min() >= args.min_spacing
+        assert rasterize_polygon(np.array(experiment['field']), args.max_size, pad=0).sum() >= args.min_area * args.max_size ** 2
+
+# The same seed gives the same experiment
+def test_generation_is_reproducible(tmp_path):
+    seed = np.random.SeedSequence(7)
+    paths = [generate_experiment(str(tmp_path / f'set{i}.yaml'), seed, batch_args()) for i in range(2)]
+    assert open(paths[0]).read() == open(paths[1]).read()
+
+# Constraints no field can meet raise an error naming them, instead of sampling forever
+@pytest.mark.parametrize('kwargs, constraint', [
+    ({'min_area': 1.0}, '--min_area'),
+    ({'num_agents': 4, 'min_spacing': 100}, '--min_spacing'),
+])
+def test_impossible_constraints(tmp_path, kwargs, constraint):
+    with pytest.raises(ValueError, match=constraint):
+        generate_experiment(str(tmp_path / 'set1.yaml'), 0, batch_args(max_attempts=20, **kwargs))
+    assert not (tmp_path / 'set1.yaml').exists()
+
+def test_grid_too_small_for_a_field():
+    with pytest.raises(ValueError, match='too small'):
+        sample_field(np.random.default_rng(0), 1, attempts=10)
@@ -0,0 +1,83 @@
+import os
+import stat
+import threading
+import numpy as np
+import pytest
+from stable_baselines3 import A2C
+from src.inference_server import InferenceClient, InferenceServer, generate_authkey, read_authkey
+from src.numpy_policy import NumpyPolicy, export_policy
+from src.utils import load_experiment
+from src.vec_env import make_env
+
+@pytest.fixture
+def policy(tmp_path):
+    env = make_env(load_experiment('experiments/set1.yaml'), 1, 0, 'dummy', 'decimal', 'discrete')
+    export_policy(A2C('MlpPolicy', env, seed=0, device='cpu'), 'A2C', str(tmp_path / 'A2C_set1.npz'))
+    env.close()
+    return NumpyPolicy(str(tmp_path / 'A2C_set1.npz'))
+
+def test_tcp_needs_authkey(policy):
+    with pytest.raises(ValueError):
+        InferenceServer({'A2C_set1': policy}, 'localhost:0')
+
+# Generated keys are only readable by their owner, and clients reading them get the actions of the served policy
+def test_generated_authkey(policy, tmp_path):
+    key_path = str(tmp_path / 'inference.key')
+    authkey = generate_authkey(key_path)
+    assert stat.S_IMODE(os.stat(key_path).st_mode) == 0o600
+    assert read_authkey(authkey_file=key_path) == authkey
+
+    server = InferenceServer({'A2C_set1': policy}, 'localhost:0', authkey=authkey)
+    host, port = server.listener.address
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        client = InferenceClient(f'{host}:{port}', 'A2C_set1', read_authkey(authkey_file=key_path))
+        obs = np.random.default_rng(0).integers(0, policy.obs_nvec, size=(8, len(policy.obs_nvec)))
+        actions, _ = client.predict(obs, deterministic=True)
+        np.testing.assert_array_equal(actions, policy.predict(obs, deterministic=True)[0])
+        client.close()
+    finally:
+        server.close()
+
+# Unix sockets need no key and are created so that only their owner can connect, without changing the umask of the
+# process
+def test_unix_socket_owner_only(policy, tmp_path):
+    umask = os.umask(0o022)
+    try:
+        server = InferenceServer({'A2C_set1': policy}, str(tmp_path / 'inference.sock'))
+        assert os.umask(0o022) == 0o022
+    finally:
+        os.umask(umask)
+    try:
+        assert stat.S_IMODE(os.stat(tmp_path / 'inference.sock').st_mode) & 0o077 == 0
+    finally:
+        server.close()
+
+# Malformed requests get an error reply instead of closing the connection, and the client can go on predicting
+def test_malformed_requests(policy, tmp_path):
+    address = str(tmp_path / 'inference.sock')
+    server = InferenceServer({'A2C_set1': policy}, address)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        client = InferenceClient(address, 'A2C_set1')
+        obs = np.zeros((2, len(policy.obs_nvec)), dtype=np.int64)
+        requests = {
+            'Unknown model': ('predict', 'PPO_set1', obs, None, True),
+            'must have shape': ('predict', 'A2C_set1', obs[:, :-1], None, True),
+            'must be integers': ('predict', 'A2C_set1', obs.astype(float), None, True),
+            'out of range': ('predict', 'A2C_set1', obs - 1, None, True),
+            'one entry per observation': ('predict', 'A2C_set1', obs, [True, False, True], True),
+            'Predict requests must be': ('predict', 'A2C_set1', obs),
+            'Unknown request': ('train',),
+            'must be tuples': 'predict',
+        }
+        for error, request in requests.items():
+            with pytest.raises(RuntimeError, match=error):
+                client.request(request)
+        client.connection.send_bytes(b'not a pickle')
+        assert client.connection.recv()[0] == 'error'
+        actions, _ = client.predict(obs, episode_start=[True, False], deterministic=True)
+        np.testing.assert_array_equal(actions, policy.predict(obs, deterministic=True)[0])
+        client.close()
+    finally:
+        server.close()
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+import stable_baselines3.common.preprocessing as preprocessing
+import stable_baselines3.common.torch_layers as torch_layers
+from export import verify
+from src.numpy_policy import NumpyPolicy, export_policy
+from src.utils import get_algorithm, load_experiment
+from src.vec_env import make_env
+
+# An exported freshly built model picks the same deterministic actions as the model, and recurrent ones keep the same
+# LSTM states, on random observations
+@pytest.mark.parametrize('algorithm, obs_mode, action_mode', [
+    ('A2C', 'decimal', 'discrete'),
+    ('PPO', 'decimal', 'discrete'),
+    ('TRPO', 'decimal', 'discrete'),
+    ('DQN', 'decimal', 'discrete'),
+    ('ARS', 'decimal', 'discrete'),
+    ('RecurrentPPO', 'decimal', 'discrete'),
+    ('PPO', 'bits', 'multidiscrete'),
+])
+def test_exported_policy_matches_model(algorithm, obs_mode, action_mode, tmp_path, monkeypatch):
+    # Some torch versions reject the NumPy integer SB3 gives as the input size of the LSTM
+    get_flattened_obs_dim = preprocessing.get_flattened_obs_dim
+    for module in (preprocessing, torch_layers):
+        monkeypatch.setattr(module, 'get_flattened_obs_dim', lambda space: int(get_flattened_obs_dim(space)))
+
+    env = make_env(load_experiment('experiments/set1.yaml'), 1, 0, 'dummy', obs_mode, action_mode)
+    model = get_algorithm(algorithm)('MlpLstmPolicy' if algorithm == 'RecurrentPPO' else 'MlpPolicy', env, seed=0, device='cpu')
+    path = str(tmp_path / f'{algorithm}.npz')
+    export_policy(model, algorithm, path)
+    assert verify(model, NumpyPolicy(path), 32, 20, 0) == 0
+    env.close()
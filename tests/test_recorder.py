@@ -0,0 +1,35 @@
+import numpy as np
+from PIL import Image, ImageSequence
+from src.recorder import FrameRecorder, GifStreamWriter
+
+def read_gif(path):
+    with Image.open(path) as gif:
+        return [np.array(frame.convert('RGB')) for frame in ImageSequence.Iterator(gif)], gif.info
+
+# Tiled frames recorded to a GIF are read back with their count, size, colours and timing
+def test_gif_recording(tmp_path):
+    path = str(tmp_path / 'rollout.gif')
+    frames = np.zeros((5, 2, 16, 24, 3), dtype=np.uint8)
+    for i in range(5):
+        frames[i, 0, :, :, i % 3] = 50 * i
+        frames[i, 1, :8] = 255
+    with FrameRecorder(path, fps=10) as recorder:
+        for i in range(5):
+            recorder.record(frames[i])
+    read, info = read_gif(path)
+    assert info['loop'] == 0 and info['duration'] == 100
+    assert len(read) == 5
+    for i, frame in enumerate(read):
+        np.testing.assert_array_equal(frame, np.concatenate(frames[i], axis=1))
+
+# Every frame is written to the file when it is appended, not when the writer is closed
+def test_gif_frames_written_when_appended(tmp_path):
+    path = str(tmp_path / 'rollout.gif')
+    writer = GifStreamWriter(path, 30)
+    sizes = []
+    for i in range(3):
+        writer.append_data(np.full((8, 8, 3), 80 * i, dtype=np.uint8))
+        sizes.append(writer.file.tell())
+    writer.close()
+    assert sizes[0] < sizes[1] < sizes[2]
+    assert len(read_gif(path)[0]) == 3
@@ -0,0 +1,82 @@
+import os
+import pandas as pd
+import pytest
+import src.scalars as scalars
+from src.scalars import update_cache
+
+SummaryWriter = pytest.importorskip('torch.utils.tensorboard').SummaryWriter
+
+formats = ['csv', pytest.param('parquet', marks=pytest.mark.skipif(scalars.pyarrow is None, reason='pyarrow is not installed'))]
+
+# Uses the given cache format and counts the files the cache update parses
+@pytest.fixture
+def parsed(monkeypatch, request):
+    if request.param == 'csv':
+        monkeypatch.setattr(scalars, 'pyarrow', None)
+    read_many = scalars.read_many
+    parsed = []
+    def counting_read_many(paths, **kwargs):
+        parsed.extend(paths)
+        return read_many(paths, **kwargs)
+    monkeypatch.setattr(scalars, 'read_many', counting_read_many)
+    return parsed
+
+def add_scalars(writer, steps):
+    for step in steps:
+        writer.add_scalar('rollout/ep_rew_mean', step * 0.5, step)
+    writer.flush()
+
+# Rows of the cache as plain values
+def cache_rows(cache):
+    return sorted(cache[['run', 'set', 'trial', 'step', 'value']].astype(object).itertuples(index=False, name=None))
+
+# Only new and grown event files are parsed again, and rows of deleted files are dropped
+@pytest.mark.parametrize('parsed', formats, indirect=True)
+def test_cache_invalidation(tmp_path, parsed):
+    log_dirs = {'training': str(tmp_path / 'training_logs'), 'tuning': str(tmp_path / 'tuning_logs')}
+    cache_path = str(tmp_path / 'logs_cache' / 'scalars.parquet')
+    growing = SummaryWriter(os.path.join(log_dirs['training'], 'A2C_set1_0'))
+    add_scalars(growing, range(0, 100, 10))
+    tuning = SummaryWriter(os.path.join(log_dirs['tuning'], 'PPO_set2_3_1'))
+    add_scalars(tuning, range(5))
+    tuning.close()
+
+    cache = update_cache(cache_path, log_dirs, workers=1, verbose=False)
+    assert len(parsed) == 2 and len(cache) == 15
+    assert cache.loc[cache['run'] == 'PPO_set2_3_1', 'trial'].tolist() == [3] * 5
+
+    # Nothing changed, the cache is read back as it was written
+    reloaded = update_cache(cache_path, log_dirs, workers=1, verbose=False)
+    assert len(parsed) == 2
+    assert cache_rows(reloaded) == cache_rows(cache)
+    assert str(reloaded['set'].dtype) == 'Int64' and str(reloaded['run'].dtype) == 'category'
+
+    # The training run wrote more scalars to the same event file
+    add_scalars(growing, range(100, 150, 10))
+    cache = update_cache(cache_path, log_dirs, workers=1, verbose=False)
+    assert len(parsed) == 3 and parsed[-1].startswith(log_dirs['training'])
+    assert sorted(cache.loc[cache['run'] == 'A2C_set1_0', 'step'].tolist()) == list(range(0, 150, 10))
+    assert len(cache) == 20
+    growing.close()
+
+    # A deleted run is dropped without parsing anything
+    tuning_file = os.path.join(log_dirs['tuning'], 'PPO_set2_3_1', os.listdir(os.path.join(log_dirs['tuning'], 'PPO_set2_3_1'))[0])
+    os.remove(tuning_file)
+    parsed.clear()
+    cache = update_cache(cache_path, log_dirs, workers=1, verbose=False)
+    assert parsed == [] and set(cache['run']) == {'A2C_set1_0'}
+
+# Without pyarrow, the cache is kept in a CSV file next to the parquet path instead of failing
+@pytest.mark.parametrize('parsed', ['csv'], indirect=True)
+def test_cache_without_pyarrow(tmp_path, parsed, capsys):
+    log_dirs = {'training': str(tmp_path / 'training_logs')}
+    writer = SummaryWriter(os.path.join(log_dirs['training'], 'DQN_set4_0'))
+    add_scalars(writer, range(3))
+    writer.close()
+    cache_path = str(tmp_path / 'logs_cache' / 'scalars.parquet')
+    cache = update_cache(cache_path, log_dirs, workers=1)
+    assert 'pyarrow is not installed' in capsys.readouterr().out
+    assert not os.path.exists(cache_path)
+    assert os.path.exists(str(tmp_path / 'logs_cache' / 'scalars.csv'))
+    assert pd.read_csv(str(tmp_path / 'logs_cache' / 'scalars.csv'))['value'].tolist() == [0.0, 0.5, 1.0]
+    assert cache['algorithm'].tolist() == ['DQN'] * 3
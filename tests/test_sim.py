@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+from tests.fake_sim import run
+from src.utils import load_experiment
+
+def scene(sim):
+    objects = {handle: position for handle, (_, position) in sim.objects.items()}
+    drawings = {handle: np.round(items, 9).tolist() for handle, items in sim.drawings.items()}
+    return objects, drawings
+
+# Batched scripts, single calls and stepping mode all leave the simulator in the same state
+@pytest.mark.parametrize('scripts, stepping', [(False, False), (True, True)])
+def test_batched_and_single_calls_give_same_scene(scripts, stepping):
+    env_config = load_experiment('experiments/set1.yaml')
+    batched = run(env_config, 100, 0, scripts=True, stepping=False)
+    other = run(env_config, 100, 0, scripts=scripts, stepping=stepping)
+    assert batched.steps == other.steps > 0
+    assert scene(batched) == scene(other)
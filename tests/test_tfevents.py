@@ -0,0 +1,96 @@
+import glob
+import os
+import numpy as np
+import pytest
+from src.tfevents import read_many, read_scalars
+
+event_accumulator = pytest.importorskip('tensorboard.backend.event_processing.event_accumulator')
+SummaryWriter = pytest.importorskip('torch.utils.tensorboard').SummaryWriter
+
+# Writes a tfevents file with SummaryWriter, returning its path and the scalars written
+def write_events(directory):
+    rng = np.random.default_rng(0)
+    writer = SummaryWriter(directory)
+    written = []
+    writer.add_text('notes', 'not a scalar', 0)
+    for step in range(0, 5000, 7):
+        for tag in ('rollout/ep_rew_mean', 'train/loss'):
+            value = float(rng.normal(scale=1e5))
+            writer.add_scalar(tag, value, step)
+            written.append((tag, step, value))
+    writer.close()
+    return glob.glob(os.path.join(directory, 'events.out.tfevents.*'))[0], written
+
+# Scalars of a file read with TensorBoard's own event processing
+def tensorboard_scalars(path, tags):
+    accumulator = event_accumulator.EventAccumulator(path, size_guidance={event_accumulator.SCALARS: 0})
+    accumulator.Reload()
+    return {tag: [(event.step, event.value) for event in accumulator.Scalars(tag)] for tag in tags}
+
+# The scalars read without TensorFlow are the ones TensorBoard reads
+def test_read_scalars_matches_tensorboard(tmp_path):
+    path, written = write_events(str(tmp_path))
+    tags, steps, values = read_scalars(path, verify_crc=True)
+    assert sorted(set(tags)) == ['rollout/ep_rew_mean', 'train/loss']
+    expected = tensorboard_scalars(path, set(tags))
+    for tag in expected:
+        selected = tags == tag
+        assert list(zip(steps[selected].tolist(), values[selected].tolist())) == expected[tag]
+    assert np.allclose(values, [value for _, _, value in written], rtol=1e-6) # Stored as 32-bit floats
+
+    only_loss = read_scalars(path, tags=['train/loss'])
+    assert set(only_loss[0]) == {'train/loss'} and len(only_loss[0]) == len(expected['train/loss'])
+
+# A record cut off at the end of the file, as in a file that is still being written, is skipped, and the records
+# before it are read
+@pytest.mark.parametrize('cut', [1, 4, 20])
+def test_truncated_trailing_record(tmp_path, cut):
+    path, written = write_events(str(tmp_path))
+    with open(path, 'rb') as events_file:
+        data = events_file.read()
+    truncated = str(tmp_path / 'truncated.tfevents')
+    with open(truncated, 'wb') as events_file:
+        events_file.write(data[:-cut])
+    tags, steps, values = read_scalars(truncated, verify_crc=True)
+    full = read_scalars(path)
+    assert len(tags) == len(full[0]) - 1
+    assert np.array_equal(steps, full[1][:-1]) and np.array_equal(values, full[2][:-1])
+
+# Checksums are only verified when asked, and a corrupted record then raises
+def test_corrupted_record(tmp_path):
+    path, _ = write_events(str(tmp_path))
+    with open(path, 'r+b') as events_file:
+        events_file.seek(-6, os.SEEK_END)
+        byte = events_file.read(1)
+        events_file.seek(-6, os.SEEK_END)
+        events_file.write(bytes([byte[0] ^ 0xFF]))
+    read_scalars(path)
+    with pytest.raises(ValueError, match='Corrupted record'):
+        read_scalars(path, verify_crc=True)
+
+# Reading several files in worker processes gives the results of reading them one by one
+def test_read_many(tmp_path):
+    paths = [write_events(str(tmp_path / str(i)))[0] for i in range(3)]
+    for result, path in zip(read_many(paths, workers=2), paths):
+        expected = read_scalars(path)
+        assert all(np.array_equal(a, b) for a, b in zip(result, expected))
+
+# Scalars written as tensors, as TensorFlow 2 summaries store them, are read from float_val and tensor_content
+def test_tensor_scalars(tmp_path):
+    from tensorboard.compat.proto import event_pb2, summary_pb2, tensor_pb2, types_pb2
+    from tensorboard.summary.writer.event_file_writer import EventFileWriter
+    writer = EventFileWriter(str(tmp_path))
+    tensors = [
+        tensor_pb2.TensorProto(dtype=types_pb2.DT_FLOAT, float_val=[1.5]),
+        tensor_pb2.TensorProto(dtype=types_pb2.DT_DOUBLE, double_val=[-2.25]),
+        tensor_pb2.TensorProto(dtype=types_pb2.DT_FLOAT, tensor_content=np.float32(3.5).tobytes()),
+        tensor_pb2.TensorProto(dtype=types_pb2.DT_DOUBLE, tensor_content=np.float64(1e10 + 0.5).tobytes()),
+    ]
+    for step, tensor in enumerate(tensors):
+        summary = summary_pb2.Summary(value=[summary_pb2.Summary.Value(tag='eval/mean_reward', tensor=tensor)])
+        writer.add_event(event_pb2.Event(step=step, summary=summary))
+    writer.close()
+    tags, steps, values = read_scalars(glob.glob(os.path.join(str(tmp_path), 'events.out.tfevents.*'))[0])
+    assert tags.tolist() == ['eval/mean_reward'] * 4
+    assert steps.tolist() == [0, 1, 2, 3]
+    assert values.tolist() == [1.5, -2.25, 3.5, 1e10 + 0.5]
@@ -0,0 +1,110 @@
+import gymnasium as gym
+import numpy as np
+import src # Registers the environment
+from src.field import FieldSpec
+from src.field_pool import build_field_pool, load_field_pool
+from src.recorder import load_npy_frames
+from src.trajectory import Trajectory, TrajectoryWriter
+from src.utils import load_experiment
+
+# Field of set1 with 12 weeds, more than the 'decimal' observation mode supports
+def many_weeds_config():
+    env_config = load_experiment('experiments/set1.yaml')
+    del env_config['field_spec']
+    env_config['infected_locations'] = env_config['infected_locations'] + [(20, 20), (21, 22), (24, 26), (28, 24), (30, 22), (18, 30)]
+    env_config['field_spec'] = FieldSpec.from_config(env_config)
+    return env_config
+
+# Logs episodes with random actions
+def log_episodes(path, env_config, obs_mode, action_mode, episodes=2, steps=30):
+    env = gym.make('MultiAgentGridworld-v1', env_config=env_config, obs_mode=obs_mode, action_mode=action_mode)
+    with TrajectoryWriter(path, env_config, obs_mode, action_mode) as writer:
+        for episode in range(episodes):
+            env.reset(seed=episode)
+            env.action_space.seed(episode)
+            writer.begin(env, seed=episode)
+            for _ in range(steps):
+                action = env.action_space.sample()
+                _, reward, terminated, truncated, _ = env.step(action)
+                writer.step(env, action, reward)
+                if terminated:
+                    break
+            writer.end(terminated, truncated)
+    env.close()
+
+# Replays rebuild the environment with the logged observation and action modes, so logs of fields with more than 10
+# weeds replay, and every logged state can be restored
+def test_replay_uses_logged_modes(tmp_path):
+    log_episodes(str(tmp_path), many_weeds_config(), 'bits', 'multidiscrete')
+    trajectory = Trajectory(str(tmp_path))
+    assert (trajectory.obs_mode, trajectory.action_mode) == ('bits', 'multidiscrete')
+    assert trajectory.meta['num_weeds'] == 12
+
+    env = gym.make('MultiAgentGridworld-v1', env_config=trajectory.env_config, obs_mode=trajectory.obs_mode, action_mode=trajectory.action_mode)
+    env.reset()
+    columns = trajectory.episode(1)
+    targets = Trajectory.targets(columns)
+    for t in range(len(columns['rewards'])):
+        obs, _ = env.unwrapped.set_state(columns['positions'][t], columns['weeds'][t], targets[:t], t)
+        assert obs[-12:].tolist() == columns['weeds'][t].tolist()
+        assert env.unwrapped.agent_positions.tolist() == columns['positions'][t].tolist()
+
+# Logs written before the modes were recorded replay with 'bits' observations
+def test_old_logs_replay_with_bits(tmp_path):
+    log_episodes(str(tmp_path), load_experiment('experiments/set1.yaml'), 'decimal', 'discrete', episodes=1)
+    trajectory = Trajectory(str(tmp_path))
+    assert trajectory.obs_mode == 'decimal'
+    del trajectory.meta['obs_mode'], trajectory.meta['action_mode']
+    assert (trajectory.obs_mode, trajectory.action_mode) == ('bits', 'discrete')
+
+# Episodes logged on a field pool record their own field, and replay on it with one weed entry per weed of the field
+def test_pool_episodes_replay_on_their_field(tmp_path):
+    build_field_pool(['experiments/set1.yaml', 'experiments/set2.yaml'], str(tmp_path / 'pool'))
+    pool_config = load_field_pool(str(tmp_path / 'pool'))
+    env = gym.make('MultiAgentGridworld-v1', env_config=pool_config, obs_mode='bits', action_mode='multidiscrete')
+    fields = [1, 0, 1]
+    with TrajectoryWriter(str(tmp_path / 'log'), pool_config, 'bits', 'multidiscrete') as writer:
+        for seed, field in enumerate(fields):
+            env.reset(seed=seed, options={'field': field})
+            env.action_space.seed(seed)
+            writer.begin(env, seed=seed)
+            for _ in range(40):
+                action = env.action_space.sample()
+                _, reward, terminated, truncated, _ = env.step(action)
+                writer.step(env, action, reward)
+            writer.end(terminated, truncated)
+
+    trajectory = Trajectory(str(tmp_path / 'log'))
+    for index, field in enumerate(fields):
+        experiment = load_experiment(f'experiments/set{field + 1}.yaml')
+        config = trajectory.episode_config(index)
+        assert trajectory.episodes[index]['field'] == field
+        assert config['field'] == experiment['field'] and config['infected_locations'] == experiment['infected_locations']
+        columns = trajectory.episode(index)
+        assert columns['weeds'].shape == (41, len(experiment['infected_locations']))
+
+        replay_env = gym.make('MultiAgentGridworld-v1', env_config=config, obs_mode=trajectory.obs_mode, action_mode=trajectory.action_mode)
+        replay_env.reset()
+        targets = Trajectory.targets(columns)
+        for t in range(len(columns['rewards'])):
+            obs, _ = replay_env.unwrapped.set_state(columns['positions'][t], columns['weeds'][t], targets[:t], t)
+            assert obs[replay_env.unwrapped.num_agents:].tolist() == columns['weeds'][t].tolist()
+
+# run.py replays a pool log into a recording, switching fields between episodes
+def test_replay_pool_log_to_recording(tmp_path):
+    import argparse
+    from run import replay
+    build_field_pool(['experiments/set1.yaml', 'experiments/set2.yaml'], str(tmp_path / 'pool'))
+    pool_config = load_field_pool(str(tmp_path / 'pool'))
+    env = gym.make('MultiAgentGridworld-v1', env_config=pool_config, obs_mode='bits')
+    with TrajectoryWriter(str(tmp_path / 'log'), pool_config, 'bits') as writer:
+        for field in [0, 1]:
+            env.reset(seed=field, options={'field': field})
+            writer.begin(env)
+            for _ in range(5):
+                _, reward, terminated, truncated, _ = env.step(0)
+                writer.step(env, 0, reward)
+            writer.end(terminated, truncated)
+    args = argparse.Namespace(replay=str(tmp_path / 'log'), record=str(tmp_path / 'frames'), fps=30, speed=1.0, episode=None, start=0, simulate=False)
+    replay(args)
+    assert sum(len(chunk) for chunk in load_npy_frames(str(tmp_path / 'frames'))) == 12
@@ -0,0 +1,85 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+import optuna
+import pytest
+from filelock import FileLock
+from stable_baselines3 import A2C
+from src.utils import load_experiment
+from src.vec_env import make_env
+from tune import TrialEvalCallback, make_storage, save_if_best
+
+optuna.logging.set_verbosity(optuna.logging.WARNING)
+
+def make_model():
+    env = make_env(load_experiment('experiments/set1.yaml'), 1, 0, 'batched')
+    return A2C('MlpPolicy', env, n_steps=5, seed=0)
+
+# A trial the pruner stops ends training at its first evaluation, one that is never pruned trains for every step
+# and reports each evaluation
+@pytest.mark.parametrize('pruner, pruned', [(optuna.pruners.ThresholdPruner(lower=1e9), True), (optuna.pruners.NopPruner(), False)])
+def test_trial_pruning(pruner, pruned):
+    trial = optuna.create_study(direction='maximize', pruner=pruner).ask()
+    model = make_model()
+    eval_env = make_env(load_experiment('experiments/set1.yaml'), 1, 1, 'batched')
+    eval_callback = TrialEvalCallback(eval_env, trial, 1, 50)
+    model.learn(total_timesteps=150, callback=eval_callback)
+    eval_env.close()
+    assert eval_callback.is_pruned == pruned
+    if pruned:
+        assert model.num_timesteps == 50
+        assert list(trial.storage.get_trial(trial._trial_id).intermediate_values) == [50]
+    else:
+        assert model.num_timesteps == 150
+        assert list(trial.storage.get_trial(trial._trial_id).intermediate_values) == [50, 100, 150]
+
+# The best model is only saved while holding the lock, and only when it beats the best reward of the study
+def test_save_if_best_waits_for_lock(tmp_path):
+    study = optuna.create_study(direction='maximize')
+    trial = study.ask()
+    path = str(tmp_path / 'A2C_set1.zip')
+    lock_path = str(tmp_path / 'study.lock')
+    model = make_model()
+
+    saved = []
+    with FileLock(lock_path): # Another worker is saving its model
+        saver = threading.Thread(target=lambda: saved.append(save_if_best(model, 10.0, trial, study, FileLock(lock_path), path)))
+        saver.start()
+        time.sleep(0.5)
+        assert saver.is_alive() and not os.path.exists(path)
+    saver.join()
+    assert saved == [True] and os.path.exists(path)
+    assert not os.path.exists(str(tmp_path / 'A2C_set1.tmp.zip'))
+    assert study.user_attrs == {'best_reward': 10.0, 'best_trial': trial.number}
+
+    modified = os.path.getmtime(path)
+    assert not save_if_best(model, 5.0, study.ask(), study, FileLock(lock_path), path)
+    assert os.path.getmtime(path) == modified and study.user_attrs['best_reward'] == 10.0
+
+# Runs tune.py in a directory of its own, so that its studies, logs and models stay out of the repository
+def run_tune(directory, trials):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if not os.path.exists(os.path.join(directory, 'experiments')):
+        os.symlink(os.path.join(root, 'experiments'), os.path.join(directory, 'experiments'))
+    command = [sys.executable, os.path.join(root, 'tune.py'), '--algorithm', 'A2C', '--set', '1', '--trials', str(trials), '--steps', '20',
+               '--num_envs', '1', '--num_eval_eps', '1', '--seed', '0', '--storage', 'tuning_studies/A2C_set1.log']
+    result = subprocess.run(command, cwd=directory, check=True, capture_output=True, text=True)
+    assert 'to acquire the lock file' not in result.stderr # The journal lock is only held while writing
+    return result.stdout
+
+# A second tune.py process on the same journal file continues the study of the first one instead of starting over
+def test_study_resumes_from_journal(tmp_path):
+    directory = str(tmp_path)
+    stdout = run_tune(directory, 1)
+    assert 'Study A2C_set1 in tuning_studies/A2C_set1.log: 0 of 1 trials finished' in stdout
+
+    stdout = run_tune(directory, 2)
+    assert 'Study A2C_set1 in tuning_studies/A2C_set1.log: 1 of 2 trials finished' in stdout
+    study = optuna.load_study(study_name='A2C_set1', storage=make_storage(os.path.join(directory, 'tuning_studies/A2C_set1.log')))
+    trials = study.get_trials(deepcopy=False)
+    assert [trial.number for trial in trials] == [0, 1]
+    assert all(trial.state == optuna.trial.TrialState.COMPLETE for trial in trials)
+    assert study.user_attrs['best_reward'] == study.best_value
+    assert os.path.exists(os.path.join(directory, 'tuned_models/A2C_set1.zip'))
@@ -0,0 +1,93 @@
+import gymnasium as gym
+import numpy as np
+import pytest
+import src
+from src.utils import load_experiment
+from src.vec_env import BatchedGridworldVecEnv, make_env
+
+@pytest.fixture
+def env_config():
+    return load_experiment('experiments/set1.yaml')
+
+# Frames of the batched environment match those of the gym environment after the same actions
+def test_batched_get_images_match_gym_env(env_config):
+    vec_env = BatchedGridworldVecEnv(env_config, 2, render_mode='rgb_array')
+    envs = [gym.make('MultiAgentGridworld-v1', render_mode='rgb_array', env_config=env_config) for _ in range(2)]
+    vec_env.reset()
+    for env in envs:
+        env.reset()
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        actions = rng.integers(0, vec_env.action_space.n, size=2)
+        _, _, dones, _ = vec_env.step(actions)
+        if dones.any():
+            break
+        for env, action in zip(envs, actions):
+            env.step(action)
+    for image, env in zip(vec_env.get_images(), envs):
+        np.testing.assert_array_equal(image, env.render())
+    assert vec_env.render().ndim == 3
+
+# The batched environment steps like DummyVecEnv over gym environments given the same actions, through terminations,
+# truncations and auto-resets. The agents of the last environments mostly stay in place, so that their episodes reach
+# the time limit
+@pytest.mark.parametrize('experiment_set, seed, obs_mode, action_mode', [
+    (1, 0, 'decimal', 'discrete'),
+    (3, 1, 'bits', 'discrete'),
+    (9, 2, 'decimal', 'multidiscrete'),
+    (10, 3, 'bits', 'multidiscrete'),
+])
+def test_batched_matches_dummy_vec_env(experiment_set, seed, obs_mode, action_mode):
+    env_config = load_experiment(f'experiments/set{experiment_set}.yaml')
+    num_envs = 4
+    batched = make_env(env_config, num_envs, seed, 'batched', obs_mode, action_mode)
+    dummy = make_env(env_config, num_envs, seed, 'dummy', obs_mode, action_mode)
+    np.testing.assert_array_equal(batched.reset(), dummy.reset())
+    rng = np.random.default_rng(seed)
+    move_probabilities = [1.0, 0.3, 0.01, 0.01]
+    num_agents = len(env_config['init_positions'])
+    stay = 5 ** num_agents - 1 if action_mode == 'discrete' else np.full(num_agents, 4)
+    finished = {'terminated': 0, 'truncated': 0}
+    for _ in range(4100):
+        actions = np.array([batched.action_space.sample() if rng.random() < p else stay for p in move_probabilities])
+        batched_obs, batched_rewards, batched_dones, batched_infos = batched.step(actions)
+        dummy_obs, dummy_rewards, dummy_dones, dummy_infos = dummy.step(actions)
+        np.testing.assert_array_equal(batched_obs, dummy_obs)
+        np.testing.assert_array_equal(batched_rewards, dummy_rewards)
+        np.testing.assert_array_equal(batched_dones, dummy_dones)
+        for batched_info, dummy_info, done in zip(batched_infos, dummy_infos, batched_dones):
+            if done:
+                np.testing.assert_array_equal(batched_info['terminal_observation'], dummy_info['terminal_observation'])
+                assert batched_info['TimeLimit.truncated'] == dummy_info.get('TimeLimit.truncated', False)
+                assert batched_info['episode']['r'] == dummy_info['episode']['r']
+                assert batched_info['episode']['l'] == dummy_info['episode']['l']
+                finished['truncated' if batched_info['TimeLimit.truncated'] else 'terminated'] += 1
+    assert finished['terminated'] > 0 and finished['truncated'] > 0
+    batched.close()
+    dummy.close()
+
+def test_batched_rejects_human_render_mode(env_config):
+    with pytest.raises(ValueError):
+        BatchedGridworldVecEnv(env_config, 2, render_mode='human')
+
+def test_batched_set_attr_indices(env_config):
+    vec_env = BatchedGridworldVecEnv(env_config, 3)
+    vec_env.set_attr('max_episode_steps', 10)
+    vec_env.set_attr('max_episode_steps', 20, indices=[2, 1, 0])
+    assert vec_env.get_attr('max_episode_steps') == [20, 20, 20]
+    with pytest.raises(ValueError):
+        vec_env.set_attr('max_episode_steps', 30, indices=[1])
+    assert vec_env.max_episode_steps == 20
+
+# Only the shared memory workers' environments in indices are changed or have the method called
+def test_shm_indices(env_config):
+    from src.vec_env import SharedMemoryVecEnv
+    vec_env = SharedMemoryVecEnv(env_config, 3, num_workers=2)
+    try:
+        vec_env.reset()
+        vec_env.set_attr('tag', 0)
+        vec_env.set_attr('tag', 7, indices=[1])
+        assert vec_env.get_attr('tag') == [0, 7, 0]
+        assert [state['step_count'] for state in vec_env.env_method('get_state', indices=[2])] == [0]
+    finally:
+        vec_env.close()
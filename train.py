@@ -3,9 +3,11 @@ import argparse
 from datetime import datetime
 from stable_baselines3 import A2C, PPO, DQN
 from sb3_contrib import TRPO, ARS, RecurrentPPO
-from stable_baselines3.common.env_util import make_vec_env
-from stable_baselines3.common.callbacks import LogEveryNTimesteps
-from src.utils import load_experiment, load_model, parse_bool
+from stable_baselines3.common.callbacks import CallbackList, LogEveryNTimesteps
+from src.checkpoint import BackgroundCheckpointCallback, clear_run, completed_run, latest_checkpoint, load_checkpoint, mark_completed
+from src.field_pool import load_field_pool
+from src.utils import load_experiment, load_model, parse_bool, get_algorithm, set_model_modes
+from src.vec_env import make_env
 
 if __name__ == "__main__":
 
@@ -13,31 +15,67 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
 
     parser.add_argument('--algorithm', type=str, required=True, choices=['A2C', 'PPO', 'TRPO', 'DQN', 'ARS', 'RecurrentPPO'], help='The DRL algorithm to use')
-    parser.add_argument('--set', required=True, type=int, help='The experiment set to use, from the sets defined in the experiments directory')
+    parser.add_argument('--set', type=int, help='The experiment set to use, from the sets defined in the experiments directory. Required unless --pool is given')
+    parser.add_argument('--pool', type=str, default=None, help='The field pool to train on instead of a single set, built with build_field_pool.py. A field of the pool is sampled for each episode')
     parser.add_argument('--verbose', type=int, choices=[0, 1, 2], default=0, help='The verbosity level: 0 no output, 1 info, 2 debug')
     parser.add_argument('--steps', type=int, default=1_000_000, help='The amount of steps to train the DRL model for')
     parser.add_argument('--num_envs', type=int, default=4, help='The number of parallel environments to run')
+    parser.add_argument('--vec_env', type=str, choices=['dummy', 'subproc', 'shm', 'batched'], default='dummy', help='The vectorized environment to use: dummy steps one gym environment at a time, subproc runs each environment in its own process, shm runs core-pinned workers that share observations through shared memory, batched steps all environments in one NumPy call')
+    parser.add_argument('--obs_mode', type=str, choices=['decimal', 'bits'], default='decimal', help='How collected weeds are observed: decimal encodes them as one number (at most 10 weeds), bits uses one entry per weed')
+    parser.add_argument('--action_mode', type=str, choices=['discrete', 'multidiscrete'], default='discrete', help='How actions are given: discrete encodes the movements of all agents as one number, multidiscrete takes one movement per agent')
     parser.add_argument('--seed', type=int, default=None, help='The random seed to use')
     parser.add_argument('--log_steps', type=int, default=2000, help='The number of steps between each log entry')
-    parser.add_argument('--resume', type=parse_bool, default=False, help='If true, loads an existing model to resume training. If false, trains a new model')
+    parser.add_argument('--resume', type=parse_bool, default=False, help='If true, resumes an unfinished run from its latest checkpoint, or else trains the model in trained_models for --steps more steps, or else a new model. If false, trains a new model')
+    parser.add_argument('--skip_completed', type=parse_bool, default=False, help='If true, does nothing if the run already finished, e.g. when a Slurm job is resubmitted')
+    parser.add_argument('--run_name', type=str, default=None, help='The name of the model, its checkpoint subdirectory and TensorBoard run, defaults to [algorithm]_set[set] or [algorithm]_pool_[pool name]')
+    parser.add_argument('--checkpoint_dir', type=str, default='checkpoints', help='The directory to save checkpoints in, each run uses its own subdirectory')
+    parser.add_argument('--checkpoint_steps', type=int, default=100_000, help='The number of steps between checkpoints, 0 for none')
+    parser.add_argument('--checkpoint_minutes', type=float, default=30, help='The number of minutes between checkpoints, 0 for none')
+    parser.add_argument('--checkpoint_keep', type=int, default=2, help='The number of newest checkpoints to keep, 0 to keep all')
+    parser.add_argument('--save_replay_buffer', type=parse_bool, default=False, help='If true, checkpoints include the replay buffer of DQN')
     parser.add_argument('--device', type=str, choices=['cpu', 'cuda'], default='cpu', help='The device to train on')
     
     args = parser.parse_args()
     print(args)
+    if args.set is None and args.pool is None:
+        parser.error('--set is required unless --pool is given')
     
-    # Configure environment
-    env_config = load_experiment(f'experiments/set{args.set}.yaml')
-    vec_env = make_vec_env('ThreeAgentGridworld-v1', env_kwargs={'env_config': env_config, 'seed': args.seed}, n_envs=args.num_envs)
-    vec_env.seed(seed=args.seed)
-    vec_env.action_space.seed(seed=args.seed)
+    # Configure environment, models trained on a pool are named after it
+    if args.pool is not None:
+        env_config = load_field_pool(args.pool)
+        run_name = f'{args.algorithm}_pool_{os.path.basename(os.path.normpath(args.pool))}'
+    else:
+        env_config = load_experiment(f'experiments/set{args.set}.yaml')
+        run_name = f'{args.algorithm}_set{args.set}'
+    run_name = args.run_name or run_name
+
+    # A finished run is not trained again with --skip_completed, e.g. by a resubmitted Slurm job
+    checkpoint_dir = os.path.join(args.checkpoint_dir, run_name)
+    completed = completed_run(checkpoint_dir)
+    if completed is not None and args.skip_completed:
+        print(f"{run_name} already finished at step {completed['steps']} on {completed['finished_on']}, its model is {completed['model']}. Run without --skip_completed to train it again")
+        raise SystemExit
+    vec_env = make_env(env_config, args.num_envs, args.seed, args.vec_env, args.obs_mode, args.action_mode)
     
     os.makedirs('training_logs', exist_ok=True)
 
-    # Configure model
-    if args.resume:
-        model = load_model(args.algorithm, args.set, args.seed, args.device, 'trained_models', args.verbose, 'training_logs')
+    # Configure model. An unfinished run is resumed from its latest checkpoint up to the step count it was started
+    # with, otherwise the trained model is trained for --steps more steps
+    checkpoint = latest_checkpoint(checkpoint_dir) if args.resume and completed is None else None
+    model_path = f'trained_models/{run_name}.zip'
+    if checkpoint is not None:
+        model = load_checkpoint(checkpoint, get_algorithm(args.algorithm), vec_env, args.device, args.verbose, './training_logs')
+        target_steps = checkpoint.get('target_steps') or args.steps # Checkpoints without it count from a new model
+        print(f'Resuming from the checkpoint at step {model.num_timesteps}, {max(target_steps - model.num_timesteps, 0)} steps left')
+    elif args.resume and os.path.exists(model_path):
+        model = load_model(args.algorithm, args.set, args.seed, args.device, 'trained_models', args.verbose, './training_logs', run_name)
         model.set_env(vec_env)
+        target_steps = model.num_timesteps + args.steps
+        print(f'Training {model_path} from step {model.num_timesteps} for {args.steps} more steps')
     else:
+        if args.resume:
+            print(f'No checkpoint or {model_path} to resume from, training a new model')
+        target_steps = args.steps
         model_args = {
             'policy': 'MlpLstmPolicy' if args.algorithm == 'RecurrentPPO' else 'MlpPolicy',
             'env': vec_env,
@@ -59,18 +97,29 @@ if __name__ == "__main__":
             model = ARS(**model_args)
         else:
             model = RecurrentPPO(**model_args)
+    set_model_modes(model, args.obs_mode, args.action_mode) # Saved with the checkpoints and the trained model
 
     # Train model
     start_time = datetime.now()
     print(f'Training started on {start_time.ctime()}')
     logger = LogEveryNTimesteps(n_steps=args.log_steps)
-    model.learn(total_timesteps=args.steps, callback=logger, log_interval=None, tb_log_name=f"{args.algorithm}_set{args.set}", reset_num_timesteps=False)
+    checkpoint_callback = BackgroundCheckpointCallback(checkpoint_dir, run_name, args.checkpoint_steps, args.checkpoint_minutes, args.checkpoint_keep, args.save_replay_buffer, args.verbose, target_steps)
+    checkpoint_callback.install_signal_handlers()
+    if checkpoint is None:
+        clear_run(checkpoint_dir) # Checkpoints of older runs are not resumed
+    model.learn(total_timesteps=max(target_steps - model.num_timesteps, 0), callback=CallbackList([logger, checkpoint_callback]), log_interval=None, tb_log_name=run_name, reset_num_timesteps=False)
     end_time = datetime.now()
     print(f'Training ended on {end_time.ctime()}')
     print(f'Training lasted {end_time - start_time}')
+
+    # A stopped run is not saved as a trained model, it is resumed from its final checkpoint with --resume True
+    if checkpoint_callback.interrupted:
+        vec_env.close()
+        raise SystemExit(f'Training stopped at step {model.num_timesteps}, resume it with --resume True')
     
-    # Save model
+    # Save model, and mark the run as finished so that its checkpoints are not resumed
     os.makedirs('trained_models', exist_ok=True)
-    model.save(f'trained_models/{args.algorithm}_set{args.set}.zip')
+    model.save(model_path)
+    mark_completed(checkpoint_dir, model.num_timesteps, model_path)
 
     vec_env.close()
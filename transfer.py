@@ -1,9 +1,10 @@
 import os
 import argparse
 from datetime import datetime
-from stable_baselines3.common.env_util import make_vec_env
-from stable_baselines3.common.callbacks import LogEveryNTimesteps
-from src.utils import load_experiment, load_model
+from stable_baselines3.common.callbacks import CallbackList, LogEveryNTimesteps
+from src.checkpoint import BackgroundCheckpointCallback, clear_run, completed_run, latest_checkpoint, load_checkpoint, mark_completed
+from src.utils import load_experiment, load_model, parse_bool, get_algorithm, set_model_modes
+from src.vec_env import make_env
 
 if __name__ == '__main__':
 
@@ -16,9 +17,20 @@ if __name__ == '__main__':
     parser.add_argument('--verbose', type=int, choices=[0, 1, 2], default=0, help='The verbosity level: 0 no output, 1 info, 2 debug')
     parser.add_argument('--steps', type=int, default=1_000_000, help='The amount of steps to train the DRL model for while tuning')
     parser.add_argument('--num_envs', type=int, default=4, help='The number of parallel environments to run')
+    parser.add_argument('--vec_env', type=str, choices=['dummy', 'subproc', 'shm', 'batched'], default='dummy', help='The vectorized environment to use: dummy steps one gym environment at a time, subproc runs each environment in its own process, shm runs core-pinned workers that share observations through shared memory, batched steps all environments in one NumPy call')
+    parser.add_argument('--obs_mode', type=str, choices=['decimal', 'bits'], default='decimal', help='How collected weeds are observed: decimal encodes them as one number (at most 10 weeds), bits uses one entry per weed')
+    parser.add_argument('--action_mode', type=str, choices=['discrete', 'multidiscrete'], default='discrete', help='How actions are given: discrete encodes the movements of all agents as one number, multidiscrete takes one movement per agent')
     parser.add_argument('--seed', type=int, default=None, help='The random seed to use')
     parser.add_argument('--log_steps', type=int, default=2000, help='The number of steps between each log entry')
     parser.add_argument('--device', type=str, choices=['cpu', 'cuda'], default='cpu', help='The device to tune on')
+    parser.add_argument('--resume', type=parse_bool, default=False, help='If true, resumes an unfinished transfer learning run from its latest checkpoint if there is one')
+    parser.add_argument('--skip_completed', type=parse_bool, default=False, help='If true, does nothing if the run already finished, e.g. when a Slurm job is resubmitted')
+    parser.add_argument('--run_name', type=str, default=None, help='The name of the transferred model, its checkpoint subdirectory and TensorBoard run, defaults to [algorithm]_from[load set]_to[train set]')
+    parser.add_argument('--checkpoint_dir', type=str, default='checkpoints', help='The directory to save checkpoints in, each run uses its own subdirectory')
+    parser.add_argument('--checkpoint_steps', type=int, default=100_000, help='The number of steps between checkpoints, 0 for none')
+    parser.add_argument('--checkpoint_minutes', type=float, default=30, help='The number of minutes between checkpoints, 0 for none')
+    parser.add_argument('--checkpoint_keep', type=int, default=2, help='The number of newest checkpoints to keep, 0 to keep all')
+    parser.add_argument('--save_replay_buffer', type=parse_bool, default=False, help='If true, checkpoints include the replay buffer of DQN')
 
     args = parser.parse_args()
     print(args)
@@ -27,28 +39,55 @@ if __name__ == '__main__':
     if args.load_set == args.train_set:
         raise ValueError('load_set and train_set must be different for transfer learning')
 
+    # A finished run is not trained again with --skip_completed, e.g. by a resubmitted Slurm job
+    run_name = args.run_name or f'{args.algorithm}_from{args.load_set}_to{args.train_set}'
+    checkpoint_dir = os.path.join(args.checkpoint_dir, run_name)
+    completed = completed_run(checkpoint_dir)
+    if completed is not None and args.skip_completed:
+        print(f"{run_name} already finished at step {completed['steps']} on {completed['finished_on']}, its model is {completed['model']}. Run without --skip_completed to transfer again")
+        raise SystemExit
+
     # Configure environment
     env_config = load_experiment(f'experiments/set{args.train_set}.yaml')
-    vec_env = make_vec_env('ThreeAgentGridworld-v1', env_kwargs={'env_config': env_config, 'seed': args.seed}, n_envs=args.num_envs)
-    vec_env.seed(seed=args.seed)
-    vec_env.action_space.seed(seed=args.seed)
+    vec_env = make_env(env_config, args.num_envs, args.seed, args.vec_env, args.obs_mode, args.action_mode)
 
     os.makedirs('transfer_logs', exist_ok=True)
 
-    model = load_model(args.algorithm, args.load_set, args.seed, args.device, 'tuned_models', args.verbose, 'transfer_logs')
-    model.set_env(vec_env)
+    # Load the tuned model, or the latest checkpoint of an unfinished run when resuming. Transfer learning counts its
+    # steps from 0, and a resumed run trains up to the step count it was started with
+    checkpoint = latest_checkpoint(checkpoint_dir) if args.resume and completed is None else None
+    if checkpoint is not None:
+        model = load_checkpoint(checkpoint, get_algorithm(args.algorithm), vec_env, args.device, args.verbose, 'transfer_logs')
+        target_steps = checkpoint.get('target_steps') or args.steps
+        steps = max(target_steps - model.num_timesteps, 0)
+        print(f'Resuming from the checkpoint at step {model.num_timesteps}, {steps} steps left')
+    else:
+        model = load_model(args.algorithm, args.load_set, args.seed, args.device, 'tuned_models', args.verbose, 'transfer_logs')
+        model.set_env(vec_env)
+        target_steps = steps = args.steps
+    set_model_modes(model, args.obs_mode, args.action_mode) # Saved with the checkpoints and the transferred model
 
     # Train model
     start_time = datetime.now()
     print(f'Transfer learning started on {start_time.ctime()}')
     logger = LogEveryNTimesteps(n_steps=args.log_steps)
-    model.learn(total_timesteps=args.steps, callback=logger, log_interval=None, tb_log_name=f"{args.algorithm}_from{args.load_set}_to{args.train_set}")
+    checkpoint_callback = BackgroundCheckpointCallback(checkpoint_dir, run_name, args.checkpoint_steps, args.checkpoint_minutes, args.checkpoint_keep, args.save_replay_buffer, args.verbose, target_steps)
+    checkpoint_callback.install_signal_handlers()
+    if checkpoint is None:
+        clear_run(checkpoint_dir) # Checkpoints of older runs are not resumed
+    model.learn(total_timesteps=steps, callback=CallbackList([logger, checkpoint_callback]), log_interval=None, tb_log_name=run_name, reset_num_timesteps=checkpoint is None)
     end_time = datetime.now()
     print(f'Transfer learning ended on {end_time.ctime()}')
     print(f'Transfer learning lasted {end_time - start_time}')
+
+    # A stopped run is not saved as a transferred model, it is resumed from its final checkpoint with --resume True
+    if checkpoint_callback.interrupted:
+        vec_env.close()
+        raise SystemExit(f'Transfer learning stopped at step {model.num_timesteps}, resume it with --resume True')
     
-    # Save model
+    # Save model, and mark the run as finished so that its checkpoints are not resumed
     os.makedirs('transfer_models', exist_ok=True)
-    model.save(f'transfer_models/{args.algorithm}_from{args.load_set}_to{args.train_set}.zip')
+    model.save(f'transfer_models/{run_name}.zip')
+    mark_completed(checkpoint_dir, model.num_timesteps, f'transfer_models/{run_name}.zip')
 
     vec_env.close()
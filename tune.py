@@ -3,60 +3,92 @@ import os
 import argparse
 import yaml
 import gc
+import multiprocessing as mp
 from datetime import datetime
-from stable_baselines3 import A2C, PPO, DQN
-from sb3_contrib import TRPO, ARS, RecurrentPPO
-from stable_baselines3.common.env_util import make_vec_env
+from filelock import FileLock
+from optuna.storages import JournalStorage, RDBStorage, RetryFailedTrialCallback
+from optuna.storages.journal import JournalFileBackend
+from optuna.study import MaxTrialsCallback
+from optuna.trial import TrialState
 from stable_baselines3.common.evaluation import evaluate_policy
-from stable_baselines3.common.callbacks import LogEveryNTimesteps
-from src.utils import load_experiment, filter_args
-
-if __name__ == '__main__':
-
-    # Parse arguments
-    parser = argparse.ArgumentParser()
-
-    parser.add_argument('--algorithm', type=str, required=True, choices=['A2C', 'PPO', 'TRPO', 'DQN', 'ARS', 'RecurrentPPO'], help='The DRL algorithm to use')
-    parser.add_argument('--set', required=True, type=int, help='The experiment set to use, from the sets defined in the experiments directory')
-    parser.add_argument('--trials', type=int, default=20, help='The number of trials used for tuning')
-    parser.add_argument('--steps', type=int, default=1_000_000, help='The amount of steps to train the DRL model for while tuning')
-    parser.add_argument('--num_envs', type=int, default=4, help='The number of parallel environments to run')
-    parser.add_argument('--num_eval_eps', type=int, default=10, help='The number of episodes for evaluating a trial')
-    parser.add_argument('--seed', type=int, default=None, help='The random seed to use')
-    parser.add_argument('--log_steps', type=int, default=2000, help='The number of steps between each log entry')
-    parser.add_argument('--device', type=str, choices=['cpu', 'cuda'], default='cpu', help='The device to tune on')
-
-    args = parser.parse_args()
-    print(args)
-
-    os.makedirs('tuning_logs', exist_ok=True)
-    os.makedirs('tuned_models', exist_ok=True)
-
-    if args.algorithm == 'A2C':
-        model_type = A2C
-    elif args.algorithm == 'PPO':
-        model_type = PPO
-    elif args.algorithm == 'TRPO':
-        model_type = TRPO
-    elif args.algorithm == 'DQN':
-        model_type = DQN
-    elif args.algorithm == 'ARS':
-        model_type = ARS
-    else:
-        model_type = RecurrentPPO
-    
-    mean_rewards = []
-    best_reward = -1e10
+from stable_baselines3.common.callbacks import CallbackList, EvalCallback, LogEveryNTimesteps
+from src.utils import load_experiment, filter_args, get_algorithm, set_model_modes
+from src.vec_env import make_env
+
+# Opens the storage of a study: a SQLite database for .db files, with heartbeats so that trials of crashed or
+# preempted workers are failed and retried, or an append-only journal file for any other path
+def make_storage(path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    if path.endswith('.db'):
+        return RDBStorage(
+            f'sqlite:///{path}',
+            heartbeat_interval=60,
+            grace_period=180,
+            failed_trial_callback=RetryFailedTrialCallback(max_retry=2),
+            engine_kwargs={'connect_args': {'timeout': 60}}, # Wait for the writes of other workers
+        )
+    return JournalStorage(JournalFileBackend(path))
+
+# Makes the pruner that stops unpromising trials, based on the rewards reported during training. Resources are
+# counted in training steps
+def make_pruner(args):
+    if args.pruner == 'median':
+        return optuna.pruners.MedianPruner(n_startup_trials=5, n_warmup_steps=args.steps // 10)
+    elif args.pruner == 'halving':
+        return optuna.pruners.SuccessiveHalvingPruner(min_resource=args.eval_freq, reduction_factor=3)
+    elif args.pruner == 'hyperband':
+        return optuna.pruners.HyperbandPruner(min_resource=args.eval_freq, max_resource=args.steps, reduction_factor=3)
+    return optuna.pruners.NopPruner()
+
+# Evaluates the policy every eval_freq calls during training and reports the mean reward to the trial. Training
+# stops as soon as the pruner decides that the trial is not promising
+class TrialEvalCallback(EvalCallback):
+    def __init__(self, eval_env, trial, n_eval_episodes, eval_freq):
+        super().__init__(eval_env, n_eval_episodes=n_eval_episodes, eval_freq=eval_freq, deterministic=True, verbose=0)
+        self.trial = trial
+        self.is_pruned = False
+
+    def _on_step(self):
+        if self.eval_freq > 0 and self.n_calls % self.eval_freq == 0:
+            super()._on_step()
+            self.trial.report(self.last_mean_reward, self.num_timesteps)
+            if self.trial.should_prune():
+                self.is_pruned = True
+                return False
+        return True
+
+# Saves the model of a trial if it beats the best reward of the study. The best reward is kept in the study, so that
+# every worker compares against the same value. The lock keeps two workers from replacing the saved model at the same
+# time, and the model is written to a temporary file first, so that the saved model is never half written
+def save_if_best(model, mean_reward, trial, study, lock, path):
+    with lock:
+        if study.user_attrs.get('best_reward', -1e10) >= mean_reward:
+            return False
+        model.save(path[:-len('.zip')] + '.tmp.zip')
+        os.replace(path[:-len('.zip')] + '.tmp.zip', path)
+        study.set_user_attr('best_reward', mean_reward)
+        study.set_user_attr('best_trial', trial.number)
+        return True
+
+# Runs trials of the shared study until it has enough finished trials. Several workers, in this process or others,
+# can run this at the same time
+def run_worker(args, worker=0):
+    # Give each worker its own cores, so that core-pinned environments of different workers do not overlap
+    if args.workers > 1 and hasattr(os, 'sched_setaffinity'):
+        cores = sorted(os.sched_getaffinity(0))
+        worker_cores = cores[worker::args.workers] or cores
+        os.sched_setaffinity(0, worker_cores)
+
+    model_type = get_algorithm(args.algorithm)
+    study = optuna.load_study(study_name=args.study_name, storage=make_storage(args.storage), pruner=make_pruner(args))
+    lock = FileLock(f'tuned_models/{args.study_name}.lock') # Not the storage path, journal files take {path}.lock themselves
 
     # Objective function for optimization
     def objective(trial):
-        global best_reward
 
         # Configure environment
         env_config = load_experiment(f'experiments/set{args.set}.yaml')
-        vec_env = make_vec_env('ThreeAgentGridworld-v1', env_kwargs={'env_config': env_config, 'seed': args.seed}, n_envs=args.num_envs)
-        vec_env.seed(seed=args.seed)
-        vec_env.action_space.seed(seed=args.seed)
+        vec_env = make_env(env_config, args.num_envs, args.seed, args.vec_env, args.obs_mode, args.action_mode)
 
         # Base model args
         model_args = {
@@ -75,20 +107,37 @@ if __name__ == '__main__':
 
         # Configure model
         filtered_args = filter_args(model_args, model_type)
-        model = model_type(**filtered_args)
+        model = set_model_modes(model_type(**filtered_args), args.obs_mode, args.action_mode)
 
-        # Train model
+        # Train model. With a pruner, it is evaluated every eval_freq steps in an environment stepped in this process,
+        # so that the evaluations do not start a second set of worker processes
         logger = LogEveryNTimesteps(n_steps=args.log_steps)
-        model.learn(total_timesteps=args.steps, callback=logger, log_interval=None, tb_log_name=f"{args.algorithm}_set{args.set}_{trial.number}")
+        callbacks, eval_callback = [logger], None
+        if args.pruner != 'none':
+            eval_env = make_env(env_config, min(args.num_envs, args.num_eval_eps), args.seed, 'batched', args.obs_mode, args.action_mode)
+            eval_callback = TrialEvalCallback(eval_env, trial, args.num_eval_eps, max(args.eval_freq // args.num_envs, 1))
+            callbacks.append(eval_callback)
+        model.learn(total_timesteps=args.steps, callback=CallbackList(callbacks), log_interval=None, tb_log_name=f"{args.study_name}_{trial.number}")
+        if eval_callback is not None:
+            eval_env.close()
         vec_env.reset()
 
+        # Stop pruned trials, logging the training steps they did not need
+        if eval_callback is not None and eval_callback.is_pruned:
+            steps_saved = max(args.steps - model.num_timesteps, 0)
+            trial.set_user_attr('pruned_at', model.num_timesteps)
+            trial.set_user_attr('steps_saved', steps_saved)
+            print(f'Trial {trial.number} pruned at step {model.num_timesteps} with mean reward {eval_callback.last_mean_reward}, saving {steps_saved} steps')
+            vec_env.close()
+            del model
+            gc.collect()
+            raise optuna.TrialPruned()
+
         # Evaluate model performance
         mean_reward, _ = evaluate_policy(model, vec_env, n_eval_episodes=args.num_eval_eps, deterministic=True)
-        mean_rewards.append(mean_reward)
+        vec_env.close()
 
-        if best_reward < mean_reward:
-            best_reward = mean_reward
-            model.save(f'tuned_models/{args.algorithm}_set{args.set}.zip')
+        save_if_best(model, mean_reward, trial, study, lock, f'tuned_models/{args.study_name}.zip')
 
         if args.device == 'cpu':
             del model
@@ -101,19 +150,75 @@ if __name__ == '__main__':
             
         return mean_reward
 
-    # Optuna study
+    # Stop once the study has enough finished trials, counting the ones of earlier runs and other workers
+    if len(study.get_trials(deepcopy=False, states=(TrialState.COMPLETE, TrialState.PRUNED))) >= args.trials:
+        return
+    max_trials = MaxTrialsCallback(args.trials, states=(TrialState.COMPLETE, TrialState.PRUNED))
+    study.optimize(objective, callbacks=[max_trials], show_progress_bar=worker == 0)
+
+if __name__ == '__main__':
+
+    # Parse arguments
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--algorithm', type=str, required=True, choices=['A2C', 'PPO', 'TRPO', 'DQN', 'ARS', 'RecurrentPPO'], help='The DRL algorithm to use')
+    parser.add_argument('--set', required=True, type=int, help='The experiment set to use, from the sets defined in the experiments directory')
+    parser.add_argument('--trials', type=int, default=20, help='The number of trials used for tuning, counted over all workers and earlier runs of the study')
+    parser.add_argument('--study_name', type=str, default=None, help='The name of the Optuna study, its tuned model, hyperparameters and TensorBoard runs, defaults to [algorithm]_set[set]')
+    parser.add_argument('--storage', type=str, default=None, help='The file storing the study: a SQLite database for .db files, or a journal file for any other path. Defaults to tuning_studies/[study name].db')
+    parser.add_argument('--workers', type=int, default=1, help='The number of worker processes running trials at the same time, each on its share of the cores')
+    parser.add_argument('--steps', type=int, default=1_000_000, help='The amount of steps to train the DRL model for while tuning')
+    parser.add_argument('--num_envs', type=int, default=4, help='The number of parallel environments to run')
+    parser.add_argument('--vec_env', type=str, choices=['dummy', 'subproc', 'shm', 'batched'], default='dummy', help='The vectorized environment to use: dummy steps one gym environment at a time, subproc runs each environment in its own process, shm runs core-pinned workers that share observations through shared memory, batched steps all environments in one NumPy call')
+    parser.add_argument('--obs_mode', type=str, choices=['decimal', 'bits'], default='decimal', help='How collected weeds are observed: decimal encodes them as one number (at most 10 weeds), bits uses one entry per weed')
+    parser.add_argument('--action_mode', type=str, choices=['discrete', 'multidiscrete'], default='discrete', help='How actions are given: discrete encodes the movements of all agents as one number, multidiscrete takes one movement per agent')
+    parser.add_argument('--num_eval_eps', type=int, default=10, help='The number of episodes for evaluating a trial')
+    parser.add_argument('--eval_freq', type=int, default=50_000, help='The number of training steps between evaluations reported to the pruner')
+    parser.add_argument('--pruner', type=str, choices=['none', 'median', 'halving', 'hyperband'], default='none', help='The pruner that stops unpromising trials early: none (every trial is trained for --steps), median (below the median of earlier trials), halving (successive halving) or hyperband')
+    parser.add_argument('--seed', type=int, default=None, help='The random seed to use')
+    parser.add_argument('--log_steps', type=int, default=2000, help='The number of steps between each log entry')
+    parser.add_argument('--device', type=str, choices=['cpu', 'cuda'], default='cpu', help='The device to tune on')
+
+    args = parser.parse_args()
+    print(args)
+
+    os.makedirs('tuning_logs', exist_ok=True)
+    os.makedirs('tuned_models', exist_ok=True)
+    args.study_name = args.study_name or f'{args.algorithm}_set{args.set}'
+    args.storage = args.storage or f'tuning_studies/{args.study_name}.db'
+
+    # Optuna study, resumed if it already exists
     start_time = datetime.now()
     print(f'Tuning started on {start_time.ctime()}')
-    study = optuna.create_study(direction="maximize")
-    study.optimize(objective, n_trials=args.trials, show_progress_bar=True)
+    study = optuna.create_study(study_name=args.study_name, storage=make_storage(args.storage), pruner=make_pruner(args), direction="maximize", load_if_exists=True)
+    finished = len(study.get_trials(deepcopy=False, states=(TrialState.COMPLETE, TrialState.PRUNED)))
+    print(f'Study {args.study_name} in {args.storage}: {finished} of {args.trials} trials finished')
+
+    # Run the trials, in worker processes if there are several
+    if args.workers > 1:
+        context = mp.get_context('spawn')
+        workers = [context.Process(target=run_worker, args=(args, worker)) for worker in range(args.workers)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    else:
+        run_worker(args)
     end_time = datetime.now()
     print(f'Tuning ended on {end_time.ctime()}')
     print(f'Tuning lasted {end_time - start_time}\n')
 
+    # Pruning statistics
+    study = optuna.load_study(study_name=args.study_name, storage=make_storage(args.storage))
+    trials = study.get_trials(deepcopy=False, states=(TrialState.COMPLETE, TrialState.PRUNED))
+    pruned = [trial for trial in trials if trial.state == TrialState.PRUNED]
+    steps_saved = sum(trial.user_attrs.get('steps_saved', 0) for trial in pruned)
+    print(f'Pruned {len(pruned)} of {len(trials)} trials, saving {steps_saved} of {len(trials) * args.steps} training steps ({steps_saved / max(len(trials) * args.steps, 1):.0%})')
+
     # Best hyperparameters
     os.makedirs('tuned_hyperparameters', exist_ok=True)
-    filtered_params = filter_args(study.best_params, model_type)
-    with open(f'tuned_hyperparameters/{args.algorithm}_set{args.set}.yaml', 'w') as save_file:
+    filtered_params = filter_args(study.best_params, get_algorithm(args.algorithm))
+    with open(f'tuned_hyperparameters/{args.study_name}.yaml', 'w') as save_file:
         yaml.dump(filtered_params, save_file)
     print(f"Best hyperparameters for {args.algorithm}: {filtered_params}")
-    print(f"Best mean reward for {args.algorithm}: {best_reward}")
+    print(f"Best mean reward for {args.algorithm}: {study.user_attrs.get('best_reward')} (trial {study.user_attrs.get('best_trial')})")
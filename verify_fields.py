@@ -0,0 +1,15 @@
+import glob
+from src.field import verify_field_mask
+from src.utils import load_experiment
+
+if __name__ == '__main__':
+
+    # Verify the rasterized field of every experiment against shapely
+    failed = False
+    for path in sorted(glob.glob('experiments/set*.yaml')):
+        config = load_experiment(path)
+        mismatches = verify_field_mask(config['field'], config['grid_size'])
+        print(f'{path}: {"OK" if not mismatches else f"{len(mismatches)} mismatching cells {mismatches[:5]}"}')
+        failed = failed or bool(mismatches)
+    if failed:
+        raise SystemExit(1)